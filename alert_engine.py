@@ -0,0 +1,216 @@
+import json
+import time
+import warnings
+
+import numpy as np
+
+from sqlite3_utils import connection, ensure_schema
+
+# Observation fields alerts can be set on, in column order of the metric arrays.
+# Each is (section, keys tried in order) in an OpenWeather current or forecast
+# entry (metric units); a None section means a top-level key.
+METRICS = {
+    'temp': ('main', ('temp',)),
+    'feels_like': ('main', ('feels_like',)),
+    'humidity': ('main', ('humidity',)),
+    'pressure': ('main', ('pressure',)),
+    'wind_speed': ('wind', ('speed',)),
+    'wind_gust': ('wind', ('gust',)),
+    'clouds': ('clouds', ('all',)),
+    'rain': ('rain', ('1h', '3h')),
+    'snow': ('snow', ('1h', '3h')),
+    'pop': (None, ('pop',)),
+}
+METRIC_INDEX = {name: index for index, name in enumerate(METRICS)}
+
+# Other spellings accepted in weather_alerts.alert_type
+METRIC_ALIASES = {
+    'temperature': 'temp',
+    'wind': 'wind_speed',
+    'gust': 'wind_gust',
+    'precipitation': 'rain',
+}
+
+# How far back past the threshold a value must move before a fired alert clears
+HYSTERESIS = {
+    'temp': 1.0,
+    'feels_like': 1.0,
+    'humidity': 3.0,
+    'pressure': 2.0,
+    'wind_speed': 1.0,
+    'wind_gust': 1.5,
+    'clouds': 5.0,
+    'rain': 0.2,
+    'snow': 0.2,
+    'pop': 0.05,
+}
+
+FIRED = 'fired'
+CLEARED = 'cleared'
+
+
+def parse_alert_type(alert_type):
+    """Split an alert type such as 'temp_above' into (metric, +1 for above / -1 for below)"""
+    name, _, direction = (alert_type or '').strip().lower().rpartition('_')
+    name = METRIC_ALIASES.get(name, name)
+    if name not in METRICS or direction not in ('above', 'below'):
+        return None
+    return name, 1 if direction == 'above' else -1
+
+
+def _column(sections, keys):
+    """One metric across all timesteps as floats, NaN where missing or not numeric"""
+    values = [None] * len(sections)
+    for key in reversed(keys):  # earlier keys win
+        values = [section.get(key, value) if isinstance(section, dict) else value
+                  for section, value in zip(sections, values)]
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([value if isinstance(value, (int, float)) else None for value in values],
+                        dtype=float)
+
+
+def _entries(payload):
+    """Timestep dicts in a current-weather payload, forecast payload or plain list"""
+    if isinstance(payload, dict) and isinstance(payload.get('list'), list):
+        return payload['list']
+    if isinstance(payload, list):
+        return payload
+    return [payload] if isinstance(payload, dict) else []
+
+
+def extract_metrics(payloads):
+    """Return (highs, lows, observed_at) across one location's payloads.
+
+    highs/lows hold the largest and smallest value of each metric over every
+    timestep, NaN where a metric never appears, so 'above' alerts look at the
+    peak and 'below' alerts at the trough.
+    """
+    if isinstance(payloads, dict) or not isinstance(payloads, (list, tuple)):
+        payloads = [payloads]
+    entries = [entry for payload in payloads if payload for entry in _entries(payload)]
+
+    values = np.full((len(entries), len(METRICS)), np.nan)
+    if entries:
+        sections = {}
+        for column, (section, keys) in enumerate(METRICS.values()):
+            if section not in sections:
+                sections[section] = entries if section is None else [entry.get(section) for entry in entries]
+            values[:, column] = _column(sections[section], keys)
+
+    stamps = [entry['dt'] for entry in entries if isinstance(entry.get('dt'), (int, float))]
+    observed_at = float(min(stamps)) if stamps else time.time()
+    if not entries:
+        empty = np.full(len(METRICS), np.nan)
+        return empty, empty, observed_at
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # metrics missing everywhere stay NaN
+        return np.nanmax(values, axis=0), np.nanmin(values, axis=0), observed_at
+
+
+class AlertEngine:
+    """Evaluates weather_alerts thresholds against fresh observations in bulk.
+
+    All active alerts for the affected locations are read with one indexed
+    query, compared in numpy, and only the alerts that change state are
+    written back (weather_alert_states) and logged (weather_alert_events).
+    """
+
+    def __init__(self, db_name='weather_app.db', hysteresis=None):
+        self.db_name = db_name
+        self.hysteresis = dict(HYSTERESIS, **(hysteresis or {}))
+        self._bands = np.array([self.hysteresis.get(name, 0.0) for name in METRICS])
+        ensure_schema(db_name)
+
+    def evaluate(self, observations):
+        """Check alerts for {location_id: payload or [payloads]}.
+
+        Returns {'evaluated': n, 'fired': [...], 'cleared': [...]} where the
+        lists hold (alert_id, location_id, value) for each transition.
+        """
+        result = {'evaluated': 0, 'fired': [], 'cleared': []}
+        if not observations:
+            return result
+
+        observations = {int(location_id): payloads for location_id, payloads in observations.items()}
+        location_ids = np.array(sorted(observations), dtype=np.int64)
+        highs = np.empty((len(location_ids), len(METRICS)))
+        lows = np.empty_like(highs)
+        observed_at = np.empty(len(location_ids))
+        extracted = {}  # locations sharing a cache key share the same payload objects
+        for row, location_id in enumerate(location_ids.tolist()):
+            payloads = observations[location_id]
+            key = tuple(map(id, payloads)) if isinstance(payloads, (list, tuple)) else id(payloads)
+            if key not in extracted:
+                extracted[key] = extract_metrics(payloads)
+            highs[row], lows[row], observed_at[row] = extracted[key]
+
+        with connection(self.db_name) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            c = conn.cursor()
+            c.execute('''SELECT a.id, a.location_id, a.alert_type, a.threshold_value,
+                                COALESCE(s.state, 0)
+                         FROM weather_alerts a
+                         LEFT JOIN weather_alert_states s ON s.alert_id = a.id
+                         WHERE a.is_active = 1
+                           AND a.location_id IN (SELECT value FROM json_each(?))''',
+                      (json.dumps(location_ids.tolist()),))
+            rows = c.fetchall()
+            if not rows:
+                return result
+
+            alert_ids, alert_locations, alert_types, thresholds, states = zip(*rows)
+            alert_ids = np.array(alert_ids, dtype=np.int64)
+            alert_locations = np.array(alert_locations, dtype=np.int64)
+            thresholds = np.array(thresholds, dtype=float)
+            states = np.array(states, dtype=np.int8)
+
+            # Alert types repeat heavily, so parse each distinct one once
+            distinct, type_index = np.unique(np.array(alert_types, dtype=object).astype(str),
+                                             return_inverse=True)
+            parsed = [parse_alert_type(alert_type) for alert_type in distinct]
+            type_metric = np.array([METRIC_INDEX[p[0]] if p else -1 for p in parsed], dtype=np.int64)
+            type_sign = np.array([p[1] if p else 0 for p in parsed], dtype=np.int8)
+            metric = type_metric[type_index]
+            sign = type_sign[type_index]
+
+            row = np.searchsorted(location_ids, alert_locations)
+            known = metric >= 0
+            safe_metric = np.where(known, metric, 0)
+            value = np.where(sign > 0, highs[row, safe_metric], lows[row, safe_metric])
+            value = np.where(known, value, np.nan)
+
+            # Signed distance past the threshold: positive means the alert condition holds
+            with np.errstate(invalid='ignore'):
+                excess = sign * (value - thresholds)
+                fire = (states == 0) & (excess > 0)
+                clear = (states == 1) & (excess < -self._bands[safe_metric])
+
+            when = observed_at[row]
+            now = time.time()
+            transitions = np.flatnonzero(fire | clear)
+            new_state = fire[transitions].astype(int)
+            t_ids = alert_ids[transitions].tolist()
+            t_locations = alert_locations[transitions].tolist()
+            t_values = value[transitions].tolist()
+            t_thresholds = thresholds[transitions].tolist()
+            t_when = when[transitions].tolist()
+            t_events = np.where(new_state == 1, FIRED, CLEARED).tolist()
+
+            c.executemany('''INSERT INTO weather_alert_states (alert_id, state, last_value, changed_at)
+                             VALUES (?, ?, ?, ?)
+                             ON CONFLICT(alert_id) DO UPDATE SET
+                                 state = excluded.state,
+                                 last_value = excluded.last_value,
+                                 changed_at = excluded.changed_at''',
+                          zip(t_ids, new_state.tolist(), t_values, [now] * len(t_ids)))
+            c.executemany('''INSERT OR IGNORE INTO weather_alert_events
+                             (alert_id, location_id, event, value, threshold_value, observed_at)
+                             VALUES (?, ?, ?, ?, ?, ?)''',
+                          zip(t_ids, t_locations, t_events, t_values, t_thresholds, t_when))
+
+        result['evaluated'] = len(alert_ids)
+        for alert_id, location_id, event, alert_value in zip(t_ids, t_locations, t_events, t_values):
+            result[event].append((alert_id, location_id, alert_value))
+        return result
@@ -0,0 +1,551 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite3_utils import WeatherDB, connection, get_pool
+from stub_api import STUB_ROUTES, sample_forecast, start_stubs, stop_stubs
+
+
+def _rate(rows, seconds):
+    return rows / seconds if seconds > 0 else float('inf')
+
+
+def _timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def bench_bulk_writes(rows=2000, chunk_size=500, workdir=None):
+    """Rows/sec for each WeatherDB write, one call per row versus the bulk method.
+
+    Each path runs against its own fresh database file.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='weather-bench-')
+    payload = sample_forecast()
+    queries = [{'location': f'Bench {index}', 'lat': 48.85, 'lon': 2.35, 'weather_data': payload,
+                'notes': '', 'tags': 'bench'} for index in range(rows)]
+    locations = [(f'Place {index}', f'{index} Bench St', 48.85 + index * 1e-4, 2.35) for index in range(rows)]
+
+    results = {}
+    for path in ('per_row', 'bulk'):
+        db = WeatherDB(os.path.join(workdir, f'{path}.db'))
+        if path == 'per_row':
+            query_ids, query_time = _timed(lambda: [db.save_weather_query(**query) for query in queries])
+            location_ids, location_time = _timed(lambda: [db.save_location(*location) for location in locations])
+            alerts = [(location_id, 'temp_above', 30.0) for location_id in location_ids]
+            _, alert_time = _timed(lambda: [db.add_weather_alert(*alert) for alert in alerts])
+            _, delete_time = _timed(lambda: [db.delete_query(query_id) for query_id in query_ids])
+        else:
+            query_ids, query_time = _timed(lambda: db.save_weather_queries(iter(queries), chunk_size))
+            location_ids, location_time = _timed(lambda: db.save_locations(iter(locations), chunk_size))
+            alerts = [(location_id, 'temp_above', 30.0) for location_id in location_ids]
+            _, alert_time = _timed(lambda: db.add_weather_alerts(iter(alerts), chunk_size))
+            _, delete_time = _timed(lambda: db.delete_queries(iter(query_ids), chunk_size))
+        get_pool(db.db_name).close()
+        results[path] = {
+            'save_weather_queries': _rate(rows, query_time),
+            'save_locations': _rate(rows, location_time),
+            'add_weather_alerts': _rate(rows, alert_time),
+            'delete_queries': _rate(rows, delete_time),
+        }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def print_bulk_results(results):
+    print(f"{'operation':<24}{'per-row rows/s':>16}{'bulk rows/s':>14}{'speedup':>10}")
+    for operation, per_row in results['per_row'].items():
+        bulk = results['bulk'][operation]
+        print(f"{operation:<24}{per_row:>16.0f}{bulk:>14.0f}{bulk / per_row:>9.1f}x")
+
+
+RENDER_SCRIPT = '''
+import sys
+sys.path.insert(0, {repo!r})
+from benchmark import sample_forecast
+from weather_app import display_weather
+display_weather(sample_forecast({timesteps}), compact={compact})
+'''
+
+
+def _element_stats(node):
+    """(element count, serialized proto bytes) for an AppTest element tree"""
+    count, size = 0, 0
+    proto = getattr(node, 'proto', None)
+    if proto is not None:
+        count, size = 1, proto.ByteSize()
+    for child in getattr(node, 'children', {}).values():
+        child_count, child_size = _element_stats(child)
+        count += child_count
+        size += child_size
+    return count, size
+
+
+def bench_render(timesteps=40, reruns=5):
+    """Elements, delta bytes and rerun time of display_weather, per-timestep widgets versus compact"""
+    from streamlit.testing.v1 import AppTest
+    
+    repo = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for mode, compact in (('widgets', False), ('compact', True)):
+        app = AppTest.from_string(RENDER_SCRIPT.format(repo=repo, timesteps=timesteps, compact=compact),
+                                  default_timeout=60)
+        app.run()  # first run pays the imports
+        times = []
+        for _ in range(reruns):
+            started = time.perf_counter()
+            app.run()
+            times.append(time.perf_counter() - started)
+        elements, delta_bytes = _element_stats(app._tree)
+        results[mode] = {'elements': elements, 'delta_bytes': delta_bytes,
+                         'rerun_ms': 1000 * sorted(times)[len(times) // 2]}
+    return results
+
+
+def print_render_results(results):
+    print(f"{'mode':<10}{'elements':>10}{'delta bytes':>14}{'rerun ms':>10}")
+    for mode, stats in results.items():
+        print(f"{mode:<10}{stats['elements']:>10}{stats['delta_bytes']:>14}{stats['rerun_ms']:>10.1f}")
+
+
+def percentiles(samples):
+    """count, mean and nearest-rank p50/p95/p99/max of latencies in seconds, as milliseconds"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+
+    def rank(fraction):
+        return 1000 * ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+    return {'count': len(ordered), 'mean_ms': 1000 * sum(ordered) / len(ordered),
+            'p50_ms': rank(0.50), 'p95_ms': rank(0.95), 'p99_ms': rank(0.99), 'max_ms': 1000 * ordered[-1]}
+
+
+def measure(func, args_list, concurrency=1, memory_samples=5, memory_args=None):
+    """Latency percentiles, throughput, failures and peak traced memory of func over args_list.
+
+    Calls that raise or return None count as errors. Timing runs with
+    tracemalloc off; peak memory comes from a separate pass so tracing
+    overhead doesn't skew latencies. That pass repeats the first
+    memory_samples arguments unless memory_args is given; pass throwaway
+    inputs there for calls with side effects, so no live row is written or
+    deleted twice.
+    """
+    args_list = list(args_list)
+
+    def call(args):
+        started = time.perf_counter()
+        try:
+            ok = func(*args) is not None
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(call, args_list))
+    else:
+        outcomes = [call(args) for args in args_list]
+    wall = time.perf_counter() - started
+    errors = sum(1 for _, ok in outcomes if not ok)
+
+    if memory_args is None:
+        memory_args = args_list[:memory_samples]
+    tracemalloc.start()
+    try:
+        for args in memory_args:
+            call(args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    stats = percentiles([latency for latency, _ in outcomes])
+    stats.update({'throughput_per_s': _rate(len(args_list), wall), 'errors': errors,
+                  'peak_memory_bytes': peak})
+    return stats
+
+
+def offline_environment(workdir, client_limits=False, **stub_settings):
+    """Start stub API servers and point the app (its APIs and database) at them.
+
+    Must run before weather_app is first imported. Unless client_limits is
+    set, the HttpClient's per-provider rate limits are lifted so results show
+    the app's own cost rather than the free-tier quotas. Returns the servers.
+    """
+    servers = start_stubs(**stub_settings)
+    os.environ["WEATHER_APP_DB"] = os.path.join(workdir, 'weather_app.db')
+    for key in ("WEATHER_API_KEY", "GEOAPIFY_API_KEY", "TIMEZONE_API_KEY"):
+        os.environ.setdefault(key, "bench")
+    if not client_limits:
+        for provider in STUB_ROUTES:
+            os.environ[f"HTTP_{provider.upper()}_RATE"] = "1000000"
+            os.environ[f"HTTP_{provider.upper()}_BURST"] = "1000000"
+            os.environ[f"HTTP_{provider.upper()}_CONCURRENCY"] = "64"
+    return servers
+
+
+def bench_http(calls=50, concurrency=4):
+    """Each API helper against the stubs: uncached calls, plus the cached and fan-out paths"""
+    import weather_app
+
+    coords = [(48.0 + index * 0.01, 2.0 + index * 0.01) for index in range(calls)]
+    results = {
+        # Unique text per call so the geocode cache never answers
+        'get_coordinates': measure(weather_app.get_coordinates,
+                                   [(f"Bench City {time.time_ns()}-{index}",) for index in range(calls)],
+                                   concurrency,
+                                   memory_args=[(f"Scratch City {time.time_ns()}-{index}",) for index in range(5)]),
+    }
+    for name in ('get_current_weather', 'get_forecast', 'get_air_quality', 'get_timezone_info'):
+        results[name] = measure(getattr(weather_app, name).uncached, coords, concurrency)
+    weather_app.get_current_weather(*coords[0])
+    results['get_current_weather (cached)'] = measure(weather_app.get_current_weather, [coords[0]] * calls)
+    results['get_current_conditions'] = measure(weather_app.get_current_conditions, coords, concurrency)
+    return results
+
+
+# Rows each write or delete op's memory pass works on instead of live rows
+SCRATCH_ROWS = 5
+
+
+def bench_db(rows=200):
+    """weather_app.py's database functions and the matching WeatherDB methods, call by call"""
+    import weather_app
+
+    payload = sample_forecast()
+    lat, lon = 48.8566, 2.3522
+    db = WeatherDB(weather_app.DB_NAME)
+    results = {}
+
+    def timed(name, func, args_list, memory_args=None):
+        values = []
+
+        def call(*args):
+            value = func(*args)
+            values.append(value)
+            return True if value is None else value
+
+        results[name] = measure(call, args_list, memory_args=memory_args)
+        # Calls run one at a time, so the timed ones come first; drop the memory pass's
+        return values[:len(args_list)]
+
+    # Writes and deletes run their memory pass on scratch rows, removed again
+    # afterwards, so every op sees the same live rows from run to run
+    scratch_saves = [(f"Scratch {index}", lat, lon, None, None, None, payload, "", "scratch")
+                     for index in range(SCRATCH_ROWS)]
+
+    def scratch_ids():
+        return [(query_id,) for query_id in db.save_weather_queries(
+            {'location': f"Scratch {index}", 'lat': lat, 'lon': lon, 'weather_data': payload,
+             'notes': '', 'tags': 'scratch'} for index in range(SCRATCH_ROWS))]
+
+    def drop_scratch():
+        with connection(db.db_name) as conn:
+            stale = [row[0] for row in conn.execute("SELECT id FROM weather_queries WHERE tags = 'scratch'")]
+            conn.execute("DELETE FROM saved_locations WHERE name LIKE 'Scratch %'")
+        db.delete_queries(stale)
+
+    # weather_app.py functions
+    timed('app.save_to_db', weather_app.save_to_db,
+          [(f"Bench {index}", lat + index * 1e-5, lon, None, None, None, payload, "", "bench")
+           for index in range(rows)], scratch_saves)
+    drop_scratch()
+    query_ids = [row[0] for row in weather_app.get_queries_page(page_size=rows)[0]]
+    timed('app.get_queries_page', weather_app.get_queries_page, [(25, None, "Most Recent", None)] * rows)
+    timed('app.get_queries_page (search)', weather_app.get_queries_page, [(25, None, "Best Match", "bench")] * rows)
+    timed('app.get_query_by_id', weather_app.get_query_by_id, [(query_id,) for query_id in query_ids])
+    timed('app.update_query_in_db', weather_app.update_query_in_db,
+          [(query_id, "Bench updated", lat, lon, None, None, payload, "updated", "bench")
+           for query_id in query_ids],
+          [(query_id, "Scratch updated", lat, lon, None, None, payload, "updated", "scratch")
+           for (query_id,) in scratch_ids()])
+    drop_scratch()
+    timed('app.save_location_to_db', weather_app.save_location_to_db,
+          [(f"Place {index}", "Bench St", lat + index * 1e-3, lon) for index in range(rows)],
+          [(f"Scratch {index}", "Bench St", lat, lon) for index in range(SCRATCH_ROWS)])
+    drop_scratch()
+    timed('app.get_saved_locations', weather_app.get_saved_locations, [()] * rows)
+    timed('app.get_query_history_near', weather_app.get_query_history_near, [(lat, lon)] * rows)
+    timed('app.delete_query_from_db', weather_app.delete_query_from_db, [(query_id,) for query_id in query_ids],
+          scratch_ids())
+
+    # WeatherDB methods
+    query_ids = timed('db.save_weather_query', db.save_weather_query,
+                      [(f"Bench {index}", lat + index * 1e-5, lon, None, None, None, payload, "", "bench")
+                       for index in range(rows)], scratch_saves)
+    drop_scratch()
+    location_id = db.save_location("Bench", "Bench St", lat, lon)
+    timed('db.get_all_queries', db.get_all_queries, [(25,)] * rows)
+    timed('db.search_queries', db.search_queries, [("bench", 25)] * rows)
+    timed('db.get_query_by_id', db.get_query_by_id, [(query_id,) for query_id in query_ids])
+    timed('db.get_queries_by_location', db.get_queries_by_location, [(location_id,)] * rows)
+    timed('db.get_forecast_points', db.get_forecast_points, [("Bench 0",)] * rows)
+    timed('db.update_query', lambda query_id: db.update_query(query_id, notes="updated"),
+          [(query_id,) for query_id in query_ids], scratch_ids())
+    drop_scratch()
+    timed('db.delete_query', db.delete_query, [(query_id,) for query_id in query_ids], scratch_ids())
+    return results
+
+
+# Interactions that bring each page to its data-heavy state: name -> (menu entry, steps);
+# checkboxes are picked by label, the other widgets by index
+PAGE_FLOWS = {
+    'Current Weather': ("Current Weather", [('text_input', 0, "Paris")]),
+    '5-Day Forecast': ("5-Day Forecast", [('text_input', 0, "London")]),
+    'Weather by Date Range': ("Weather by Date Range", [('text_input', 0, "Rome"), ('button', 0, None)]),
+    'Saved Queries': ("Saved Queries", []),
+    'Saved Locations': ("Saved Locations", [('checkbox', "Show weather dashboard for all locations", True),
+                                              ('checkbox', "Show map of all saved locations and queries", True)]),
+    'Settings': ("Settings", []),
+}
+
+
+def _apply_step(app, kind, target, value):
+    if kind == 'text_input':
+        app.text_input[target].input(value)
+    elif kind == 'checkbox':
+        for checkbox in app.checkbox:
+            if checkbox.label == target:
+                checkbox.set_value(value)
+                break
+    elif kind == 'button':
+        app.button[target].click()
+    app.run()
+
+
+def bench_pages(reruns=10):
+    """Full weather_app.py page renders through AppTest, against the stubs.
+
+    first_run_ms includes the API calls; the rerun percentiles are warm
+    (response caches full), which is what every widget interaction costs.
+    """
+    from streamlit.testing.v1 import AppTest
+    import weather_app
+
+    # Something to list on the saved pages
+    payload = sample_forecast()
+    for index in range(20):
+        weather_app.save_to_db(f"Bench {index}", 48.85 + index * 0.01, 2.35, None, None, None, payload, "", "bench")
+        weather_app.save_location_to_db(f"Place {index}", "Bench St", 48.85 + index * 0.01, 2.35)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weather_app.py')
+    results = {}
+    for name, (menu_entry, steps) in PAGE_FLOWS.items():
+        app = AppTest.from_file(script, default_timeout=120)
+        app.run()
+        started = time.perf_counter()
+        app.sidebar.selectbox[0].select(menu_entry)
+        app.run()
+        for step in steps:
+            _apply_step(app, *step)
+        first_run = time.perf_counter() - started
+
+        times = []
+        for _ in range(reruns):
+            started = time.perf_counter()
+            app.run()
+            times.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        try:
+            app.run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        stats = percentiles(times)
+        stats.update({'first_run_ms': 1000 * first_run, 'throughput_per_s': _rate(reruns, sum(times)),
+                      'errors': len(app.exception), 'peak_memory_bytes': peak})
+        results[name] = stats
+    return results
+
+
+def print_stats_results(results):
+    print(f"{'operation':<34}{'count':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'ops/s':>10}{'peak KB':>10}{'errors':>8}")
+    for name, stats in results.items():
+        print(f"{name:<34}{stats['count']:>6}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+              f"{stats['throughput_per_s']:>10.1f}{stats['peak_memory_bytes'] / 1024:>10.1f}{stats['errors']:>8}")
+
+
+# Modules that should only load on the pages that use them
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'folium', 'geopy')
+
+# Cold-start budgets in ms, checked by the startup suite. Measured: import_ms
+# 145-165 and first_render_ms 450-580; the pre-lazy-import tree took ~1100 ms
+# to import, and pandas alone adds ~390, so these leave ~2.5x headroom
+# for slower machines while still catching a heavy module creeping back in
+STARTUP_BUDGETS = {
+    'import_ms': float(os.getenv("STARTUP_IMPORT_BUDGET_MS", 400)),
+    'first_render_ms': float(os.getenv("STARTUP_RENDER_BUDGET_MS", 1500)),
+}
+
+STARTUP_SCRIPT = '''
+import json, os, sys, time
+sys.path.insert(0, {repo!r})
+os.environ['WEATHER_APP_DB'] = {db!r}
+started = time.perf_counter()
+import streamlit
+streamlit_s = time.perf_counter() - started
+started = time.perf_counter()
+import weather_app
+import_s = time.perf_counter() - started
+at_import = [name for name in {heavy!r} if name in sys.modules]
+
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({script!r}, default_timeout=120)
+started = time.perf_counter()
+app.run()
+first_render_s = time.perf_counter() - started
+started = time.perf_counter()
+app.run()
+rerun_s = time.perf_counter() - started
+print(json.dumps({{'streamlit_import_ms': 1000 * streamlit_s, 'import_ms': 1000 * import_s, 'first_render_ms': 1000 * first_render_s,
+                  'rerun_ms': 1000 * rerun_s, 'loaded_at_import': at_import,
+                  'loaded_after_render': [name for name in {heavy!r} if name in sys.modules],
+                  'errors': len(app.exception)}}))
+'''
+
+
+def bench_startup(runs=3, workdir=None):
+    """Cold start of weather_app.py, each run in a fresh interpreter against a new database.
+
+    import_ms is `import weather_app` on top of an already imported
+    streamlit, whose own import time (streamlit_import_ms, reported but not
+    budgeted) is fixed cost the app can't change; first_render_ms is the
+    first AppTest run of the default page, which also creates the schema. Reports the
+    median of runs, any heavy modules loaded along the way, and which
+    STARTUP_BUDGETS were exceeded (heavy modules at import count as over).
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='weather-bench-')
+    repo = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for index in range(runs):
+        script = STARTUP_SCRIPT.format(repo=repo, db=os.path.join(workdir, f'startup-{index}.db'),
+                                       heavy=HEAVY_MODULES, script=os.path.join(repo, 'weather_app.py'))
+        completed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                                   cwd=workdir, check=True)
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {name: sorted(sample[name] for sample in samples)[runs // 2]
+               for name in ('streamlit_import_ms', 'import_ms', 'first_render_ms', 'rerun_ms')}
+    results.update({
+        'loaded_at_import': samples[-1]['loaded_at_import'],
+        'loaded_after_render': samples[-1]['loaded_after_render'],
+        'errors': max(sample['errors'] for sample in samples),
+        'budgets': STARTUP_BUDGETS,
+        'over_budget': [name for name, budget in STARTUP_BUDGETS.items() if results[name] > budget],
+    })
+    if results['loaded_at_import']:
+        results['over_budget'].append('loaded_at_import')
+    return results
+
+
+def print_startup_results(results):
+    for name, budget in results['budgets'].items():
+        print(f"{name:<20}{results[name]:>10.1f}  (budget {budget:.0f})")
+    print(f"{'streamlit_import_ms':<20}{results['streamlit_import_ms']:>10.1f}")
+    print(f"{'rerun_ms':<20}{results['rerun_ms']:>10.1f}")
+    print(f"{'loaded at import':<20}{', '.join(results['loaded_at_import']) or '-':>10}")
+    print(f"{'loaded after render':<20}{', '.join(results['loaded_after_render']) or '-':>10}")
+    print(f"over budget: {', '.join(results['over_budget']) or 'none'}")
+
+
+# Suites that drive the app and need the stub servers
+OFFLINE_SUITES = ('http', 'db', 'pages')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weather app benchmarks")
+    parser.add_argument("suite", choices=["bulk", "render", "http", "db", "pages", "offline", "startup"],
+                        help="bulk: per-row versus bulk WeatherDB writes; "
+                             "render: display_weather widgets versus compact mode; "
+                             "http: API helpers against local stub servers; "
+                             "db: weather_app.py and WeatherDB database calls; "
+                             "pages: full page renders through AppTest; "
+                             "offline: http, db and pages together; "
+                             "startup: cold import and first render against STARTUP_BUDGETS, "
+                             "exiting 1 when over budget")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--timesteps", type=int, default=40)
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=50, help="calls per API helper (http)")
+    parser.add_argument("--db-rows", type=int, default=200, help="calls per database operation (db)")
+    parser.add_argument("--concurrency", type=int, default=4, help="API calls in flight (http)")
+    parser.add_argument("--latency", type=float, default=20.0, help="stub response latency in ms")
+    parser.add_argument("--jitter", type=float, default=10.0, help="extra random stub latency, up to this many ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub responses that are 500s")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of stub responses that are 429s")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--payloads", help="directory of recorded <endpoint>.json payloads for the stubs")
+    parser.add_argument("--seed", type=int, help="seed for the stubs' latency and failure draws")
+    parser.add_argument("--client-limits", action="store_true",
+                        help="keep the HttpClient's per-provider rate limits (off by default)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", "-o", help="also write results and run settings as JSON to this file")
+    args = parser.parse_args()
+
+    suites = OFFLINE_SUITES if args.suite == "offline" else (args.suite,)
+    workdir = tempfile.mkdtemp(prefix='weather-bench-')
+    servers = None
+    if any(suite in OFFLINE_SUITES for suite in suites):
+        servers = offline_environment(
+            workdir, args.client_limits, latency=args.latency / 1000, jitter=args.jitter / 1000,
+            error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+            retry_after=args.retry_after, payload_dir=args.payloads, seed=args.seed)
+
+    runners = {
+        'bulk': (lambda: bench_bulk_writes(args.rows, args.chunk_size), print_bulk_results),
+        'render': (lambda: bench_render(args.timesteps, args.reruns), print_render_results),
+        'http': (lambda: bench_http(args.calls, args.concurrency), print_stats_results),
+        'db': (lambda: bench_db(args.db_rows), print_stats_results),
+        'pages': (lambda: bench_pages(args.reruns), print_stats_results),
+        'startup': (lambda: bench_startup(args.reruns), print_startup_results),
+    }
+    results = {}
+    try:
+        for suite in suites:
+            run, printer = runners[suite]
+            results[suite] = run()
+            if not args.json:
+                if len(suites) > 1:
+                    print(f"\n[{suite}]")
+                printer(results[suite])
+    finally:
+        if servers:
+            stop_stubs(servers)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'settings': vars(args),
+            'stub_requests': {provider: server.counts for provider, server in (servers or {}).items()},
+        },
+        'results': results,
+    }
+    if args.json:
+        print(json.dumps(results[suites[0]] if len(suites) == 1 else results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if results.get('startup', {}).get('over_budget'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import csv
+import json
+import re
+import sys
+from io import StringIO
+from xml.sax.saxutils import escape
+
+from payload_codec import decode_payload
+from sqlite3_utils import connection, ensure_schema
+
+EXPORT_FORMATS = ('JSON', 'NDJSON', 'CSV', 'XML')
+
+EXPORT_MIME_TYPES = {
+    'JSON': 'application/json',
+    'NDJSON': 'application/x-ndjson',
+    'CSV': 'text/csv',
+    'XML': 'application/xml',
+}
+
+# Saved query fields written ahead of the weather data, in order
+QUERY_FIELDS = ('id', 'location', 'latitude', 'longitude', 'query_date', 'date_from',
+                'date_to', 'notes', 'tags', 'created_at')
+
+_XML_NAME = re.compile(r'^[A-Za-z_][\w.-]*$')
+
+
+def flatten(value, prefix=''):
+    """Flatten nested dicts and lists into {'main.temp': ..., 'weather.0.main': ...}"""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+    flat = {}
+    for key, child in items:
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(child, (dict, list)) and child:
+            flat.update(flatten(child, path))
+        else:
+            flat[path] = child if not isinstance(child, (dict, list)) else None
+    return flat
+
+
+def timesteps(weather_data):
+    """Rows a payload contributes to a CSV: each forecast entry, or the payload itself"""
+    if isinstance(weather_data, dict) and isinstance(weather_data.get('list'), list):
+        return weather_data['list']
+    if isinstance(weather_data, list):
+        return weather_data
+    return [weather_data] if weather_data is not None else []
+
+
+def iter_json(data):
+    """Pretty-printed JSON for one value, produced piece by piece"""
+    return json.JSONEncoder(indent=2).iterencode(data)
+
+
+def iter_json_array(records):
+    """A JSON array written one record at a time"""
+    encoder = json.JSONEncoder(indent=2)
+    yield '['
+    first = True
+    for record in records:
+        yield '\n  ' if first else ',\n  '
+        first = False
+        # Indent each record one level, as json.dumps(list, indent=2) would
+        yield encoder.encode(record).replace('\n', '\n  ')
+    yield '\n]' if not first else ']'
+
+
+def iter_ndjson(records):
+    """One compact JSON document per line"""
+    for record in records:
+        yield json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def csv_columns(rows, leading=()):
+    """Union of the flattened rows' columns in first-seen order, after `leading`"""
+    columns = dict.fromkeys(leading)
+    for row in rows:
+        columns.update(dict.fromkeys(flatten(row)))
+    return list(columns)
+
+
+def iter_csv(rows, leading=(), columns=None):
+    """CSV of flattened rows, with the union of their columns as the header.
+
+    Pass the header as `columns` when it comes from an earlier pass over the
+    same rows, so they can be streamed; otherwise the rows are read into
+    memory first to find it.
+    """
+    if columns is None:
+        rows = list(rows)
+        columns = csv_columns(rows, leading)
+
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=columns)
+
+    def flush():
+        chunk = output.getvalue()
+        output.seek(0)
+        output.truncate()
+        return chunk
+
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(flatten(row))
+        if output.tell() >= 64 * 1024:
+            yield flush()
+    yield flush()
+
+
+def _xml_tag(name):
+    """Use a key as an element name, prefixing '_' to ones XML doesn't allow (e.g. '3h')"""
+    name = str(name)
+    if _XML_NAME.match(name) and not name.lower().startswith('xml'):
+        return name
+    return '_' + re.sub(r'[^\w.-]', '_', name)
+
+
+def iter_xml_element(tag, value):
+    """One element and its children, emitted as escaped fragments"""
+    tag = _xml_tag(tag)
+    if isinstance(value, dict):
+        yield f'<{tag}>'
+        for key, child in value.items():
+            yield from iter_xml_element(key, child)
+        yield f'</{tag}>'
+    elif isinstance(value, list):
+        yield f'<{tag}>'
+        for child in value:
+            yield from iter_xml_element('item', child)
+        yield f'</{tag}>'
+    elif value is None:
+        yield f'<{tag}/>'
+    else:
+        yield f'<{tag}>{escape(str(value))}</{tag}>'
+
+
+def iter_xml_records(records, root='queries', tag='query'):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield f'<{root}>'
+    for record in records:
+        yield from iter_xml_element(tag, record)
+    yield f'</{root}>\n'
+
+
+def iter_export(data, format_type):
+    """Stream a single payload (one saved query's weather_data) in the given format"""
+    if format_type == 'JSON':
+        return iter_json(data)
+    if format_type == 'NDJSON':
+        return iter_ndjson(timesteps(data))
+    if format_type == 'CSV':
+        return iter_csv(timesteps(data))
+    if format_type == 'XML':
+        return iter_xml_element('data', data)
+    return iter([str(data)])
+
+
+def iter_query_records(db_name='weather_app.db', chunk_size=200, query_ids=None, until_id=None):
+    """Yield saved queries (up to id until_id) as dicts with decoded weather_data, oldest first.
+
+    Reads keyset chunks of chunk_size rows, each in its own short read, so a
+    slow consumer never holds a transaction (or more than one chunk) open.
+    """
+    ensure_schema(db_name)
+    columns = ', '.join(QUERY_FIELDS)
+    last_id = 0
+    until_id = -1 if until_id is None else until_id
+    while True:
+        with connection(db_name) as conn:
+            c = conn.cursor()
+            if query_ids is None:
+                c.execute(f'''SELECT {columns}, weather_data, payload_format FROM weather_queries
+                              WHERE id > ? AND (? < 0 OR id <= ?) ORDER BY id LIMIT ?''',
+                          (last_id, until_id, until_id, chunk_size))
+            else:
+                c.execute(f'''SELECT {columns}, weather_data, payload_format FROM weather_queries
+                              WHERE id > ? AND (? < 0 OR id <= ?) AND id IN (SELECT value FROM json_each(?))
+                              ORDER BY id LIMIT ?''',
+                          (last_id, until_id, until_id, json.dumps(list(query_ids)), chunk_size))
+            rows = c.fetchall()
+        if not rows:
+            return
+        for row in rows:
+            record = dict(zip(QUERY_FIELDS, row))
+            record['weather_data'] = decode_payload(row[-2], row[-1])
+            yield record
+        last_id = rows[-1][0]
+
+
+def _query_rows(records):
+    """One CSV row per timestep, each prefixed with its query's fields"""
+    for record in records:
+        base = {field: record[field] for field in QUERY_FIELDS}
+        steps = timesteps(record['weather_data']) or [{}]
+        for step in steps:
+            row = dict(base)
+            row['weather'] = step
+            yield row
+
+
+def iter_queries_csv(db_name='weather_app.db', chunk_size=200, query_ids=None):
+    """CSV of the saved query history in two keyset passes: one for the header, one for the rows.
+
+    Memory stays bounded by a chunk plus the column names, and no column is
+    lost however late in the history it first appears. The second pass stops
+    at the last id the first one saw, so rows saved in between can't bring
+    columns the header lacks.
+    """
+    last_id = None
+    columns = dict.fromkeys(QUERY_FIELDS)
+    for record in iter_query_records(db_name, chunk_size, query_ids):
+        last_id = record['id']
+        columns.update(dict.fromkeys(csv_columns(_query_rows([record]))))
+    if last_id is None:
+        yield from iter_csv([], leading=QUERY_FIELDS)
+        return
+    yield from iter_csv(_query_rows(iter_query_records(db_name, chunk_size, query_ids, last_id)),
+                        columns=list(columns))
+
+
+def iter_queries_export(format_type, db_name='weather_app.db', chunk_size=200, query_ids=None):
+    """Stream the saved query history (or just query_ids) in the given format"""
+    records = iter_query_records(db_name, chunk_size, query_ids)
+    if format_type == 'JSON':
+        return iter_json_array(records)
+    if format_type == 'NDJSON':
+        return iter_ndjson(records)
+    if format_type == 'CSV':
+        return iter_queries_csv(db_name, chunk_size, query_ids)
+    if format_type == 'XML':
+        return iter_xml_records(records)
+    raise ValueError(f"Unknown export format: {format_type}")
+
+
+def write_export(chunks, output):
+    """Write streamed chunks to a text file object; returns characters written"""
+    written = 0
+    for chunk in chunks:
+        output.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export saved weather queries")
+    parser.add_argument("--db", default="weather_app.db")
+    parser.add_argument("--format", default="NDJSON", choices=EXPORT_FORMATS)
+    parser.add_argument("--output", "-o", help="file to write (default: stdout)")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--id", type=int, action="append", dest="ids", help="export only this query id (repeatable)")
+    args = parser.parse_args()
+
+    chunks = iter_queries_export(args.format, args.db, args.chunk_size, args.ids)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as output:
+            written = write_export(chunks, output)
+        print(f"wrote {written} characters to {args.output}", file=sys.stderr)
+    else:
+        write_export(chunks, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
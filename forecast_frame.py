@@ -0,0 +1,183 @@
+import time
+
+import numpy as np
+
+# Per-timestep columns pulled out of each forecast entry: name -> (section, key)
+COLUMNS = {
+    'temp': ('main', 'temp'),
+    'feels_like': ('main', 'feels_like'),
+    'humidity': ('main', 'humidity'),
+    'pressure': ('main', 'pressure'),
+    'wind_speed': ('wind', 'speed'),
+    'rain': ('rain', '3h'),
+    'snow': ('snow', '3h'),
+}
+
+
+def _local_offsets(dt):
+    """Local UTC offsets in seconds for epoch timestamps, as datetime.fromtimestamp would apply"""
+    if not len(dt):
+        return np.zeros(0, dtype=np.int64)
+    first = time.localtime(int(dt[0])).tm_gmtoff
+    last = time.localtime(int(dt[-1])).tm_gmtoff
+    if first == last:
+        # No DST change inside the window (the usual case for a 5-day forecast)
+        return np.full(len(dt), first, dtype=np.int64)
+    return np.array([time.localtime(int(t)).tm_gmtoff for t in dt], dtype=np.int64)
+
+
+def _as_day(value):
+    if isinstance(value, str):
+        return np.datetime64(value[:10], 'D')
+    return np.datetime64(value, 'D')
+
+
+class ForecastFrame:
+    """Columnar view of an OpenWeather forecast or date-range list, built once per payload.
+
+    Entries are sorted by dt; numeric fields become float arrays (NaN where
+    missing) and local dates a datetime64[D] array, so grouping by day and
+    slicing date ranges are array operations instead of per-item datetime work.
+    """
+
+    def __init__(self, items):
+        dt = np.array([item.get('dt', 0) for item in items], dtype=np.int64)
+        order = np.argsort(dt, kind='stable')
+        if len(order) and (order[1:] < order[:-1]).any():
+            items = [items[i] for i in order]
+            dt = dt[order]
+        self.items = items
+        self.dt = dt
+        self.local = (dt + _local_offsets(dt)).astype('datetime64[s]')
+        self.day = self.local.astype('datetime64[D]')
+
+        sections = {}
+        self.columns = {}
+        for name, (section, key) in COLUMNS.items():
+            if section not in sections:
+                sections[section] = [item.get(section) for item in items]
+            self.columns[name] = np.array(
+                [value.get(key) if isinstance(value, dict) else None for value in sections[section]],
+                dtype=float)
+        weather = [item.get('weather') or [{}] for item in items]
+        self.condition = [entry[0].get('main') for entry in weather]
+        self.condition_id = [entry[0].get('id') for entry in weather]
+        self.icon = [entry[0].get('icon') for entry in weather]
+
+    @classmethod
+    def from_payload(cls, weather_data):
+        """Build a frame from a forecast dict, a list of entries or a single current-weather dict"""
+        if isinstance(weather_data, list):
+            items = weather_data
+        elif isinstance(weather_data, dict) and isinstance(weather_data.get('list'), list):
+            items = weather_data['list']
+        elif isinstance(weather_data, dict) and 'main' in weather_data:
+            items = [weather_data]
+        else:
+            items = []
+        return cls([item for item in items if isinstance(item, dict)])
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def take(self, start, stop):
+        """Frame over entries [start, stop) without re-parsing them"""
+        frame = object.__new__(ForecastFrame)
+        frame.items = self.items[start:stop]
+        frame.dt = self.dt[start:stop]
+        frame.local = self.local[start:stop]
+        frame.day = self.day[start:stop]
+        frame.columns = {name: column[start:stop] for name, column in self.columns.items()}
+        frame.condition = self.condition[start:stop]
+        frame.condition_id = self.condition_id[start:stop]
+        frame.icon = self.icon[start:stop]
+        return frame
+
+    def with_columns(self, columns):
+        """Frame sharing this one's entries with some numeric columns replaced"""
+        frame = self.take(0, len(self))
+        frame.columns.update(columns)
+        return frame
+
+    def between(self, date_from, date_to):
+        """Entries whose local date falls in [date_from, date_to]; accepts dates or 'YYYY-MM-DD'"""
+        start = np.searchsorted(self.day, _as_day(date_from), side='left')
+        stop = np.searchsorted(self.day, _as_day(date_to), side='right')
+        return self.take(start, max(start, stop))
+
+    def day_bounds(self):
+        """(date string, start, stop) for each local day, in order"""
+        if not len(self):
+            return []
+        starts = np.concatenate(([0], np.flatnonzero(self.day[1:] != self.day[:-1]) + 1))
+        stops = np.append(starts[1:], len(self))
+        labels = np.datetime_as_string(self.day[starts], unit='D')
+        return list(zip(labels.tolist(), starts.tolist(), stops.tolist()))
+
+    def days(self):
+        """(date string, frame) for each local day, in order"""
+        return [(label, self.take(start, stop)) for label, start, stop in self.day_bounds()]
+
+    def times(self):
+        """Local 'HH:MM' label per entry"""
+        return [stamp[11:16] for stamp in np.datetime_as_string(self.local, unit='m').tolist()]
+
+    def dates(self):
+        """Local 'YYYY-MM-DD' label per entry"""
+        return np.datetime_as_string(self.day, unit='D').tolist()
+
+    def daily_stats(self, column='temp'):
+        """Per-day min, max and mean of a column, ignoring missing values.
+
+        Returns {'date': [...], 'min': array, 'max': array, 'mean': array, 'count': array}.
+        """
+        bounds = self.day_bounds()
+        if not bounds:
+            empty = np.zeros(0)
+            return {'date': [], 'min': empty, 'max': empty, 'mean': empty, 'count': empty}
+        labels, starts, _ = zip(*bounds)
+        starts = np.array(starts)
+        values = self.columns[column]
+        present = ~np.isnan(values)
+        counts = np.add.reduceat(present.astype(np.int64), starts)
+        totals = np.add.reduceat(np.where(present, values, 0.0), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'date': list(labels),
+                'min': np.fmin.reduceat(values, starts),
+                'max': np.fmax.reduceat(values, starts),
+                'mean': np.where(counts > 0, totals / np.maximum(counts, 1), np.nan),
+                'count': counts,
+            }
+
+    def dominant_condition(self):
+        """Most frequent weather condition, the earliest seen winning ties"""
+        known = [condition for condition in self.condition if condition is not None]
+        if not known:
+            return None
+        labels, first, counts = np.unique(np.array(known, dtype=object).astype(str),
+                                          return_index=True, return_counts=True)
+        best = np.lexsort((first, -counts))[0]
+        return str(labels[best])
+
+    def summary(self):
+        """(temp_min, temp_max, temp_mean, dominant_condition, timestep_count)"""
+        temps = self.columns['temp']
+        temps = temps[~np.isnan(temps)]
+        if len(temps):
+            temp_min, temp_max = float(temps.min()), float(temps.max())
+            temp_mean = round(float(temps.mean()), 2)
+        else:
+            temp_min = temp_max = temp_mean = None
+        return temp_min, temp_max, temp_mean, self.dominant_condition(), len(self)
+
+    def to_table(self):
+        """Flat per-timestep table as a pandas DataFrame, for display and CSV export"""
+        import pandas as pd
+
+        table = {'date': self.dates(), 'time': self.times(), 'condition': self.condition}
+        table.update(self.columns)
+        return pd.DataFrame(table)
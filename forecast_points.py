@@ -0,0 +1,90 @@
+import argparse
+import re
+
+POINT_COLUMNS = ('query_id', 'location_key', 'dt', 'temp', 'feels_like', 'humidity',
+                 'wind_speed', 'condition_id', 'rain', 'snow')
+
+
+def location_key(location):
+    """Normalized location text so 'Paris ' and 'paris' land on the same points"""
+    return re.sub(r'\s+', ' ', location or '').strip().casefold()
+
+
+def point_rows(query_id, location, weather_data):
+    """forecast_points rows for one saved payload, one per timestep with a dt"""
+    from forecast_frame import ForecastFrame
+
+    frame = ForecastFrame.from_payload(weather_data)
+    if not len(frame):
+        return []
+    key = location_key(location)
+    # NaN (missing values) is stored as NULL by SQLite
+    return [
+        (query_id, key, dt, temp, feels_like, humidity, wind_speed, condition_id, rain, snow)
+        for dt, temp, feels_like, humidity, wind_speed, condition_id, rain, snow, item in zip(
+            frame.dt.tolist(), frame['temp'].tolist(), frame['feels_like'].tolist(),
+            frame['humidity'].tolist(), frame['wind_speed'].tolist(), frame.condition_id,
+            frame['rain'].tolist(), frame['snow'].tolist(), frame.items)
+        if 'dt' in item
+    ]
+
+
+def write_points(c, query_id, location, weather_data):
+    """Replace a query's forecast_points with rows from its payload (inside the caller's transaction)"""
+    c.execute('''DELETE FROM forecast_points WHERE query_id = ?''', (query_id,))
+    rows = point_rows(query_id, location, weather_data)
+    c.executemany(f'''INSERT OR REPLACE INTO forecast_points ({', '.join(POINT_COLUMNS)})
+                      VALUES ({', '.join('?' * len(POINT_COLUMNS))})''', rows)
+    return len(rows)
+
+
+def backfill_points(db_name='weather_app.db', batch_size=200, progress=None):
+    """Fill forecast_points for saved queries that have none, one batch per transaction.
+
+    Safe to re-run; returns (queries scanned, points written).
+    """
+    from payload_codec import decode_payload
+    from sqlite3_utils import connection, ensure_schema
+
+    ensure_schema(db_name)
+    scanned = written = 0
+    last_id = 0
+    while True:
+        with connection(db_name) as conn:
+            c = conn.cursor()
+            c.execute('''SELECT q.id, q.location, q.weather_data, q.payload_format
+                         FROM weather_queries q
+                         WHERE q.id > ?
+                           AND NOT EXISTS (SELECT 1 FROM forecast_points p WHERE p.query_id = q.id)
+                         ORDER BY q.id LIMIT ?''', (last_id, batch_size))
+            rows = c.fetchall()
+            if not rows:
+                break
+            for query_id, location, payload, payload_format in rows:
+                try:
+                    weather_data = decode_payload(payload, payload_format)
+                except ValueError:
+                    continue
+                written += write_points(c, query_id, location, weather_data)
+            scanned += len(rows)
+            last_id = rows[-1][0]
+        if progress:
+            progress(scanned, written, last_id)
+    return scanned, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill forecast_points from saved weather queries")
+    parser.add_argument("--db", default="weather_app.db")
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    scanned, written = backfill_points(
+        args.db, args.batch_size,
+        progress=lambda scanned, written, last_id: print(
+            f"\rscanned {scanned} queries (id {last_id}), {written} points", end="", flush=True))
+    print(f"\nbackfilled {written} points from {scanned} queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+import os
+import re
+import threading
+from sqlite3_utils import connection
+import time
+
+from instrumentation import CACHE_LOOKUPS
+from response_cache import TTLCache
+
+# Geocoding results rarely change; keep them for 30 days by default
+GEOCODE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 60 * 60))
+
+
+def normalize_query(query):
+    """Normalize free-text locations so 'New  York ' and 'new york' share an entry"""
+    return re.sub(r'\s+', ' ', query).strip().casefold()
+
+
+class GeocodeCache:
+    """Geocoding results stored in SQLite with an in-process LRU in front"""
+
+    def __init__(self, db_name='weather_app.db', ttl=GEOCODE_TTL, max_entries=1024):
+        self.db_name = db_name
+        self.ttl = ttl
+        self.memory = TTLCache(max_entries=max_entries, max_bytes=8 * 1024 * 1024)
+
+    def get(self, query):
+        """Return (lat, lon, properties) for a query, or None if not cached"""
+        key = normalize_query(query)
+        hit = self.memory.get(key)
+        if hit is not None:
+            CACHE_LOOKUPS.inc(endpoint='geocode', outcome='hits')
+            return hit
+
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            c.execute('''SELECT latitude, longitude, properties, expires_at FROM geocode_cache
+                         WHERE query_key = ?''', (key,))
+            row = c.fetchone()
+        if not row or row[3] <= time.time():
+            CACHE_LOOKUPS.inc(endpoint='geocode', outcome='misses')
+            return None
+
+        CACHE_LOOKUPS.inc(endpoint='geocode', outcome='warm_hits')
+        result = (row[0], row[1], json.loads(row[2]))
+        self.memory.set(key, result, row[3] - time.time())
+        return result
+
+    def set(self, query, lat, lon, properties):
+        """Store a geocoding result in both cache layers"""
+        key = normalize_query(query)
+        expires_at = time.time() + self.ttl
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            c.execute('''INSERT OR REPLACE INTO geocode_cache
+                         (query_key, latitude, longitude, properties, expires_at)
+                         VALUES (?, ?, ?, ?, ?)''',
+                      (key, lat, lon, json.dumps(properties), expires_at))
+        self.memory.set(key, (lat, lon, properties), self.ttl)
+
+    def purge_expired(self):
+        """Delete expired rows; returns how many were removed"""
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            c.execute('''DELETE FROM geocode_cache WHERE expires_at <= ?''', (time.time(),))
+        return c.rowcount
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_geocode_cache(db_name='weather_app.db'):
+    """Return the process-wide geocode cache for a database file, so its LRU outlives reruns"""
+    key = os.path.abspath(db_name)
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(key, GeocodeCache(db_name))
+    return cache
@@ -0,0 +1,209 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import HTTP_ATTEMPTS, HTTP_DURATION, HTTP_RETRIES, FANOUT_DROPPED
+
+# Status codes that are worth retrying: rate limited or upstream trouble
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Per-provider settings, keyed by the name passed to HttpClient.get().
+# rate is requests per second (token bucket refill), burst the bucket size.
+PROVIDERS = {
+    'geoapify': {'max_concurrency': 4, 'rate': 5.0, 'burst': 5},
+    'openweather': {'max_concurrency': 8, 'rate': 10.0, 'burst': 20},
+    'timezonedb': {'max_concurrency': 1, 'rate': 1.0, 'burst': 1},  # free tier allows ~1 request/second
+}
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class TokenBucket:
+    """Blocking token bucket: allows `burst` requests at once, refilled at `rate` per second"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+class HttpClient:
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff_factor=None, backoff_max=None, pool_maxsize=None):
+        self.connect_timeout = connect_timeout or _env_float("HTTP_CONNECT_TIMEOUT", 3.05)
+        self.read_timeout = read_timeout or _env_float("HTTP_READ_TIMEOUT", 10.0)
+        self.max_retries = max_retries if max_retries is not None else _env_int("HTTP_MAX_RETRIES", 2)
+        self.backoff_factor = backoff_factor or _env_float("HTTP_BACKOFF_FACTOR", 0.5)
+        self.backoff_max = backoff_max or _env_float("HTTP_BACKOFF_MAX", 8.0)
+        pool_maxsize = pool_maxsize or _env_int("HTTP_POOL_MAXSIZE", 16)
+
+        # One session keeps a keep-alive connection pool per host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(PROVIDERS), pool_maxsize=pool_maxsize,
+                              max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._limits = {
+            name: threading.BoundedSemaphore(
+                _env_int(f"HTTP_{name.upper()}_CONCURRENCY", settings['max_concurrency']))
+            for name, settings in PROVIDERS.items()
+        }
+        self._buckets = {
+            name: TokenBucket(
+                _env_float(f"HTTP_{name.upper()}_RATE", settings['rate']),
+                _env_int(f"HTTP_{name.upper()}_BURST", settings['burst']))
+            for name, settings in PROVIDERS.items()
+        }
+
+    def _backoff(self, attempt, response=None):
+        """Seconds to wait before the next attempt (full jitter, honours Retry-After)"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        ceiling = min(self.backoff_max, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def get(self, provider, url, params=None, endpoint=None):
+        """GET a URL through the shared pool, retrying 429/5xx and connection errors.
+
+        Every attempt waits for the provider's rate limit and concurrency slot.
+        Attempts, retries and the overall latency are recorded under provider
+        and endpoint (the URL path unless given).
+
+        Returns the final response (which may still be an error status) and
+        raises requests.exceptions.RequestException once retries run out.
+        """
+        endpoint = endpoint or urlparse(url).path
+        limit = self._limits.get(provider) or nullcontext()
+        bucket = self._buckets.get(provider)
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            if bucket:
+                bucket.acquire()
+            try:
+                with limit:
+                    response = self.session.get(
+                        url, params=params,
+                        timeout=(self.connect_timeout, self.read_timeout))
+            except requests.exceptions.RequestException as exc:
+                status = type(exc).__name__
+                HTTP_ATTEMPTS.inc(provider=provider, endpoint=endpoint, status=status)
+                retryable = isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if not retryable or attempt >= self.max_retries:
+                    HTTP_DURATION.observe(time.perf_counter() - started,
+                                          provider=provider, endpoint=endpoint, status=status)
+                    raise
+                HTTP_RETRIES.inc(provider=provider, endpoint=endpoint, reason=status)
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            HTTP_ATTEMPTS.inc(provider=provider, endpoint=endpoint, status=response.status_code)
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                HTTP_RETRIES.inc(provider=provider, endpoint=endpoint, reason=response.status_code)
+                delay = self._backoff(attempt, response)
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            HTTP_DURATION.observe(time.perf_counter() - started,
+                                  provider=provider, endpoint=endpoint, status=response.status_code)
+            return response
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide HttpClient, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
+
+
+_executor = ThreadPoolExecutor(max_workers=_env_int("HTTP_FANOUT_WORKERS", 16),
+                               thread_name_prefix="http-fanout")
+
+
+def fetch_concurrently(calls, deadline=None):
+    """Run independent upstream calls at once and collect what finishes in time.
+
+    calls maps a name to (function, args). Returns a dict with the same keys;
+    calls that fail or miss the shared deadline (in seconds) map to None so
+    callers can render partial results.
+    """
+    if deadline is None:
+        deadline = _env_float("HTTP_FANOUT_DEADLINE", 8.0)
+    futures = {name: _executor.submit(func, *args) for name, (func, args) in calls.items()}
+    wait(futures.values(), timeout=deadline)
+
+    results = {}
+    for name, future in futures.items():
+        if future.done() and future.exception() is None:
+            results[name] = future.result()
+        else:
+            FANOUT_DROPPED.inc(call=name, reason='error' if future.done() else 'timeout')
+            future.cancel()
+            results[name] = None
+    return results
+
+
+def fetch_many(func, args_list, max_workers=None):
+    """Call func(*args) for every args tuple with at most max_workers in flight.
+
+    Results come back in input order; calls that raise map to None. Provider
+    rate limits still apply inside the HttpClient.
+    """
+    max_workers = max_workers or _env_int("HTTP_BATCH_WORKERS", 8)
+    args_list = list(args_list)
+    if not args_list:
+        return []
+
+    def call(args):
+        try:
+            return func(*args)
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(args_list)),
+                            thread_name_prefix="http-batch") as executor:
+        return list(executor.map(call, args_list))
@@ -0,0 +1,227 @@
+import argparse
+import csv
+import functools
+import json
+import os
+import sys
+import time
+from datetime import date
+from itertools import islice
+
+from geocode_cache import get_geocode_cache
+from http_client import fetch_many
+from sqlite3_utils import WeatherDB, connection, chunked
+
+# Columns/keys read from each input record; only a location or lat/lon is required
+LOCATION_FIELDS = ('location', 'address', 'name')
+
+
+def read_records(path, fmt=None):
+    """Yield dicts from a CSV (with a header row) or NDJSON file"""
+    fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        if fmt == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def count_records(path, fmt=None):
+    return sum(1 for _ in read_records(path, fmt))
+
+
+def record_location(record):
+    for field in LOCATION_FIELDS:
+        if record.get(field):
+            return str(record[field]).strip()
+    return None
+
+
+def _coordinate(value):
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def load_checkpoint(db_name, job):
+    """(position, saved, failed) recorded for a job, zeros if it never ran"""
+    with connection(db_name) as conn:
+        row = conn.execute('''SELECT position, saved, failed FROM ingest_checkpoints
+                              WHERE job = ?''', (job,)).fetchone()
+    return row or (0, 0, 0)
+
+
+def _save_checkpoint(c, job, position, saved, failed):
+    c.execute('''INSERT INTO ingest_checkpoints (job, position, saved, failed, updated_at)
+                 VALUES (?, ?, ?, ?, ?)
+                 ON CONFLICT(job) DO UPDATE SET
+                     position = excluded.position, saved = excluded.saved,
+                     failed = excluded.failed, updated_at = excluded.updated_at''',
+              (job, position, saved, failed, time.time()))
+
+
+class Ingestor:
+    """Geocodes and fetches weather for a stream of location records in batches.
+
+    Each batch is geocoded (geocode cache first) and then fetched with at most
+    `workers` requests in flight; the shared HttpClient's per-provider token
+    buckets keep both steps inside the API quotas. Successful rows are
+    inserted with WeatherDB.save_weather_queries, and the job's checkpoint is
+    written in the same transaction, so a rerun resumes exactly after the
+    last committed batch.
+    """
+
+    def __init__(self, db_name='weather_app.db', kind='current', batch_size=100, workers=8,
+                 tags='ingest', failures=None, geocode=None, fetch=None):
+        import weather_app
+
+        self.db = WeatherDB(db_name)
+        self.db_name = db_name
+        self.kind = kind
+        self.batch_size = batch_size
+        self.workers = workers
+        self.tags = tags
+        self.failures = failures
+        # Geocode against db_name's cache, not the one weather_app opened on WEATHER_APP_DB
+        self.geocode = geocode or functools.partial(weather_app.get_coordinates, cache=get_geocode_cache(db_name))
+        self.fetch = fetch or (weather_app.get_forecast if kind == 'forecast' else weather_app.get_current_weather)
+
+    def _resolve(self, record):
+        """(location, lat, lon) for a record, geocoding when coordinates are missing"""
+        location = record_location(record)
+        lat, lon = _coordinate(record.get('lat', record.get('latitude'))), \
+            _coordinate(record.get('lon', record.get('longitude')))
+        if lat is not None and lon is not None:
+            return location or f"Lat: {lat}, Lon: {lon}", lat, lon
+        if not location:
+            raise ValueError("record has neither a location nor coordinates")
+        lat, lon, properties = self.geocode(location)
+        if lat is None or lon is None:
+            raise LookupError(f"could not geocode {location!r}")
+        return properties.get('formatted', location) if properties else location, lat, lon
+
+    def _call(self, func, *args):
+        try:
+            return func(*args), None
+        except Exception as exc:
+            return None, f"{type(exc).__name__}: {exc}"
+
+    def process_batch(self, records):
+        """Return (rows to save, [(record, reason)] failures) for one batch"""
+        resolved = fetch_many(lambda record: self._call(self._resolve, record),
+                              [(record,) for record in records], self.workers)
+        located = []
+        failed = []
+        for record, result in zip(records, resolved):
+            value, error = result or (None, "geocoding failed")
+            if error:
+                failed.append((record, error))
+            else:
+                located.append((record, value))
+
+        weather = fetch_many(self.fetch, [(lat, lon) for _, (_, lat, lon) in located], self.workers)
+        rows = []
+        today = str(date.today())
+        for (record, (location, lat, lon)), weather_data in zip(located, weather):
+            if not weather_data:
+                failed.append((record, "weather fetch failed"))
+                continue
+            rows.append({
+                'location': location, 'lat': lat, 'lon': lon, 'query_date': today,
+                'date_from': record.get('date_from') or None, 'date_to': record.get('date_to') or None,
+                'weather_data': weather_data, 'notes': record.get('notes') or '',
+                'tags': record.get('tags') or self.tags,
+            })
+        return rows, failed
+
+    def _log_failures(self, failed, position):
+        if not (self.failures and failed):
+            return
+        with open(self.failures, 'a', encoding='utf-8') as log:
+            for record, reason in failed:
+                log.write(json.dumps({'record': record, 'error': reason, 'batch_end': position}) + '\n')
+
+    def run(self, records, job, total=None, progress=None):
+        """Ingest records, skipping those a previous run of `job` already committed.
+
+        Returns {'processed', 'saved', 'failed', 'seconds', 'rate'} for this run.
+        """
+        position, saved, failed = load_checkpoint(self.db_name, job)
+        records = islice(records, position, None)
+        started = time.monotonic()
+        processed = 0
+
+        for batch in chunked(records, self.batch_size):
+            rows, batch_failed = self.process_batch(batch)
+            position += len(batch)
+            processed += len(batch)
+            saved += len(rows)
+            failed += len(batch_failed)
+
+            def checkpoint(c, ids, position=position, saved=saved, failed=failed):
+                _save_checkpoint(c, job, position, saved, failed)
+
+            if rows:
+                self.db.save_weather_queries(rows, chunk_size=len(rows), on_chunk=checkpoint)
+            else:
+                with connection(self.db_name) as conn:
+                    checkpoint(conn.cursor(), [])
+            self._log_failures(batch_failed, position)
+
+            if progress:
+                elapsed = time.monotonic() - started
+                progress({'position': position, 'total': total, 'processed': processed,
+                          'saved': saved, 'failed': failed, 'seconds': elapsed,
+                          'rate': processed / elapsed if elapsed else 0.0})
+
+        elapsed = time.monotonic() - started
+        return {'processed': processed, 'saved': saved, 'failed': failed, 'seconds': elapsed,
+                'rate': processed / elapsed if elapsed else 0.0}
+
+
+def print_progress(report):
+    done = f"{report['position']}/{report['total']}" if report['total'] else str(report['position'])
+    eta = ""
+    if report['total'] and report['rate']:
+        eta = f", ~{(report['total'] - report['position']) / report['rate']:.0f}s left"
+    print(f"\r{done} records, {report['saved']} saved, {report['failed']} failed, "
+          f"{report['rate']:.1f} records/s{eta}", end="", file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch and save weather for a CSV or NDJSON list of locations")
+    parser.add_argument("input", help="CSV with a header (location/address or lat,lon columns) or NDJSON")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="input format (default: from the extension)")
+    parser.add_argument("--db", default="weather_app.db")
+    parser.add_argument("--kind", choices=["current", "forecast"], default="current")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8, help="requests in flight per step")
+    parser.add_argument("--tags", default="ingest", help="tags for records without a tags column")
+    parser.add_argument("--job", help="checkpoint name (default: the input's absolute path)")
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint")
+    parser.add_argument("--failures", help="append failed records as NDJSON to this file")
+    args = parser.parse_args()
+
+    job = args.job or os.path.abspath(args.input)
+    # weather_app sets up its schema and response snapshots on this database when imported
+    os.environ["WEATHER_APP_DB"] = args.db
+    ingestor = Ingestor(args.db, args.kind, args.batch_size, args.workers, args.tags, args.failures)
+    if args.restart:
+        with connection(args.db) as conn:
+            conn.execute('''DELETE FROM ingest_checkpoints WHERE job = ?''', (job,))
+
+    total = count_records(args.input, args.format)
+    resumed_at = load_checkpoint(args.db, job)[0]
+    if resumed_at:
+        print(f"resuming {job} at record {resumed_at}", file=sys.stderr)
+    summary = ingestor.run(read_records(args.input, args.format), job, total, print_progress)
+    print(f"\n{summary['processed']} records in {summary['seconds']:.1f}s "
+          f"({summary['rate']:.1f}/s): {summary['saved']} saved, {summary['failed']} failed in total",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import functools
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return dict(self.values)
+
+    def render(self):
+        return [f"{self.name}{_label_text(self.labels, key)} {_number(value)}"
+                for key, value in sorted(self.samples().items())]
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set, as Prometheus expects"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.values = {}  # label values -> [per-bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            return {key: list(state) for key, state in self.values.items()}
+
+    def quantile(self, q, state):
+        """Estimate a quantile from one label set's buckets (linear within a bucket)"""
+        count = state[-1]
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, state):
+            if seen + bucket_count >= rank and bucket_count:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = bound if bound != math.inf else lower
+        return lower
+
+    def render(self):
+        lines = []
+        for key, state in sorted(self.samples().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, [('le', _number(bound))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {_number(state[-2])}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {state[-1]}")
+        return lines
+
+
+HTTP_DURATION = Histogram('weather_http_request_duration_seconds',
+                          'Upstream API calls, including retries and rate-limit waits',
+                          ('provider', 'endpoint', 'status'))
+HTTP_ATTEMPTS = Counter('weather_http_attempts_total', 'Individual HTTP attempts by status code or error',
+                        ('provider', 'endpoint', 'status'))
+HTTP_RETRIES = Counter('weather_http_retries_total', 'Attempts retried after a 429, 5xx or connection error',
+                       ('provider', 'endpoint', 'reason'))
+FANOUT_DROPPED = Counter('weather_fanout_dropped_total',
+                         'Concurrent calls rendered as missing because they failed or missed the deadline',
+                         ('call', 'reason'))
+CACHE_LOOKUPS = Counter('weather_cache_lookups_total',
+                        'Response and geocode cache lookups; warm_hits come from the SQLite tier',
+                        ('endpoint', 'outcome'))
+DB_DURATION = Histogram('weather_db_operation_duration_seconds', 'Database functions and WeatherDB methods',
+                        ('operation',))
+DB_ROWS_RETURNED = Counter('weather_db_rows_returned_total', 'Rows returned by database operations',
+                           ('operation',))
+DB_ROWS_CHANGED = Counter('weather_db_rows_changed_total',
+                          'Rows inserted, updated or deleted, including index rows kept by triggers',
+                          ('operation',))
+DB_ERRORS = Counter('weather_db_errors_total', 'Database operations that raised', ('operation', 'error'))
+
+METRICS = (HTTP_DURATION, HTTP_ATTEMPTS, HTTP_RETRIES, FANOUT_DROPPED, CACHE_LOOKUPS,
+           DB_DURATION, DB_ROWS_RETURNED, DB_ROWS_CHANGED, DB_ERRORS)
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    for metric in METRICS:
+        with metric._lock:
+            metric.values.clear()
+
+
+# Open instrumented DB operations on this thread; connection() adds each
+# transaction's changes to every one of them
+_db_frames = threading.local()
+
+
+def record_db_changes(count):
+    for frame in getattr(_db_frames, 'stack', ()):
+        frame[0] += count
+
+
+def returned_rows(result):
+    """Rows in a DB function's result: a list, a (rows, cursor) page, or a single row"""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, (tuple, dict)):
+        return 1
+    return 0
+
+
+def instrument_db(operation=None):
+    """Decorator recording a DB function's latency, rows returned/changed and errors"""
+    def decorator(func):
+        name = operation or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = getattr(_db_frames, 'stack', None)
+            if stack is None:
+                stack = _db_frames.stack = []
+            frame = [0]
+            stack.append(frame)
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as exc:
+                DB_ERRORS.inc(operation=name, error=type(exc).__name__)
+                raise
+            finally:
+                stack.pop()
+                DB_DURATION.observe(time.perf_counter() - started, operation=name)
+                if frame[0]:
+                    DB_ROWS_CHANGED.inc(frame[0], operation=name)
+            DB_ROWS_RETURNED.inc(returned_rows(result), operation=name)
+            return result
+        return wrapper
+    return decorator
+
+
+def instrument_methods(cls):
+    """Class decorator applying instrument_db to every public method"""
+    for name, value in list(vars(cls).items()):
+        if callable(value) and not name.startswith('_'):
+            setattr(cls, name, instrument_db(f"{cls.__name__}.{name}")(value))
+    return cls
+
+
+def summarize(histogram):
+    """{labels: {'count', 'mean_ms', 'p50_ms', 'p95_ms'}} from a histogram's buckets"""
+    summary = {}
+    for key, state in histogram.samples().items():
+        count = state[-1]
+        summary[key] = {
+            'count': count,
+            'mean_ms': 1000 * state[-2] / count if count else None,
+            'p50_ms': 1000 * histogram.quantile(0.5, state) if count else None,
+            'p95_ms': 1000 * histogram.quantile(0.95, state) if count else None,
+        }
+    return summary
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=None, host=None):
+    """Serve /metrics from a daemon thread; later calls in the same process reuse the server"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            port = int(port if port is not None else os.getenv("METRICS_PORT", 9108))
+            host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True, name="metrics-server").start()
+        return _server
@@ -4,18 +4,24 @@ import sqlite3
 import json
 from datetime import datetime
 
-# Initialize database
+SCHEMA_VERSION = 1
+
+# Initialize database; cache_resource runs this once per process rather than
+# on every rerun, and user_version skips the DDL once the file is set up
+@st.cache_resource
 def init_db():
     conn = sqlite3.connect('weather_data.db')
     c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS weather_entries
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  location TEXT,
-                  temperature REAL,
-                  conditions TEXT,
-                  notes TEXT,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    conn.commit()
+    if c.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+        c.execute('''CREATE TABLE IF NOT EXISTS weather_entries
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      location TEXT,
+                      temperature REAL,
+                      conditions TEXT,
+                      notes TEXT,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
     conn.close()
 
 init_db()
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+
+import streamlit.components.v1 as components
+
+from response_cache import TTLCache
+from sqlite3_utils import connection
+
+MAP_WIDTH = 700
+MAP_HEIGHT = 500
+
+# Rendered map HTML, most recently used kept; maps don't expire, they are
+# keyed on everything that goes into them
+map_html_cache = TTLCache(
+    max_entries=int(os.getenv("MAP_CACHE_ENTRIES", 128)),
+    max_bytes=int(os.getenv("MAP_CACHE_BYTES", 32 * 1024 * 1024)),
+)
+
+# Most markers an overview map embeds; beyond this points are aggregated into grid cells in SQL
+MAX_MAP_MARKERS = int(os.getenv("MAX_MAP_MARKERS", 2000))
+
+# Grid cell sizes in degrees, tried from finest to coarsest
+GRID_CELL_SIZES = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+# (table, label expression) for each overview map source
+MAP_SOURCES = {
+    'locations': ('saved_locations', 'name'),
+    'queries': ('weather_queries', 'location'),
+}
+
+
+def content_hash(value):
+    """Stable short hash of JSON-serializable map inputs"""
+    encoded = json.dumps(value, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def figure_html(m):
+    """Full HTML document for a folium map, as folium_static would embed it"""
+    import folium
+
+    return folium.Figure().add_child(m).render()
+
+
+def cached_map_html(key, build):
+    """Return cached HTML for key, or build(), render and cache it"""
+    html = map_html_cache.get(key)
+    if html is None:
+        html = figure_html(build())
+        map_html_cache.set(key, html, size=len(html))
+    return html
+
+
+def show_map_html(html, height=MAP_HEIGHT, width=MAP_WIDTH):
+    components.html(html, height=height + 10, width=width)
+
+
+def location_map_html(lat, lon, properties=None, zoom=12, popup=None, tooltip="Weather Location"):
+    """HTML for a single-location map, cached on (lat, lon, zoom, hash of everything else)"""
+    popup = popup or f"Lat: {lat}, Lon: {lon}"
+
+    def build():
+        import folium
+
+        m = folium.Map(location=[lat, lon], zoom_start=zoom)
+        folium.Marker([lat, lon], popup=popup, tooltip=tooltip).add_to(m)
+        if properties:
+            if 'city' in properties:
+                folium.CircleMarker(
+                    location=[lat, lon],
+                    radius=5,
+                    popup=f"{properties.get('city', 'Location')}",
+                    color='blue',
+                    fill=True,
+                    fill_color='blue'
+                ).add_to(m)
+            if 'country' in properties:
+                folium.Marker(
+                    [lat, lon],
+                    icon=folium.DivIcon(
+                        html=f"""<div style="font-size: 12pt; color: black">{properties.get('country', '')}</div>"""
+                    )
+                ).add_to(m)
+        return m
+
+    key = ('location', float(lat), float(lon), zoom,
+           content_hash([properties.get(field) for field in ('city', 'country')] if properties else None)
+           + content_hash([popup, tooltip]))
+    return cached_map_html(key, build)
+
+
+def markers_map_html(markers, cluster=True):
+    """HTML for a map of (lat, lon, popup, tooltip) markers fitted to their bounds"""
+    markers = list(markers)
+
+    def build():
+        import folium
+        from folium.plugins import MarkerCluster
+
+        m = folium.Map()
+        layer = MarkerCluster().add_to(m) if cluster else m
+        for lat, lon, popup, tooltip in markers:
+            folium.Marker([lat, lon], popup=popup, tooltip=tooltip).add_to(layer)
+        if markers:
+            m.fit_bounds([[min(marker[0] for marker in markers), min(marker[1] for marker in markers)],
+                          [max(marker[0] for marker in markers), max(marker[1] for marker in markers)]])
+        return m
+
+    return cached_map_html(('markers', cluster, content_hash(markers)), build)
+
+
+# Aggregated overview points per (source, data fingerprint)
+_aggregate_cache = TTLCache(max_entries=16, max_bytes=16 * 1024 * 1024)
+
+# Overview markers are created client-side from a compact JS array; clusters
+# of points become circles sized by how many they hold
+OVERVIEW_MARKER_CALLBACK = """
+function (row) {
+    var marker = row[2] > 1
+        ? L.circleMarker(new L.LatLng(row[0], row[1]),
+                         {radius: Math.min(30, 6 + 4 * Math.log10(row[2])), color: 'blue', fillOpacity: 0.6})
+        : L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip(row[3]);
+    marker.bindPopup(row[3]);
+    return marker;
+}"""
+
+
+def _grid_groups(c, table, label, cell, limit):
+    c.execute(f'''SELECT AVG(latitude), AVG(longitude), COUNT(*), MIN({label}) FROM {table}
+                  WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                  GROUP BY CAST(latitude / ? + 1000000 AS INTEGER),
+                           CAST(longitude / ? + 1000000 AS INTEGER)
+                  LIMIT ?''', (cell, cell, limit))
+    return c.fetchall()
+
+
+def aggregate_points(source, db_name='weather_app.db', max_markers=MAX_MAP_MARKERS):
+    """Group a source's coordinates into at most max_markers points, in SQL.
+    
+    Returns (cell size in degrees or None, rows of (lat, lon, count, label));
+    lat/lon is the mean of the cell's points and label a sample name. Results
+    are cached until the table's row count, max id or coordinate totals change.
+    """
+    table, label = MAP_SOURCES[source]
+    with connection(db_name) as conn:
+        c = conn.cursor()
+        c.execute(f'''SELECT COUNT(*), MAX(id), TOTAL(latitude), TOTAL(longitude),
+                             MIN(latitude), MAX(latitude), MIN(longitude), MAX(longitude)
+                      FROM {table} WHERE latitude IS NOT NULL AND longitude IS NOT NULL''')
+        stats = c.fetchone()
+        key = (db_name, source, max_markers) + stats[:4]
+        cached = _aggregate_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        count, _, _, _, lat_min, lat_max, lon_min, lon_max = stats
+        result = None
+        if count <= max_markers:
+            c.execute(f'''SELECT latitude, longitude, 1, {label} FROM {table}
+                          WHERE latitude IS NOT NULL AND longitude IS NOT NULL''')
+            result = (None, c.fetchall())
+        else:
+            # The coarsest cell needed is bounded by the bounding box; points usually
+            # cluster, so step down to finer cells while the groups still fit
+            sizes = [cell for cell in GRID_CELL_SIZES
+                     if ((lat_max - lat_min) / cell + 1) * ((lon_max - lon_min) / cell + 1) > max_markers]
+            sizes = GRID_CELL_SIZES[len(sizes):len(sizes) + 1] + tuple(reversed(sizes))
+            for cell in sizes:
+                rows = _grid_groups(c, table, label, cell, max_markers + 1)
+                if len(rows) > max_markers:
+                    break
+                result = (cell, rows)
+            if result is None:
+                result = (GRID_CELL_SIZES[-1], _grid_groups(c, table, label, GRID_CELL_SIZES[-1], max_markers))
+    _aggregate_cache.set(key, result)
+    return result
+
+
+def overview_map_html(source, db_name='weather_app.db', max_markers=MAX_MAP_MARKERS):
+    """Clustered map of every saved location or query, aggregated server-side.
+    
+    Returns (html, cell size, total points). Markers are shipped as one JS
+    array and clustered in the browser; the HTML is cached on the aggregated
+    rows, so it is only rebuilt when the data behind it changes.
+    """
+    cell, rows = aggregate_points(source, db_name, max_markers)
+    noun = 'locations' if source == 'locations' else 'queries'
+    
+    def build():
+        import folium
+        from folium.plugins import FastMarkerCluster
+        
+        m = folium.Map()
+        data = [[lat, lon, count, str(label) if count == 1 else f"{count} {noun} near {label}"]
+                for lat, lon, count, label in rows]
+        FastMarkerCluster(data, callback=OVERVIEW_MARKER_CALLBACK).add_to(m)
+        if rows:
+            m.fit_bounds([[min(row[0] for row in rows), min(row[1] for row in rows)],
+                          [max(row[0] for row in rows), max(row[1] for row in rows)]])
+        return m
+    
+    html = cached_map_html(('overview', source, cell, content_hash(rows)), build)
+    return html, cell, sum(row[2] for row in rows)
@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used when it isn't installed
+    zstandard = None
+
+# Format tags stored in weather_queries.payload_format (NULL means plain JSON text)
+PLAIN_JSON = 'json'
+ZLIB_JSON = 'zlib-json'
+ZSTD_JSON = 'zstd-json'
+COLUMNAR_ZLIB = 'columnar-zlib'
+AUTO = 'auto'
+
+FORMATS = (PLAIN_JSON, ZLIB_JSON, ZSTD_JSON, COLUMNAR_ZLIB)
+
+# Format used for new rows; 'auto' packs forecast lists column-wise and
+# zlib-compresses everything else (zstd gains nothing on payloads this small)
+DEFAULT_FORMAT = os.getenv("PAYLOAD_FORMAT", AUTO)
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _forecast_items(weather_data):
+    """Return the timestep list if the payload is a forecast or date-range list"""
+    if isinstance(weather_data, dict) and isinstance(weather_data.get('list'), list):
+        items = weather_data['list']
+    elif isinstance(weather_data, list):
+        items = weather_data
+    else:
+        return None
+    return items if items and all(isinstance(item, dict) for item in items) else None
+
+
+def _flatten(item, prefix=()):
+    """Flatten nested dicts into {path tuple: leaf}; lists and empty dicts are leaves"""
+    flat = {}
+    for key, value in item.items():
+        path = prefix + (key,)
+        if isinstance(value, dict) and value:
+            flat.update(_flatten(value, path))
+        else:
+            flat[path] = value
+    return flat
+
+
+def pack_columns(items):
+    """Pack a list of similarly shaped dicts into one value list per key path.
+
+    Repeated keys such as main, weather, wind and dt_txt are stored once, and
+    each column holds same-typed values, which compresses far better than
+    the row-wise JSON.
+    """
+    paths = {}
+    rows = []
+    for item in items:
+        flat = _flatten(item)
+        rows.append(flat)
+        for path in flat:
+            paths.setdefault(path, len(paths))
+
+    columns = [[None] * len(rows) for _ in paths]
+    absent = {}
+    for row_index, flat in enumerate(rows):
+        for path, column_index in paths.items():
+            if path in flat:
+                columns[column_index][row_index] = flat[path]
+            else:
+                absent.setdefault(str(column_index), []).append(row_index)
+
+    return {'n': len(rows), 'paths': [list(path) for path in paths],
+            'columns': columns, 'absent': absent}
+
+
+def unpack_columns(packed):
+    """Inverse of pack_columns"""
+    absent = {int(index): set(rows) for index, rows in packed['absent'].items()}
+    items = []
+    for row_index in range(packed['n']):
+        item = {}
+        for column_index, path in enumerate(packed['paths']):
+            if row_index in absent.get(column_index, ()):
+                continue
+            node = item
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = packed['columns'][column_index][row_index]
+        items.append(item)
+    return items
+
+
+def encode_payload(weather_data, fmt=None):
+    """Serialize a payload; returns (value to store, format tag)"""
+    fmt = fmt or DEFAULT_FORMAT
+    if fmt == AUTO:
+        fmt = COLUMNAR_ZLIB if _forecast_items(weather_data) else ZLIB_JSON
+    if fmt == ZSTD_JSON and zstandard is None:
+        fmt = ZLIB_JSON
+
+    if fmt == PLAIN_JSON:
+        return json.dumps(weather_data), PLAIN_JSON
+    if fmt == ZLIB_JSON:
+        return zlib.compress(_dumps(weather_data), ZLIB_LEVEL), ZLIB_JSON
+    if fmt == ZSTD_JSON:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(_dumps(weather_data)), ZSTD_JSON
+    if fmt == COLUMNAR_ZLIB:
+        items = _forecast_items(weather_data)
+        if items is None:
+            return encode_payload(weather_data, ZLIB_JSON)
+        if isinstance(weather_data, list):
+            envelope = {'list': pack_columns(items)}
+        else:
+            envelope = {'meta': {k: v for k, v in weather_data.items() if k != 'list'},
+                        'list': pack_columns(items)}
+        return zlib.compress(_dumps(envelope), ZLIB_LEVEL), COLUMNAR_ZLIB
+    raise ValueError(f"Unknown payload format: {fmt}")
+
+
+def decode_payload(value, fmt=None):
+    """Deserialize a stored payload; rows without a format tag are plain JSON"""
+    if value is None:
+        return None
+    if fmt in (None, PLAIN_JSON):
+        return json.loads(value)
+    if fmt == ZLIB_JSON:
+        return json.loads(zlib.decompress(value))
+    if fmt == ZSTD_JSON:
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is required to read zstd-json payloads")
+        return json.loads(zstandard.ZstdDecompressor().decompress(value))
+    if fmt == COLUMNAR_ZLIB:
+        envelope = json.loads(zlib.decompress(value))
+        items = unpack_columns(envelope['list'])
+        if 'meta' not in envelope:
+            return items
+        weather_data = dict(envelope['meta'])
+        weather_data['list'] = items
+        return weather_data
+    raise ValueError(f"Unknown payload format: {fmt}")
+
+
+def decode_payload_text(value, fmt=None):
+    """Return a stored payload as JSON text, without re-serializing plain rows"""
+    if fmt in (None, PLAIN_JSON):
+        return value
+    return json.dumps(decode_payload(value, fmt))
+
+
+def reencode_payloads(db_name='weather_app.db', fmt=None, batch_size=500, progress=None):
+    """Rewrite stored payloads into another format, one batch per transaction.
+
+    Rows that would not get smaller are left alone unless the target is plain
+    JSON. Returns (rows rewritten, bytes before, bytes after).
+    """
+    from sqlite3_utils import connection, ensure_schema, payload_size
+    
+    ensure_schema(db_name)
+    target = fmt or DEFAULT_FORMAT
+    rewritten = before = after = 0
+    last_id = 0
+    while True:
+        with connection(db_name) as conn:
+            c = conn.cursor()
+            c.execute('''SELECT id, weather_data, payload_format FROM weather_queries
+                         WHERE id > ? ORDER BY id LIMIT ?''', (last_id, batch_size))
+            rows = c.fetchall()
+            if not rows:
+                break
+            updates = []
+            for query_id, value, current in rows:
+                if value is None or (current or PLAIN_JSON) == target:
+                    continue
+                weather_data = decode_payload(value, current)
+                new_value, new_format = encode_payload(weather_data, target)
+                payload_bytes = payload_size(new_value)
+                if new_format == (current or PLAIN_JSON) or (
+                        new_format != PLAIN_JSON and payload_bytes >= payload_size(value)):
+                    continue
+                updates.append((new_value, new_format, payload_bytes, query_id))
+                before += payload_size(value)
+                after += payload_bytes
+            c.executemany('''UPDATE weather_queries
+                             SET weather_data = ?, payload_format = ?, payload_bytes = ?
+                             WHERE id = ?''', updates)
+            rewritten += len(updates)
+            last_id = rows[-1][0]
+        if progress:
+            progress(rewritten, last_id)
+    return rewritten, before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode stored weather_data payloads")
+    parser.add_argument("command", choices=["reencode"])
+    parser.add_argument("--db", default="weather_app.db")
+    parser.add_argument("--format", default=DEFAULT_FORMAT, choices=FORMATS + (AUTO,))
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to return freed pages")
+    args = parser.parse_args()
+
+    rewritten, before, after = reencode_payloads(
+        args.db, args.format, args.batch_size,
+        progress=lambda count, last_id: print(f"\rre-encoded {count} rows (id {last_id})", end="", flush=True))
+    print(f"\nre-encoded {rewritten} rows: {before} -> {after} bytes")
+    if args.vacuum:
+        from sqlite3_utils import connection
+        
+        with connection(args.db) as conn:
+            conn.execute('VACUUM')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+
+from payload_codec import encode_payload, decode_payload
+from response_cache import COORD_PRECISION, coordinate_key, response_cache, store_response
+from sqlite3_utils import connection, ensure_schema, LOCATION_MATCH_RADIUS_KM
+from spatial_index import within_radius
+
+logger = logging.getLogger(__name__)
+
+# Seconds between refresh cycles, and how recently a location must have been
+# viewed to be refreshed at all
+REFRESH_INTERVAL = int(os.getenv("REFRESH_INTERVAL", 15 * 60))
+REFRESH_ACTIVE_WINDOW = int(os.getenv("REFRESH_ACTIVE_WINDOW", 7 * 24 * 60 * 60))
+REFRESH_JITTER = float(os.getenv("REFRESH_JITTER", 0.1))  # fraction of the interval
+
+# Endpoints whose payloads are handed to on_refresh for alert evaluation
+ALERT_ENDPOINTS = ('current_weather', 'forecast')
+
+
+class SnapshotStore:
+    """Latest upstream responses per endpoint and rounded coordinates, kept in SQLite"""
+
+    def __init__(self, db_name='weather_app.db', precision=COORD_PRECISION):
+        self.db_name = db_name
+        self.precision = precision
+
+    def coordinate_keys(self, lat, lon):
+        return round(float(lat), self.precision), round(float(lon), self.precision)
+
+    def get(self, endpoint, lat, lon):
+        """Return (payload, fetched_at) or None"""
+        lat_key, lon_key = self.coordinate_keys(lat, lon)
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            c.execute('''SELECT payload, payload_format, fetched_at FROM weather_snapshots
+                         WHERE endpoint = ? AND lat_key = ? AND lon_key = ?''',
+                      (endpoint, lat_key, lon_key))
+            row = c.fetchone()
+        if not row:
+            return None
+        return decode_payload(row[0], row[1]), row[2]
+
+    def put(self, endpoint, lat, lon, payload, fetched_at=None):
+        lat_key, lon_key = self.coordinate_keys(lat, lon)
+        value, payload_format = encode_payload(payload)
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            c.execute('''INSERT OR REPLACE INTO weather_snapshots
+                         (endpoint, lat_key, lon_key, payload, payload_format, fetched_at)
+                         VALUES (?, ?, ?, ?, ?, ?)''',
+                      (endpoint, lat_key, lon_key, value, payload_format, fetched_at or time.time()))
+
+
+def mark_locations_viewed(location_ids, db_name='weather_app.db'):
+    """Record that saved locations were just viewed so the scheduler keeps them warm"""
+    now = time.time()
+    with connection(db_name) as conn:
+        c = conn.cursor()
+        c.executemany('''UPDATE saved_locations SET last_viewed_at = ? WHERE id = ?''',
+                      [(now, location_id) for location_id in location_ids])
+
+
+class RefreshScheduler:
+    """Periodically pre-fetches weather for recently viewed saved locations.
+
+    fetchers maps an endpoint name (as used by response_cache) to an uncached
+    function(lat, lon). Requests within a cycle are spread evenly over most of
+    the interval, with jitter, so a large location list never bursts the
+    provider quotas. At the end of a cycle on_refresh, if given, receives
+    {location_id: [payloads]} for everything that was fetched.
+    """
+
+    def __init__(self, fetchers, db_name='weather_app.db', interval=REFRESH_INTERVAL,
+                 active_window=REFRESH_ACTIVE_WINDOW, jitter=REFRESH_JITTER, store=None,
+                 on_refresh=None):
+        self.fetchers = fetchers
+        self.db_name = db_name
+        self.interval = interval
+        self.active_window = active_window
+        self.jitter = jitter
+        self.store = store or SnapshotStore(db_name)
+        self.on_refresh = on_refresh
+        self._stop = threading.Event()
+        self._thread = None
+
+    def active_locations(self):
+        """Saved locations viewed within the active window"""
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            c.execute('''SELECT id, latitude, longitude FROM saved_locations
+                         WHERE last_viewed_at >= ?''', (time.time() - self.active_window,))
+            return c.fetchall()
+
+    def _wait(self, seconds):
+        """Sleep unless stopped; returns True if the scheduler was stopped"""
+        return self._stop.wait(max(0.0, seconds))
+
+    def run_cycle(self, spread=None):
+        """Refresh every active location once; returns {endpoint: refreshed count}"""
+        locations = self.active_locations()
+        # Deduplicate locations that share a rounded cache key
+        unique = {}
+        for location_id, lat, lon in locations:
+            unique.setdefault(self.store.coordinate_keys(lat, lon), (lat, lon, []))[2].append(location_id)
+        targets = list(unique.values())
+        random.shuffle(targets)
+
+        if spread is None:
+            spread = self.interval * 0.8
+        step = spread / len(targets) if targets else 0
+        refreshed = {endpoint: 0 for endpoint in self.fetchers}
+        observations = {}
+        started = time.monotonic()
+
+        for index, (lat, lon, location_ids) in enumerate(targets):
+            offset = index * step + random.uniform(0, step * self.jitter)
+            if self._wait(started + offset - time.monotonic()):
+                break
+            for endpoint, fetch in self.fetchers.items():
+                try:
+                    payload = fetch(lat, lon)
+                except Exception:
+                    logger.exception("refresh of %s at %s,%s failed", endpoint, lat, lon)
+                    continue
+                if payload is None:
+                    continue
+                fetched_at = time.time()
+                self.store.put(endpoint, lat, lon, payload, fetched_at)
+                store_response(endpoint, lat, lon, payload, fetched_at)
+                refreshed[endpoint] += 1
+                if endpoint not in ALERT_ENDPOINTS:
+                    continue
+                for location_id in location_ids:
+                    observations.setdefault(location_id, []).append(payload)
+
+        if self.on_refresh and observations:
+            try:
+                self.on_refresh(observations)
+            except Exception:
+                logger.exception("post-refresh hook failed")
+        return refreshed
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                refreshed = self.run_cycle()
+                logger.info("refresh cycle done: %s", refreshed)
+            except Exception:
+                logger.exception("refresh cycle failed")
+            delay = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+            if self._wait(started + delay - time.monotonic()):
+                break
+
+    def start(self):
+        """Run in a daemon thread inside the current process"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="weather-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+_in_process = None
+_in_process_lock = threading.Lock()
+
+
+def start_in_process(fetchers, db_name='weather_app.db', on_refresh=None):
+    """Start one scheduler per process; later calls (e.g. Streamlit reruns) reuse it"""
+    global _in_process
+    with _in_process_lock:
+        if _in_process is None:
+            _in_process = RefreshScheduler(fetchers, db_name, on_refresh=on_refresh).start()
+    return _in_process
+
+
+def default_fetchers():
+    """Uncached API helpers from weather_app, keyed by response_cache endpoint"""
+    import weather_app
+
+    return {
+        'current_weather': weather_app.get_current_weather.uncached,
+        'forecast': weather_app.get_forecast.uncached,
+        'air_quality': weather_app.get_air_quality.uncached,
+    }
+
+
+def alert_hook(db_name='weather_app.db'):
+    """on_refresh callback that evaluates weather alerts against the fetched data"""
+    from alert_engine import AlertEngine
+
+    engine = AlertEngine(db_name)
+
+    def evaluate(observations):
+        outcome = engine.evaluate(observations)
+        logger.info("alerts: %d evaluated, %d fired, %d cleared", outcome['evaluated'],
+                    len(outcome['fired']), len(outcome['cleared']))
+    return evaluate
+
+
+def observation_hook(db_name='weather_app.db', radius_km=LOCATION_MATCH_RADIUS_KM):
+    """Fetch listener (see response_cache.set_fetch_listener) that evaluates alerts on new data.
+
+    Current weather and forecasts fetched outside the scheduler, by the app
+    pages or ingest.py, are checked against the alerts of every saved
+    location within radius_km of where they were fetched. As in run_cycle,
+    the other alert endpoint's latest cached payload for the same
+    coordinates is evaluated alongside, so a current reading can't clear an
+    alert a forecast fired moments before (or the reverse).
+    """
+    evaluate = None
+
+    def listener(endpoint, lat, lon, payload):
+        nonlocal evaluate
+        if endpoint not in ALERT_ENDPOINTS:
+            return
+        try:
+            with connection(db_name) as conn:
+                location_ids = [location_id for _, location_id in
+                                within_radius(conn.cursor(), 'saved_locations', lat, lon, radius_km)]
+            if not location_ids:
+                return
+            payloads = [payload]
+            for other in ALERT_ENDPOINTS:
+                cached = response_cache.get(coordinate_key(other, lat, lon)) if other != endpoint else None
+                if cached is not None:
+                    payloads.append(cached)
+            if evaluate is None:
+                evaluate = alert_hook(db_name)
+            evaluate({location_id: payloads for location_id in location_ids})
+        except Exception:
+            logger.exception("alert check after fetching %s at %s,%s failed", endpoint, lat, lon)
+    return listener
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep weather for saved locations warm in the local store")
+    parser.add_argument("--db", default="weather_app.db")
+    parser.add_argument("--interval", type=int, default=REFRESH_INTERVAL)
+    parser.add_argument("--once", action="store_true", help="run a single cycle without spreading requests")
+    parser.add_argument("--no-alerts", action="store_true", help="don't evaluate weather alerts after each cycle")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    ensure_schema(args.db)
+    scheduler = RefreshScheduler(default_fetchers(), args.db, interval=args.interval,
+                                 on_refresh=None if args.no_alerts else alert_hook(args.db))
+    if args.once:
+        print(scheduler.run_cycle(spread=0))
+        return
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import CACHE_LOOKUPS
+
+# Seconds each endpoint's response stays fresh
+ENDPOINT_TTLS = {
+    'current_weather': int(os.getenv("CACHE_TTL_CURRENT_WEATHER", 10 * 60)),
+    'forecast': int(os.getenv("CACHE_TTL_FORECAST", 3 * 60 * 60)),
+    'air_quality': int(os.getenv("CACHE_TTL_AIR_QUALITY", 30 * 60)),
+    'timezone': int(os.getenv("CACHE_TTL_TIMEZONE", 24 * 60 * 60)),
+}
+
+# Decimal places kept when keying on coordinates (3 places is roughly 110 m)
+COORD_PRECISION = int(os.getenv("CACHE_COORD_PRECISION", 3))
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry and a memory bound"""
+
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, size=None):
+        """Store a value, evicting least recently used entries to stay in bounds"""
+        if size is None:
+            size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (expires_at, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+response_cache = TTLCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 2048)),
+    max_bytes=int(os.getenv("CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+)
+
+# Per-endpoint counters; warm_hits are misses answered by the snapshot store
+endpoint_stats = {name: {'hits': 0, 'misses': 0, 'warm_hits': 0} for name in ENDPOINT_TTLS}
+_stats_lock = threading.Lock()
+
+# Optional second tier consulted on a miss, e.g. the refresh scheduler's
+# snapshot table. Must provide get(endpoint, lat, lon) -> (value, fetched_at) or None.
+_snapshot_store = None
+
+
+def set_snapshot_store(store):
+    global _snapshot_store
+    _snapshot_store = store
+
+
+# Optional callback for every response fetched upstream on a miss, e.g. to
+# evaluate weather alerts; called as listener(endpoint, lat, lon, value)
+_fetch_listener = None
+
+
+def set_fetch_listener(listener):
+    global _fetch_listener
+    _fetch_listener = listener
+
+
+def _count(endpoint, outcome):
+    with _stats_lock:
+        counters = endpoint_stats.setdefault(endpoint, {'hits': 0, 'misses': 0, 'warm_hits': 0})
+        counters[outcome] += 1
+    CACHE_LOOKUPS.inc(endpoint=endpoint, outcome=outcome)
+
+
+def coordinate_key(endpoint, lat, lon, precision=None):
+    """Cache key for an endpoint at coordinates rounded to the configured precision"""
+    if precision is None:
+        precision = COORD_PRECISION
+    return (endpoint, round(float(lat), precision), round(float(lon), precision))
+
+
+def store_response(endpoint, lat, lon, value, fetched_at=None):
+    """Put a response fetched elsewhere (e.g. by the refresh scheduler) into the cache"""
+    ttl = ENDPOINT_TTLS.get(endpoint)
+    if fetched_at is not None and ttl:
+        ttl -= time.time() - fetched_at
+        if ttl <= 0:
+            return
+    response_cache.set(coordinate_key(endpoint, lat, lon), value, ttl)
+
+
+def cached_by_coordinates(endpoint):
+    """Cache a (lat, lon) API helper's non-empty responses for the endpoint's TTL"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(lat, lon):
+            key = coordinate_key(endpoint, lat, lon)
+            value = response_cache.get(key)
+            if value is not None:
+                _count(endpoint, 'hits')
+                return value
+
+            if _snapshot_store is not None:
+                snapshot = _snapshot_store.get(endpoint, lat, lon)
+                if snapshot is not None:
+                    value, fetched_at = snapshot
+                    if time.time() - fetched_at < ENDPOINT_TTLS.get(endpoint, 0):
+                        _count(endpoint, 'warm_hits')
+                        store_response(endpoint, lat, lon, value, fetched_at)
+                        return value
+
+            _count(endpoint, 'misses')
+            value = func(lat, lon)
+            if value is not None:
+                response_cache.set(key, value, ENDPOINT_TTLS.get(endpoint))
+                if _fetch_listener is not None:
+                    _fetch_listener(endpoint, lat, lon, value)
+            return value
+        wrapper.uncached = func
+        return wrapper
+    return decorator
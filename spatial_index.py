@@ -0,0 +1,136 @@
+import json
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Any circle this wide covers the whole globe
+HALF_CIRCUMFERENCE_KM = math.pi * EARTH_RADIUS_KM
+
+# R*Tree kept in step with each table's latitude/longitude columns (migration v10)
+RTREE_TABLES = {
+    'saved_locations': 'saved_locations_rtree',
+    'weather_queries': 'weather_queries_rtree',
+}
+
+# First radius tried by a nearest-neighbour search; it grows 4x per miss
+NEAREST_START_KM = 5.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two points in degrees"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) boxes covering a circle, split at the antimeridian"""
+    if radius_km >= HALF_CIRCUMFERENCE_KM:
+        return [(-90.0, 90.0, -180.0, 180.0)]
+    angular = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        # The circle contains a pole, so it spans every longitude
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+
+    dlon = math.degrees(math.asin(min(1.0, math.sin(angular) / math.cos(math.radians(lat)))))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0:
+        return [(min_lat, max_lat, min_lon + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360.0)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def within_radius(c, table, lat, lon, radius_km):
+    """[(distance_km, id)] of table rows within radius_km of (lat, lon), nearest first.
+
+    The R*Tree narrows the search to the circle's bounding box; candidates
+    are then filtered on their exact haversine distance.
+    """
+    rtree = RTREE_TABLES[table]
+    matches = {}
+    for min_lat, max_lat, min_lon, max_lon in bounding_boxes(lat, lon, radius_km):
+        c.execute(f'''SELECT t.id, t.latitude, t.longitude FROM {rtree}
+                      JOIN {table} t ON t.id = {rtree}.id
+                      WHERE {rtree}.min_lat <= ? AND {rtree}.max_lat >= ?
+                        AND {rtree}.min_lon <= ? AND {rtree}.max_lon >= ?''',
+                  (max_lat, min_lat, max_lon, min_lon))
+        for row_id, row_lat, row_lon in c.fetchall():
+            distance = haversine_km(lat, lon, row_lat, row_lon)
+            if distance <= radius_km:
+                matches[row_id] = distance
+    return sorted((distance, row_id) for row_id, distance in matches.items())
+
+
+def nearest(c, table, lat, lon, k=1, max_radius_km=HALF_CIRCUMFERENCE_KM):
+    """[(distance_km, id)] of the k rows nearest (lat, lon), at most max_radius_km away.
+
+    Searches a radius that grows until it holds k rows: anything closer than
+    the k-th match is inside the circle, so the answer is exact.
+    """
+    radius = min(NEAREST_START_KM, max_radius_km)
+    while True:
+        matches = within_radius(c, table, lat, lon, radius)
+        if len(matches) >= k or radius >= max_radius_km:
+            return matches[:k]
+        radius = min(radius * 4, max_radius_km)
+
+
+def recent_within_radius(c, table, columns, lat, lon, radius_km, limit, alias='t'):
+    """The newest `limit` rows within radius_km of (lat, lon), as dicts with distance_km.
+
+    columns must include the alias's id, created_at, latitude and longitude.
+    R*Tree candidates are sorted and limited in SQL, over-fetching since a
+    bounding box holds more than its circle; when the distance filter still
+    leaves fewer than limit, the next batch continues after the last row.
+    """
+    rtree = RTREE_TABLES[table]
+    boxes = bounding_boxes(lat, lon, radius_km)
+    candidates = ' UNION ALL '.join(
+        f'SELECT id FROM {rtree} WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?'
+        for _ in boxes)
+    box_params = [value for min_lat, max_lat, min_lon, max_lon in boxes
+                  for value in (max_lat, min_lat, max_lon, min_lon)]
+    batch = max(2 * limit, 10)
+    rows = []
+    cursor = ()
+    while len(rows) < limit:
+        after = f'WHERE ({alias}.created_at, {alias}.id) < (?, ?)' if cursor else ''
+        # CROSS JOIN keeps the candidates as the outer loop rather than walking the table by date
+        c.execute(f'''SELECT {columns} FROM ({candidates}) candidates
+                      CROSS JOIN {table} {alias} ON {alias}.id = candidates.id
+                      {after}
+                      ORDER BY {alias}.created_at DESC, {alias}.id DESC LIMIT ?''',
+                  box_params + list(cursor) + [batch])
+        names = [description[0] for description in c.description]
+        fetched = [dict(zip(names, row)) for row in c.fetchall()]
+        for row in fetched:
+            distance = haversine_km(lat, lon, row['latitude'], row['longitude'])
+            if distance <= radius_km:
+                row['distance_km'] = distance
+                rows.append(row)
+        if len(fetched) < batch:
+            break
+        cursor = (fetched[-1]['created_at'], fetched[-1]['id'])
+    return rows[:limit]
+
+
+def rows_by_distance(c, table, columns, matches, alias='t'):
+    """Fetch `columns` (table aliased as alias) for within_radius/nearest matches.
+
+    Returns dicts nearest first, each with its distance_km.
+    """
+    if not matches:
+        return []
+    distances = {row_id: distance for distance, row_id in matches}
+    c.execute(f'''SELECT {columns} FROM {table} {alias}
+                  WHERE {alias}.id IN (SELECT value FROM json_each(?))''', (json.dumps(list(distances)),))
+    names = [description[0] for description in c.description]
+    rows = [dict(zip(names, row)) for row in c.fetchall()]
+    for row in rows:
+        row['distance_km'] = distances[row['id']]
+    return sorted(rows, key=lambda row: row['distance_km'])
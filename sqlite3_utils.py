@@ -1,7 +1,541 @@
 import sqlite3
 import json
+import os
+import queue
+import re
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
 
+from instrumentation import instrument_methods, record_db_changes
+from forecast_points import POINT_COLUMNS, location_key, point_rows, write_points
+from payload_codec import encode_payload, decode_payload_text
+from spatial_index import RTREE_TABLES, within_radius, nearest, recent_within_radius, rows_by_distance
+
+# Settings applied to every pooled connection
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    f'PRAGMA cache_size=-{int(os.getenv("SQLITE_CACHE_KB", 16384))}',
+    f'PRAGMA mmap_size={int(os.getenv("SQLITE_MMAP_BYTES", 256 * 1024 * 1024))}',
+)
+
+
+class ConnectionPool:
+    """Small pool of long-lived connections to one database file"""
+
+    def __init__(self, db_name, max_size=None):
+        self.db_name = db_name
+        self.max_size = max_size or int(os.getenv("SQLITE_POOL_SIZE", 8))
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_name, timeout=5, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.max_size:
+                self._created += 1
+                return self._open()
+        return self._idle.get(timeout=30)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name='weather_app.db'):
+    """Return the process-wide pool for a database file"""
+    key = os.path.abspath(db_name)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(key, ConnectionPool(db_name))
+    return pool
+
+
+@contextmanager
+def connection(db_name='weather_app.db'):
+    """Borrow a pooled connection; commits on success and rolls back on error"""
+    pool = get_pool(db_name)
+    conn = pool.acquire()
+    try:
+        changes = conn.total_changes
+        with conn:
+            yield conn
+        record_db_changes(conn.total_changes - changes)
+    finally:
+        pool.release(conn)
+
+
+# Rows written per transaction by the WeatherDB bulk methods
+BULK_CHUNK_SIZE = int(os.getenv("DB_BULK_CHUNK_SIZE", 500))
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size items from any iterable or generator"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _as_args(item, fields):
+    """Positional values for fields from a mapping or a tuple in the same order"""
+    if isinstance(item, Mapping):
+        return tuple(item.get(field) for field in fields)
+    return tuple(item) + (None,) * (len(fields) - len(item))
+
+
+def _inserted_ids(c, count):
+    """Ids of the last `count` rows inserted by one executemany.
+
+    Inside a write transaction nothing else can insert, so AUTOINCREMENT hands
+    out consecutive ids ending at last_insert_rowid().
+    """
+    last = c.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return list(range(last - count + 1, last + 1))
+
+
+# Precomputed per-query summary columns, filled at save time
+SUMMARY_FIELDS = ('temp_min', 'temp_max', 'temp_mean', 'dominant_condition',
+                  'timestep_count', 'payload_bytes')
+SUMMARY_ASSIGNMENTS = ', '.join(f"{field} = ?" for field in SUMMARY_FIELDS)
+
+# Everything list and search views need, without the weather_data blob
+LIST_COLUMNS = ('''q.id, q.location, q.latitude, q.longitude, q.query_date, q.date_from,
+                  q.date_to, q.notes, q.tags, q.created_at, ''' +
+                ', '.join(f"q.{field}" for field in SUMMARY_FIELDS))
+
+# Queries saved within this distance of a location count as its history
+LOCATION_MATCH_RADIUS_KM = float(os.getenv("LOCATION_MATCH_RADIUS_KM", 0.5))
+
+
+def payload_size(payload):
+    """Stored size in bytes of a JSON text or encoded payload"""
+    if not payload:
+        return 0
+    return len(payload.encode('utf-8') if isinstance(payload, str) else payload)
+
+
+def summarize_weather_data(weather_data, payload=None):
+    """Summarize a current, forecast or date-range payload as a SUMMARY_FIELDS tuple"""
+    from forecast_frame import ForecastFrame
+
+    return ForecastFrame.from_payload(weather_data).summary() + (payload_size(payload),)
+
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+def _migrate_v1(c):
+    """Base tables"""
+    # Main weather queries table
+    c.execute('''CREATE TABLE IF NOT EXISTS weather_queries
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  location TEXT,
+                  latitude REAL,
+                  longitude REAL,
+                  query_date TEXT,
+                  date_from TEXT,
+                  date_to TEXT,
+                  weather_data TEXT,
+                  notes TEXT,
+                  tags TEXT,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
+    # User preferences table
+    c.execute('''CREATE TABLE IF NOT EXISTS user_preferences
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  temperature_unit TEXT DEFAULT 'celsius',
+                  wind_speed_unit TEXT DEFAULT 'm/s',
+                  pressure_unit TEXT DEFAULT 'hPa',
+                  theme TEXT DEFAULT 'light')''')
+    
+    # Locations table for quick access
+    c.execute('''CREATE TABLE IF NOT EXISTS saved_locations
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  name TEXT,
+                  address TEXT,
+                  latitude REAL,
+                  longitude REAL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
+    # Weather alerts table
+    c.execute('''CREATE TABLE IF NOT EXISTS weather_alerts
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  location_id INTEGER,
+                  alert_type TEXT,
+                  threshold_value REAL,
+                  is_active INTEGER DEFAULT 1,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY(location_id) REFERENCES saved_locations(id))''')
+    
+    # Geocoding cache keyed by normalized location text
+    c.execute('''CREATE TABLE IF NOT EXISTS geocode_cache
+                 (query_key TEXT PRIMARY KEY,
+                  latitude REAL,
+                  longitude REAL,
+                  properties TEXT,
+                  expires_at REAL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+
+def _migrate_v2(c):
+    """Secondary indexes for the list, date-range, location and alert lookups"""
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_weather_queries_created
+                 ON weather_queries(created_at, id)''')
+    # Matches the ROUND(latitude, 4)/ROUND(longitude, 4) lookups exactly
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_weather_queries_rounded_coords
+                 ON weather_queries(ROUND(latitude, 4), ROUND(longitude, 4), created_at)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_saved_locations_name
+                 ON saved_locations(name)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_weather_alerts_location_active
+                 ON weather_alerts(location_id, is_active, created_at)''')
+
+
+
+def _migrate_v3(c):
+    """Full-text index over location, tags and notes, plus the location sort index"""
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS weather_queries_fts
+                 USING fts5(location, tags, notes,
+                            content='weather_queries', content_rowid='id',
+                            tokenize='unicode61 remove_diacritics 2', prefix='2 3')''')
+    
+    # Keep the external-content index in step with weather_queries
+    c.execute('''CREATE TRIGGER IF NOT EXISTS weather_queries_fts_insert
+                 AFTER INSERT ON weather_queries BEGIN
+                     INSERT INTO weather_queries_fts(rowid, location, tags, notes)
+                     VALUES (new.id, new.location, new.tags, new.notes);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS weather_queries_fts_delete
+                 AFTER DELETE ON weather_queries BEGIN
+                     INSERT INTO weather_queries_fts(weather_queries_fts, rowid, location, tags, notes)
+                     VALUES ('delete', old.id, old.location, old.tags, old.notes);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS weather_queries_fts_update
+                 AFTER UPDATE OF location, tags, notes ON weather_queries BEGIN
+                     INSERT INTO weather_queries_fts(weather_queries_fts, rowid, location, tags, notes)
+                     VALUES ('delete', old.id, old.location, old.tags, old.notes);
+                     INSERT INTO weather_queries_fts(rowid, location, tags, notes)
+                     VALUES (new.id, new.location, new.tags, new.notes);
+                 END''')
+    c.execute('''INSERT INTO weather_queries_fts(weather_queries_fts) VALUES ('rebuild')''')
+    
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_weather_queries_location
+                 ON weather_queries(location COLLATE NOCASE, id)''')
+
+
+
+def _migrate_v4(c):
+    """Summary columns so list views never need the weather_data blob"""
+    c.execute('''ALTER TABLE weather_queries ADD COLUMN temp_min REAL''')
+    c.execute('''ALTER TABLE weather_queries ADD COLUMN temp_max REAL''')
+    c.execute('''ALTER TABLE weather_queries ADD COLUMN temp_mean REAL''')
+    c.execute('''ALTER TABLE weather_queries ADD COLUMN dominant_condition TEXT''')
+    c.execute('''ALTER TABLE weather_queries ADD COLUMN timestep_count INTEGER''')
+    c.execute('''ALTER TABLE weather_queries ADD COLUMN payload_bytes INTEGER''')
+    
+    # Backfill existing rows in batches
+    last_id = 0
+    while True:
+        c.execute('''SELECT id, weather_data FROM weather_queries
+                     WHERE id > ? ORDER BY id LIMIT 500''', (last_id,))
+        rows = c.fetchall()
+        if not rows:
+            break
+        updates = []
+        for query_id, payload in rows:
+            try:
+                weather_data = json.loads(payload) if payload else None
+            except ValueError:
+                weather_data = None
+            updates.append(summarize_weather_data(weather_data, payload) + (query_id,))
+        c.executemany(f'''UPDATE weather_queries SET {SUMMARY_ASSIGNMENTS} WHERE id = ?''', updates)
+        last_id = rows[-1][0]
+
+
+
+def _migrate_v5(c):
+    """Per-row payload format tag; NULL means plain JSON text"""
+    c.execute('''ALTER TABLE weather_queries ADD COLUMN payload_format TEXT''')
+
+
+
+def _migrate_v6(c):
+    """View tracking for saved locations and the background refresh snapshot store"""
+    c.execute('''ALTER TABLE saved_locations ADD COLUMN last_viewed_at REAL''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_saved_locations_last_viewed
+                 ON saved_locations(last_viewed_at)''')
+    
+    # Latest response per endpoint and rounded coordinate pair
+    c.execute('''CREATE TABLE IF NOT EXISTS weather_snapshots
+                 (endpoint TEXT,
+                  lat_key REAL,
+                  lon_key REAL,
+                  payload BLOB,
+                  payload_format TEXT,
+                  fetched_at REAL,
+                  PRIMARY KEY (endpoint, lat_key, lon_key))''')
+
+
+def _migrate_v7(c):
+    """Current state of each weather alert and the log of its fired/cleared transitions"""
+    c.execute('''CREATE TABLE IF NOT EXISTS weather_alert_states
+                 (alert_id INTEGER PRIMARY KEY,
+                  state INTEGER NOT NULL DEFAULT 0,
+                  last_value REAL,
+                  changed_at REAL,
+                  FOREIGN KEY(alert_id) REFERENCES weather_alerts(id))''')
+    
+    # One row per transition; the unique key makes re-evaluating the same
+    # observation a no-op
+    c.execute('''CREATE TABLE IF NOT EXISTS weather_alert_events
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  alert_id INTEGER NOT NULL,
+                  location_id INTEGER,
+                  event TEXT NOT NULL,
+                  value REAL,
+                  threshold_value REAL,
+                  observed_at REAL NOT NULL,
+                  UNIQUE (alert_id, event, observed_at),
+                  FOREIGN KEY(alert_id) REFERENCES weather_alerts(id))''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_weather_alert_events_location
+                 ON weather_alert_events(location_id, observed_at)''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS weather_alerts_state_delete
+                 AFTER DELETE ON weather_alerts BEGIN
+                     DELETE FROM weather_alert_states WHERE alert_id = old.id;
+                 END''')
+
+
+def _migrate_v8(c):
+    """Per-timestep forecast values, filled when queries are saved (see forecast_points.py)"""
+    c.execute('''CREATE TABLE IF NOT EXISTS forecast_points
+                 (query_id INTEGER NOT NULL,
+                  location_key TEXT,
+                  dt INTEGER NOT NULL,
+                  temp REAL,
+                  feels_like REAL,
+                  humidity REAL,
+                  wind_speed REAL,
+                  condition_id INTEGER,
+                  rain REAL,
+                  snow REAL,
+                  PRIMARY KEY (query_id, dt),
+                  FOREIGN KEY(query_id) REFERENCES weather_queries(id)) WITHOUT ROWID''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_forecast_points_location_dt
+                 ON forecast_points(location_key, dt)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_forecast_points_dt
+                 ON forecast_points(dt)''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS weather_queries_points_delete
+                 AFTER DELETE ON weather_queries BEGIN
+                     DELETE FROM forecast_points WHERE query_id = old.id;
+                 END''')
+
+
+def _migrate_v9(c):
+    """Resume points for batch ingestion jobs, committed with the rows they cover"""
+    c.execute('''CREATE TABLE IF NOT EXISTS ingest_checkpoints
+                 (job TEXT PRIMARY KEY,
+                  position INTEGER NOT NULL DEFAULT 0,
+                  saved INTEGER NOT NULL DEFAULT 0,
+                  failed INTEGER NOT NULL DEFAULT 0,
+                  updated_at REAL)''')
+
+
+def _migrate_v10(c):
+    """R*Tree indexes over the coordinates of saved locations and queries (see spatial_index.py)"""
+    for table, rtree in RTREE_TABLES.items():
+        c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {rtree}
+                      USING rtree(id, min_lat, max_lat, min_lon, max_lon)''')
+        
+        # Points are stored as zero-size boxes; rows without coordinates are left out
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {rtree}_insert
+                      AFTER INSERT ON {table}
+                      WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+                          INSERT INTO {rtree} VALUES (new.id, new.latitude, new.latitude,
+                                                      new.longitude, new.longitude);
+                      END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {rtree}_update
+                      AFTER UPDATE OF latitude, longitude ON {table} BEGIN
+                          DELETE FROM {rtree} WHERE id = old.id;
+                          INSERT INTO {rtree}
+                          SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+                          WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+                      END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {rtree}_delete
+                      AFTER DELETE ON {table} BEGIN
+                          DELETE FROM {rtree} WHERE id = old.id;
+                      END''')
+        c.execute(f'''INSERT OR REPLACE INTO {rtree}
+                      SELECT id, latitude, latitude, longitude, longitude FROM {table}
+                      WHERE latitude IS NOT NULL AND longitude IS NOT NULL''')
+    
+    # Location lookups go through the R*Tree now
+    c.execute('''DROP INDEX IF EXISTS idx_weather_queries_rounded_coords''')
+
+
+def _migrate_v11(c):
+    """Location sorts key on COALESCE(location, '') so a NULL location can be a page cursor"""
+    c.execute('''DROP INDEX IF EXISTS idx_weather_queries_location''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_weather_queries_location
+                 ON weather_queries(COALESCE(location, '') COLLATE NOCASE, id)''')
+
+
+SCHEMA_MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6,
+                     _migrate_v7, _migrate_v8, _migrate_v9, _migrate_v10, _migrate_v11]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+
+# Database files already at SCHEMA_VERSION in this process; Streamlit reruns
+# weather_app.py on every interaction, so later calls skip the round trip
+_schema_ready = set()
+
+
+def ensure_schema(db_name='weather_app.db'):
+    """Bring a database up to SCHEMA_VERSION, applying each pending migration once"""
+    key = os.path.abspath(db_name)
+    if key in _schema_ready:
+        return
+    with connection(db_name) as conn:
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            conn.execute('BEGIN IMMEDIATE')
+            # Re-read under the write lock in case another process migrated first
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            c = conn.cursor()
+            for number, migrate in enumerate(SCHEMA_MIGRATIONS, start=1):
+                if number > version:
+                    migrate(c)
+                    c.execute(f'PRAGMA user_version = {number}')
+    _schema_ready.add(key)
+
+
+# Sort options for saved query listings: name -> (sort key expression, direction)
+QUERY_SORTS = {
+    'Most Recent': ('q.created_at', 'DESC'),
+    'Oldest': ('q.created_at', 'ASC'),
+    # NULL locations sort as '': a NULL key would make the next page's cursor comparison NULL
+    'Location A-Z': ("COALESCE(q.location, '') COLLATE NOCASE", 'ASC'),
+    'Location Z-A': ("COALESCE(q.location, '') COLLATE NOCASE", 'DESC'),
+    # bm25 weights: location matches count most, then tags, then notes
+    'Best Match': ('bm25(weather_queries_fts, 10.0, 5.0, 1.0)', 'ASC'),
+}
+
+# When searching, time sorts follow the FTS rowid instead: ids are handed out in
+# insertion order (matching created_at) and FTS5 can walk its doclists in rowid
+# order and stop at the LIMIT rather than sorting every match.
+SEARCH_SORTS = {
+    'Most Recent': ('weather_queries_fts.rowid', 'DESC'),
+    'Oldest': ('weather_queries_fts.rowid', 'ASC'),
+}
+
+
+def fts_match_expression(search_term):
+    """Turn free text into an FTS5 query that prefix-matches every word"""
+    words = re.findall(r'\w+', search_term or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def build_query_page_sql(columns, sort='Most Recent', search=None, cursor=None, limit=25):
+    """Build a keyset-paginated listing over weather_queries (aliased q).
+    
+    The sort key is appended as a trailing sort_key column; cursor is the
+    (sort_key, id) of the last row already seen. Returns (sql, params).
+    """
+    match = fts_match_expression(search)
+    if sort == 'Best Match' and not match:
+        sort = 'Most Recent'
+    # The rowid keys are unique on their own and need no id tie-breaker
+    unique_key = bool(match) and sort in SEARCH_SORTS
+    key, direction = SEARCH_SORTS[sort] if unique_key else QUERY_SORTS[sort]
+    op = '>' if direction == 'ASC' else '<'
+    
+    sql = f"SELECT {columns}, {key} AS sort_key FROM weather_queries q"
+    where = []
+    params = []
+    if match:
+        sql += " JOIN weather_queries_fts ON weather_queries_fts.rowid = q.id"
+        where.append("weather_queries_fts MATCH ?")
+        params.append(match)
+    if cursor is not None and unique_key:
+        where.append(f"{key} {op} ?")
+        params.append(cursor[1])
+    elif cursor is not None:
+        # Expanded form of (key, id) > (?, ?) so the planner can seek on the index
+        where.append(f"{key} {op}= ? AND ({key} {op} ? OR q.id {op} ?)")
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if unique_key:
+        sql += f" ORDER BY {key} {direction} LIMIT ?"
+    else:
+        sql += f" ORDER BY {key} {direction}, q.id {direction} LIMIT ?"
+    params.append(limit)
+    return sql, params
+
+
+# Fixed queries that must keep using an index: name -> (sql, params, expected index).
+# SQL built at runtime is checked where it is built, in test_query_plans.
+INDEXED_QUERIES = {
+    # 'INDEX 2:' is an R*Tree search constrained on the coordinates, not a full scan
+    'queries_by_location': ('''SELECT id FROM weather_queries_rtree
+                               WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?''',
+                            (48.86, 48.85, 2.36, 2.34), 'weather_queries_rtree VIRTUAL TABLE INDEX 2:'),
+    'locations_near': ('''SELECT id FROM saved_locations_rtree
+                          WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?''',
+                       (48.86, 48.85, 2.36, 2.34), 'saved_locations_rtree VIRTUAL TABLE INDEX 2:'),
+    'alerts_for_location': ('''SELECT id FROM weather_alerts
+                               WHERE location_id = ? AND is_active = 1
+                               ORDER BY created_at DESC''', (1,),
+                            'idx_weather_alerts_location_active'),
+    'forecast_points_for_location': ('''SELECT dt, temp FROM forecast_points
+                                        WHERE location_key = ? AND dt >= ? AND dt < ?
+                                        ORDER BY dt''', ('paris', 0, 2000000000),
+                                     'idx_forecast_points_location_dt'),
+    'locations_by_name': ('''SELECT id FROM saved_locations ORDER BY name''', (),
+                          'idx_saved_locations_name'),
+}
+
+
+def check_query_plans(db_name='weather_app.db'):
+    """Return {name: plan} for INDEXED_QUERIES entries that miss their index or sort in a temp b-tree"""
+    ensure_schema(db_name)
+    problems = {}
+    with connection(db_name) as conn:
+        for name, (sql, params, index) in INDEXED_QUERIES.items():
+            plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            if not any(index in step for step in plan) or any('TEMP B-TREE' in step for step in plan):
+                problems[name] = plan
+    return problems
+
+
+@instrument_methods
 class WeatherDB:
     def __init__(self, db_name='weather_app.db'):
         self.db_name = db_name
@@ -9,51 +543,7 @@ class WeatherDB:
     
     def _initialize_db(self):
         """Initialize database tables if they don't exist"""
-        with sqlite3.connect(self.db_name) as conn:
-            c = conn.cursor()
-            
-            # Main weather queries table
-            c.execute('''CREATE TABLE IF NOT EXISTS weather_queries
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                          location TEXT,
-                          latitude REAL,
-                          longitude REAL,
-                          query_date TEXT,
-                          date_from TEXT,
-                          date_to TEXT,
-                          weather_data TEXT,
-                          notes TEXT,
-                          tags TEXT,
-                          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-            
-            # User preferences table
-            c.execute('''CREATE TABLE IF NOT EXISTS user_preferences
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                          temperature_unit TEXT DEFAULT 'celsius',
-                          wind_speed_unit TEXT DEFAULT 'm/s',
-                          pressure_unit TEXT DEFAULT 'hPa',
-                          theme TEXT DEFAULT 'light')''')
-            
-            # Locations table for quick access
-            c.execute('''CREATE TABLE IF NOT EXISTS saved_locations
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                          name TEXT,
-                          address TEXT,
-                          latitude REAL,
-                          longitude REAL,
-                          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-            
-            # Weather alerts table
-            c.execute('''CREATE TABLE IF NOT EXISTS weather_alerts
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                          location_id INTEGER,
-                          alert_type TEXT,
-                          threshold_value REAL,
-                          is_active INTEGER DEFAULT 1,
-                          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                          FOREIGN KEY(location_id) REFERENCES saved_locations(id))''')
-            
-            conn.commit()
+        ensure_schema(self.db_name)
     
     def save_weather_query(self, location, lat, lon, query_date=None, 
                           date_from=None, date_to=None, weather_data=None, 
@@ -62,64 +552,154 @@ class WeatherDB:
         if query_date is None:
             query_date = str(datetime.now().date())
         
-        with sqlite3.connect(self.db_name) as conn:
+        payload, payload_format = encode_payload(weather_data)
+        summary = summarize_weather_data(weather_data, payload)
+        with connection(self.db_name) as conn:
             c = conn.cursor()
-            c.execute('''INSERT INTO weather_queries 
-                         (location, latitude, longitude, query_date, date_from, date_to, 
-                          weather_data, notes, tags)
-                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            c.execute(f'''INSERT INTO weather_queries 
+                          (location, latitude, longitude, query_date, date_from, date_to, 
+                           weather_data, payload_format, notes, tags, {', '.join(SUMMARY_FIELDS)})
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                       (location, lat, lon, query_date, date_from, date_to, 
-                       json.dumps(weather_data), notes, tags))
+                       payload, payload_format, notes, tags) + summary)
+            query_id = c.lastrowid
+            write_points(c, query_id, location, weather_data)
             conn.commit()
-            return c.lastrowid
+            return query_id
     
-    def get_all_queries(self, limit=100, offset=0):
-        """Get all saved weather queries with pagination"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+    def save_weather_queries(self, queries, chunk_size=BULK_CHUNK_SIZE, on_chunk=None):
+        """Save many weather queries; returns their ids in input order.
+        
+        queries yields dicts with save_weather_query's argument names, or
+        tuples in the same order. Rows go in with executemany, one transaction
+        per chunk_size rows. on_chunk(cursor, ids), if given, runs inside each
+        chunk's transaction, e.g. to record a checkpoint atomically.
+        """
+        fields = ('location', 'lat', 'lon', 'query_date', 'date_from', 'date_to',
+                  'weather_data', 'notes', 'tags')
+        today = str(datetime.now().date())
+        ids = []
+        for chunk in chunked(queries, chunk_size):
+            rows = []
+            points = []
+            for item in chunk:
+                location, lat, lon, query_date, date_from, date_to, weather_data, notes, tags = \
+                    _as_args(item, fields)
+                payload, payload_format = encode_payload(weather_data)
+                rows.append((location, lat, lon, query_date or today, date_from, date_to,
+                             payload, payload_format, notes, tags)
+                            + summarize_weather_data(weather_data, payload))
+                points.append((location, weather_data))
+            
+            with connection(self.db_name) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                c = conn.cursor()
+                c.executemany(f'''INSERT INTO weather_queries 
+                                  (location, latitude, longitude, query_date, date_from, date_to, 
+                                   weather_data, payload_format, notes, tags, {', '.join(SUMMARY_FIELDS)})
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+                chunk_ids = _inserted_ids(c, len(rows))
+                c.executemany(f'''INSERT OR REPLACE INTO forecast_points ({', '.join(POINT_COLUMNS)})
+                                  VALUES ({', '.join('?' * len(POINT_COLUMNS))})''',
+                              (row for query_id, (location, weather_data) in zip(chunk_ids, points)
+                               for row in point_rows(query_id, location, weather_data)))
+                if on_chunk:
+                    on_chunk(c, chunk_ids)
+            ids.extend(chunk_ids)
+        return ids
+    
+    def get_all_queries(self, limit=100, cursor=None):
+        """Get saved weather queries newest first with keyset pagination.
+        
+        cursor is the (created_at, id) of the last row already seen; pass the
+        last row's values to fetch the next page.
+        """
+        with connection(self.db_name) as conn:
             c = conn.cursor()
-            c.execute('''SELECT * FROM weather_queries 
-                          ORDER BY created_at DESC 
-                          LIMIT ? OFFSET ?''', (limit, offset))
+            c.row_factory = sqlite3.Row
+            if cursor is None:
+                c.execute(f'''SELECT {LIST_COLUMNS} FROM weather_queries q
+                              ORDER BY created_at DESC, id DESC 
+                              LIMIT ?''', (limit,))
+            else:
+                c.execute(f'''SELECT {LIST_COLUMNS} FROM weather_queries q
+                              WHERE (created_at, id) < (?, ?)
+                              ORDER BY created_at DESC, id DESC 
+                              LIMIT ?''', (cursor[0], cursor[1], limit))
             return [dict(row) for row in c.fetchall()]
     
     def get_query_by_id(self, query_id):
         """Get a specific weather query by ID"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+        with connection(self.db_name) as conn:
             c = conn.cursor()
+            c.row_factory = sqlite3.Row
             c.execute('''SELECT * FROM weather_queries WHERE id = ?''', (query_id,))
             row = c.fetchone()
-            return dict(row) if row else None
+            if not row:
+                return None
+            query = dict(row)
+            # Callers get JSON text back whatever format the row is stored in
+            query['weather_data'] = decode_payload_text(query['weather_data'], query.pop('payload_format'))
+            return query
     
     def update_query(self, query_id, **kwargs):
         """Update a weather query with the provided fields"""
         if not kwargs:
             return False
         
+        weather_data = None
+        if 'weather_data' in kwargs:
+            weather_data = kwargs['weather_data']
+            if isinstance(weather_data, str):
+                weather_data = json.loads(weather_data)
+            kwargs['weather_data'], kwargs['payload_format'] = encode_payload(weather_data)
+            kwargs.update(zip(SUMMARY_FIELDS, summarize_weather_data(weather_data, kwargs['weather_data'])))
+        
         set_clause = ', '.join(f"{key} = ?" for key in kwargs.keys())
         values = list(kwargs.values())
         values.append(query_id)
         
-        with sqlite3.connect(self.db_name) as conn:
+        with connection(self.db_name) as conn:
             c = conn.cursor()
             c.execute(f'''UPDATE weather_queries 
                           SET {set_clause}
                           WHERE id = ?''', values)
+            updated = c.rowcount > 0
+            if updated and 'weather_data' in kwargs:
+                location = kwargs.get('location')
+                if location is None:
+                    c.execute('''SELECT location FROM weather_queries WHERE id = ?''', (query_id,))
+                    location = c.fetchone()[0]
+                write_points(c, query_id, location, weather_data)
+            elif updated and 'location' in kwargs:
+                c.execute('''UPDATE forecast_points SET location_key = ? WHERE query_id = ?''',
+                          (location_key(kwargs['location']), query_id))
             conn.commit()
-            return c.rowcount > 0
+            return updated
     
     def delete_query(self, query_id):
         """Delete a weather query by ID"""
-        with sqlite3.connect(self.db_name) as conn:
+        with connection(self.db_name) as conn:
             c = conn.cursor()
             c.execute('''DELETE FROM weather_queries WHERE id = ?''', (query_id,))
             conn.commit()
             return c.rowcount > 0
     
+    def delete_queries(self, query_ids, chunk_size=BULK_CHUNK_SIZE):
+        """Delete many weather queries by ID; returns how many rows were removed"""
+        deleted = 0
+        for chunk in chunked(query_ids, chunk_size):
+            with connection(self.db_name) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                c = conn.cursor()
+                c.executemany('''DELETE FROM weather_queries WHERE id = ?''',
+                              [(query_id,) for query_id in chunk])
+                deleted += c.rowcount
+        return deleted
+    
     def save_location(self, name, address, lat, lon):
         """Save a location to the database"""
-        with sqlite3.connect(self.db_name) as conn:
+        with connection(self.db_name) as conn:
             c = conn.cursor()
             c.execute('''INSERT INTO saved_locations 
                          (name, address, latitude, longitude)
@@ -128,26 +708,40 @@ class WeatherDB:
             conn.commit()
             return c.lastrowid
     
+    def save_locations(self, locations, chunk_size=BULK_CHUNK_SIZE):
+        """Save many locations from dicts or (name, address, lat, lon) tuples; returns their ids"""
+        ids = []
+        for chunk in chunked(locations, chunk_size):
+            rows = [_as_args(item, ('name', 'address', 'lat', 'lon')) for item in chunk]
+            with connection(self.db_name) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                c = conn.cursor()
+                c.executemany('''INSERT INTO saved_locations 
+                                 (name, address, latitude, longitude)
+                                 VALUES (?, ?, ?, ?)''', rows)
+                ids.extend(_inserted_ids(c, len(rows)))
+        return ids
+    
     def get_all_locations(self):
         """Get all saved locations"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+        with connection(self.db_name) as conn:
             c = conn.cursor()
+            c.row_factory = sqlite3.Row
             c.execute('''SELECT * FROM saved_locations ORDER BY name''')
             return [dict(row) for row in c.fetchall()]
     
     def get_location_by_id(self, location_id):
         """Get a specific location by ID"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+        with connection(self.db_name) as conn:
             c = conn.cursor()
+            c.row_factory = sqlite3.Row
             c.execute('''SELECT * FROM saved_locations WHERE id = ?''', (location_id,))
             row = c.fetchone()
             return dict(row) if row else None
     
     def delete_location(self, location_id):
         """Delete a location by ID"""
-        with sqlite3.connect(self.db_name) as conn:
+        with connection(self.db_name) as conn:
             c = conn.cursor()
             c.execute('''DELETE FROM saved_locations WHERE id = ?''', (location_id,))
             conn.commit()
@@ -155,9 +749,9 @@ class WeatherDB:
     
     def get_user_preferences(self):
         """Get user preferences"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+        with connection(self.db_name) as conn:
             c = conn.cursor()
+            c.row_factory = sqlite3.Row
             c.execute('''SELECT * FROM user_preferences LIMIT 1''')
             row = c.fetchone()
             if row:
@@ -186,7 +780,7 @@ class WeatherDB:
             return False
         
         # First clear existing preferences
-        with sqlite3.connect(self.db_name) as conn:
+        with connection(self.db_name) as conn:
             c = conn.cursor()
             c.execute('''DELETE FROM user_preferences''')
             
@@ -203,7 +797,7 @@ class WeatherDB:
     
     def add_weather_alert(self, location_id, alert_type, threshold_value):
         """Add a weather alert for a location"""
-        with sqlite3.connect(self.db_name) as conn:
+        with connection(self.db_name) as conn:
             c = conn.cursor()
             c.execute('''INSERT INTO weather_alerts 
                          (location_id, alert_type, threshold_value)
@@ -212,11 +806,25 @@ class WeatherDB:
             conn.commit()
             return c.lastrowid
     
+    def add_weather_alerts(self, alerts, chunk_size=BULK_CHUNK_SIZE):
+        """Add many alerts from dicts or (location_id, alert_type, threshold_value) tuples; returns their ids"""
+        ids = []
+        for chunk in chunked(alerts, chunk_size):
+            rows = [_as_args(item, ('location_id', 'alert_type', 'threshold_value')) for item in chunk]
+            with connection(self.db_name) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                c = conn.cursor()
+                c.executemany('''INSERT INTO weather_alerts 
+                                 (location_id, alert_type, threshold_value)
+                                 VALUES (?, ?, ?)''', rows)
+                ids.extend(_inserted_ids(c, len(rows)))
+        return ids
+    
     def get_alerts_for_location(self, location_id):
         """Get all alerts for a specific location"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+        with connection(self.db_name) as conn:
             c = conn.cursor()
+            c.row_factory = sqlite3.Row
             c.execute('''SELECT * FROM weather_alerts 
                           WHERE location_id = ? AND is_active = 1
                           ORDER BY created_at DESC''', (location_id,))
@@ -224,7 +832,7 @@ class WeatherDB:
     
     def update_alert_status(self, alert_id, is_active):
         """Update the active status of an alert"""
-        with sqlite3.connect(self.db_name) as conn:
+        with connection(self.db_name) as conn:
             c = conn.cursor()
             c.execute('''UPDATE weather_alerts 
                          SET is_active = ?
@@ -232,54 +840,105 @@ class WeatherDB:
             conn.commit()
             return c.rowcount > 0
     
+    def get_forecast_points(self, location, start=None, end=None):
+        """Saved per-timestep values for a location across all queries, ordered by time.
+        
+        start and end are epoch seconds (end exclusive); either may be omitted.
+        """
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            c.row_factory = sqlite3.Row
+            c.execute('''SELECT * FROM forecast_points
+                         WHERE location_key = ? AND dt >= ? AND dt < ?
+                         ORDER BY dt, query_id''',
+                      (location_key(location), start if start is not None else 0,
+                       end if end is not None else 2 ** 62))
+            return [dict(row) for row in c.fetchall()]
+    
+    def get_alert_events(self, location_id=None, limit=50):
+        """Get the most recent fired/cleared alert transitions, optionally for one location"""
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            c.row_factory = sqlite3.Row
+            if location_id is None:
+                c.execute('''SELECT e.*, a.alert_type FROM weather_alert_events e
+                             JOIN weather_alerts a ON a.id = e.alert_id
+                             ORDER BY e.id DESC LIMIT ?''', (limit,))
+            else:
+                c.execute('''SELECT e.*, a.alert_type FROM weather_alert_events e
+                             JOIN weather_alerts a ON a.id = e.alert_id
+                             WHERE e.location_id = ?
+                             ORDER BY e.observed_at DESC LIMIT ?''', (location_id, limit))
+            return [dict(row) for row in c.fetchall()]
+    
     def delete_alert(self, alert_id):
         """Delete a weather alert"""
-        with sqlite3.connect(self.db_name) as conn:
+        with connection(self.db_name) as conn:
             c = conn.cursor()
             c.execute('''DELETE FROM weather_alerts WHERE id = ?''', (alert_id,))
             conn.commit()
             return c.rowcount > 0
     
-    def search_queries(self, search_term, limit=50):
-        """Search weather queries by location or tags"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+    def search_queries(self, search_term, limit=50, sort='Best Match', cursor=None):
+        """Search weather queries by location, tags or notes (prefix match on each word)"""
+        if not fts_match_expression(search_term):
+            return []
+        
+        sql, params = build_query_page_sql(LIST_COLUMNS, sort, search_term, cursor, limit)
+        with connection(self.db_name) as conn:
             c = conn.cursor()
-            c.execute('''SELECT * FROM weather_queries 
-                          WHERE location LIKE ? OR tags LIKE ?
-                          ORDER BY created_at DESC
-                          LIMIT ?''', 
-                      (f'%{search_term}%', f'%{search_term}%', limit))
-            return [dict(row) for row in c.fetchall()]
+            c.row_factory = sqlite3.Row
+            c.execute(sql, params)
+            # sort_key is only there to build cursors
+            return [{key: row[key] for key in row.keys() if key != 'sort_key'} for row in c.fetchall()]
     
     def get_queries_by_date_range(self, start_date, end_date):
         """Get queries created within a date range"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+        with connection(self.db_name) as conn:
             c = conn.cursor()
-            c.execute('''SELECT * FROM weather_queries 
-                          WHERE date(created_at) BETWEEN ? AND ?
+            c.row_factory = sqlite3.Row
+            c.execute(f'''SELECT {LIST_COLUMNS} FROM weather_queries q
+                          WHERE created_at >= ? AND created_at < date(?, '+1 day')
                           ORDER BY created_at DESC''', 
                       (start_date, end_date))
             return [dict(row) for row in c.fetchall()]
     
-    def get_queries_by_location(self, location_id):
-        """Get queries for a specific saved location"""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+    def get_queries_by_location(self, location_id, radius_km=LOCATION_MATCH_RADIUS_KM):
+        """Get queries saved within radius_km of a saved location, newest first"""
+        with connection(self.db_name) as conn:
             c = conn.cursor()
-            
-            # First get the location coordinates
             c.execute('''SELECT latitude, longitude FROM saved_locations 
                           WHERE id = ?''', (location_id,))
             loc = c.fetchone()
-            if not loc:
+            if not loc or loc[0] is None or loc[1] is None:
                 return []
-            
-            # Then find queries with matching coordinates
-            c.execute('''SELECT * FROM weather_queries 
-                          WHERE ROUND(latitude, 4) = ROUND(?, 4)
-                          AND ROUND(longitude, 4) = ROUND(?, 4)
-                          ORDER BY created_at DESC''', 
-                      (loc['latitude'], loc['longitude']))
-            return [dict(row) for row in c.fetchall()]
\ No newline at end of file
+        return self.find_queries_near(loc[0], loc[1], radius_km)
+    
+    def find_queries_near(self, lat, lon, radius_km=LOCATION_MATCH_RADIUS_KM, limit=None):
+        """Get queries saved within radius_km of a point, newest first, each with distance_km"""
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            if limit:
+                return recent_within_radius(c, 'weather_queries', LIST_COLUMNS, lat, lon, radius_km, limit,
+                                            alias='q')
+            matches = within_radius(c, 'weather_queries', lat, lon, radius_km)
+            rows = rows_by_distance(c, 'weather_queries', LIST_COLUMNS, matches, alias='q')
+        rows.sort(key=lambda row: (row['created_at'], row['id']), reverse=True)
+        return rows[:limit] if limit else rows
+    
+    def find_locations_near(self, lat, lon, radius_km, limit=None):
+        """Get saved locations within radius_km of a point, nearest first, each with distance_km"""
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            matches = within_radius(c, 'saved_locations', lat, lon, radius_km)
+            return rows_by_distance(c, 'saved_locations', 't.*', matches[:limit] if limit else matches)
+    
+    def nearest_locations(self, lat, lon, k=1, max_radius_km=None):
+        """Get the k saved locations nearest a point, each with distance_km"""
+        with connection(self.db_name) as conn:
+            c = conn.cursor()
+            if max_radius_km is None:
+                matches = nearest(c, 'saved_locations', lat, lon, k)
+            else:
+                matches = nearest(c, 'saved_locations', lat, lon, k, max_radius_km)
+            return rows_by_distance(c, 'saved_locations', 't.*', matches)
@@ -0,0 +1,195 @@
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Path served by each provider's stub -> endpoint name; the name also picks
+# a recorded payload file (<name>.json) when a payload directory is given
+STUB_ROUTES = {
+    'geoapify': {'/v1/geocode/search': 'geocode'},
+    'openweather': {
+        '/data/2.5/weather': 'current_weather',
+        '/data/2.5/forecast': 'forecast',
+        '/data/2.5/air_pollution': 'air_quality',
+    },
+    'timezonedb': {'/v2.1/get-time-zone': 'timezone'},
+}
+
+# Environment variable that points the app at each provider
+BASE_URL_VARIABLES = {
+    'geoapify': 'GEOAPIFY_BASE_URL',
+    'openweather': 'OPENWEATHER_BASE_URL',
+    'timezonedb': 'TIMEZONEDB_BASE_URL',
+}
+
+
+def sample_forecast(timesteps=40, start=1760000000):
+    """A forecast payload shaped like OpenWeather's 5-day/3-hour response"""
+    conditions = [(800, 'Clear', '01d'), (803, 'Clouds', '04d'), (500, 'Rain', '10d')]
+    items = []
+    for index in range(timesteps):
+        condition_id, main, icon = random.choice(conditions)
+        items.append({
+            'dt': start + index * 3 * 60 * 60,
+            'main': {'temp': round(random.uniform(5, 25), 2), 'feels_like': round(random.uniform(3, 25), 2),
+                     'humidity': random.randint(30, 95), 'pressure': random.randint(995, 1030)},
+            'weather': [{'id': condition_id, 'main': main, 'description': main.lower(), 'icon': icon}],
+            'wind': {'speed': round(random.uniform(0, 12), 2), 'deg': random.randint(0, 359)},
+            'clouds': {'all': random.randint(0, 100)},
+        })
+    return {'cod': '200', 'cnt': timesteps, 'list': items, 'city': {'name': 'Bench'}}
+
+
+def sample_payload(endpoint, params):
+    """A synthetic response for an endpoint, echoing the requested coordinates"""
+    lat = float(params.get('lat', 48.8566))
+    lon = float(params.get('lon', params.get('lng', 2.3522)))
+    if endpoint == 'geocode':
+        text = params.get('text', 'Bench')
+        # Spread locations out deterministically so each text geocodes somewhere different
+        seed = sum(map(ord, text))
+        return {'features': [{'properties': {
+            'lat': 48.8566 + (seed % 1000) / 1000, 'lon': 2.3522 + (seed % 997) / 1000,
+            'city': text, 'country': 'Benchland', 'formatted': f"{text}, Benchland",
+            'timezone': {'name': 'Europe/Paris'},
+        }}]}
+    if endpoint == 'current_weather':
+        return {'coord': {'lat': lat, 'lon': lon},
+                'weather': [{'id': 800, 'main': 'Clear', 'description': 'clear sky', 'icon': '01d'}],
+                'main': {'temp': 18.4, 'feels_like': 17.9, 'temp_min': 16.1, 'temp_max': 20.3,
+                         'pressure': 1016, 'humidity': 61},
+                'visibility': 10000, 'wind': {'speed': 3.6, 'deg': 240}, 'clouds': {'all': 0},
+                'dt': 1760000000, 'sys': {'sunrise': 1759989600, 'sunset': 1760031000},
+                'name': 'Bench', 'cod': 200}
+    if endpoint == 'forecast':
+        return sample_forecast()
+    if endpoint == 'air_quality':
+        return {'coord': {'lat': lat, 'lon': lon}, 'list': [{
+            'main': {'aqi': 2}, 'dt': 1760000000,
+            'components': {'co': 230.3, 'no': 0.1, 'no2': 12.9, 'o3': 61.5, 'so2': 1.2,
+                           'pm2_5': 6.4, 'pm10': 9.8, 'nh3': 0.9}}]}
+    if endpoint == 'timezone':
+        return {'status': 'OK', 'countryCode': 'BL', 'zoneName': 'Europe/Paris', 'abbreviation': 'CEST',
+                'gmtOffset': 7200, 'dst': '1', 'formatted': '2025-10-09 12:00:00'}
+    return {}
+
+
+class StubServer:
+    """Local HTTP server standing in for one API provider.
+
+    Each request waits latency seconds (plus up to jitter more), then fails
+    with a 500 at error_rate, is rate limited with a 429 at rate_limit_rate,
+    or returns the endpoint's payload: a recorded <endpoint>.json from
+    payload_dir when one exists, a synthetic one otherwise.
+    """
+
+    def __init__(self, provider, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, payload_dir=None, seed=None):
+        self.provider = provider
+        self.routes = STUB_ROUTES[provider]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.recorded = {}
+        for endpoint in self.routes.values():
+            path = os.path.join(payload_dir, f"{endpoint}.json") if payload_dir else None
+            if path and os.path.exists(path):
+                with open(path, encoding='utf-8') as recorded:
+                    self.recorded[endpoint] = recorded.read().encode('utf-8')
+        self.random = random.Random(seed)
+        self.counts = {'requests': 0, 'errors': 0, 'rate_limited': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _outcome(self):
+        """(delay, status) for the next request"""
+        with self._lock:
+            self.counts['requests'] += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+            roll = self.random.random()
+            if roll < self.error_rate:
+                self.counts['errors'] += 1
+                return delay, 500
+            if roll < self.error_rate + self.rate_limit_rate:
+                self.counts['rate_limited'] += 1
+                return delay, 429
+            return delay, 200
+
+    def _body(self, endpoint, params):
+        if endpoint in self.recorded:
+            return self.recorded[endpoint]
+        return json.dumps(sample_payload(endpoint, params)).encode('utf-8')
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this, delayed ACKs
+            # add ~40 ms to every keep-alive response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                endpoint = stub.routes.get(parsed.path)
+                delay, status = stub._outcome()
+                if delay:
+                    time.sleep(delay)
+                if endpoint is None:
+                    status = 404
+                if status == 200:
+                    params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                    body = stub._body(endpoint, params)
+                else:
+                    body = json.dumps({'cod': status, 'message': 'stub error'}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429:
+                    self.send_header('Retry-After', str(stub.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True,
+                                        name=f"stub-{self.provider}")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def start_stubs(**settings):
+    """Start a StubServer per provider and point the app's base URL variables at them.
+
+    settings are passed to every StubServer. Returns {provider: server}.
+    Set the variables before weather_app is imported, as it reads them once.
+    """
+    servers = {provider: StubServer(provider, **settings).start() for provider in STUB_ROUTES}
+    for provider, server in servers.items():
+        os.environ[BASE_URL_VARIABLES[provider]] = server.url
+    return servers
+
+
+def stop_stubs(servers):
+    for server in servers.values():
+        server.stop()
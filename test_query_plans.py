@@ -0,0 +1,114 @@
+"""Query plans for the SQL the app actually builds, checked against a fresh database"""
+from contextlib import contextmanager
+
+import pytest
+
+from alert_engine import AlertEngine
+from spatial_index import recent_within_radius
+from sqlite3_utils import (LIST_COLUMNS, QUERY_SORTS, WeatherDB, build_query_page_sql,
+                           check_query_plans, connection)
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'plans.db')
+    WeatherDB(db_name)
+    return db_name
+
+
+def query_plan(db_name, sql, params=()):
+    with connection(db_name) as conn:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+@contextmanager
+def traced(db_name):
+    """Collect the statements run on db_name, with their parameters expanded.
+
+    Single-threaded callers get the same pooled connection back each time,
+    so tracing the one idle connection sees everything they run.
+    """
+    statements = []
+    with connection(db_name) as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        yield statements
+    finally:
+        with connection(db_name) as conn:
+            conn.set_trace_callback(None)
+
+
+def traced_select(statements, table):
+    selects = [sql for sql in statements if sql.lstrip().startswith('SELECT') and table in sql]
+    assert selects, f"no SELECT on {table} was run"
+    return selects[0]
+
+
+PAGE_INDEXES = {
+    'Most Recent': 'idx_weather_queries_created',
+    'Oldest': 'idx_weather_queries_created',
+    'Location A-Z': 'idx_weather_queries_location',
+    'Location Z-A': 'idx_weather_queries_location',
+    # Without a search term Best Match falls back to Most Recent
+    'Best Match': 'idx_weather_queries_created',
+}
+
+
+@pytest.mark.parametrize('cursor', [None, ('2024-01-01 00:00:00', 10)])
+@pytest.mark.parametrize('sort', list(QUERY_SORTS))
+def test_query_page_walks_index(db_name, sort, cursor):
+    plan = query_plan(db_name, *build_query_page_sql(LIST_COLUMNS, sort, cursor=cursor))
+    assert any(PAGE_INDEXES[sort] in step for step in plan), plan
+    assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+@pytest.mark.parametrize('cursor', [None, ('2024-01-01 00:00:00', 10)])
+@pytest.mark.parametrize('sort', list(QUERY_SORTS))
+def test_search_page_drives_from_fts(db_name, sort, cursor):
+    plan = query_plan(db_name, *build_query_page_sql(LIST_COLUMNS, sort, search='paris rain', cursor=cursor))
+    assert any('weather_queries_fts VIRTUAL TABLE' in step for step in plan), plan
+    assert any('SEARCH q USING INTEGER PRIMARY KEY' in step for step in plan), plan
+    if sort in ('Most Recent', 'Oldest'):
+        # FTS5 hands back matches in rowid order, so time sorts never sort the matches
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_date_range_uses_created_index(db_name):
+    with traced(db_name) as statements:
+        WeatherDB(db_name).get_queries_by_date_range('2024-01-01', '2024-01-31')
+    plan = query_plan(db_name, traced_select(statements, 'weather_queries'))
+    assert any('idx_weather_queries_created' in step for step in plan), plan
+    assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_recent_within_radius_searches_rtree(db_name):
+    with traced(db_name) as statements:
+        with connection(db_name) as conn:
+            recent_within_radius(conn.cursor(), 'weather_queries', LIST_COLUMNS, 48.85, 2.35, 25, 10,
+                                 alias='q')
+    plan = query_plan(db_name, traced_select(statements, 'weather_queries_rtree'))
+    # 'INDEX 2:' is an R*Tree search constrained on the coordinates, not a full scan
+    assert any('weather_queries_rtree VIRTUAL TABLE INDEX 2:' in step for step in plan), plan
+    assert any('SEARCH q USING INTEGER PRIMARY KEY' in step for step in plan), plan
+
+
+def test_recent_within_radius_across_antimeridian(db_name):
+    with traced(db_name) as statements:
+        with connection(db_name) as conn:
+            recent_within_radius(conn.cursor(), 'weather_queries', LIST_COLUMNS, 0.0, 179.99, 50, 10,
+                                 alias='q')
+    plan = query_plan(db_name, traced_select(statements, 'weather_queries_rtree'))
+    rtree_searches = [step for step in plan if 'weather_queries_rtree VIRTUAL TABLE INDEX 2:' in step]
+    assert len(rtree_searches) == 2, plan
+
+
+def test_alert_engine_reads_active_alerts_by_location(db_name):
+    with traced(db_name) as statements:
+        AlertEngine(db_name).evaluate({1: {'main': {'temp': 20}}, 2: {'main': {'temp': 25}}})
+    plan = query_plan(db_name, traced_select(statements, 'weather_alerts'))
+    assert any('idx_weather_alerts_location_active' in step for step in plan), plan
+    assert not any('SCAN a' == step.strip() for step in plan), plan
+
+
+def test_indexed_queries(db_name):
+    assert check_query_plans(db_name) == {}
@@ -0,0 +1,25 @@
+"""Cold start of weather_app.py in a fresh interpreter, held to the benchmark's budgets"""
+import pytest
+
+from benchmark import STARTUP_BUDGETS, bench_startup
+
+# The modules only some pages need; none should load at import or on the default page
+LAZY_MODULES = ('numpy', 'pandas', 'pyarrow', 'folium')
+
+
+@pytest.fixture(scope='module')
+def startup(tmp_path_factory):
+    return bench_startup(runs=3, workdir=str(tmp_path_factory.mktemp('startup')))
+
+
+def test_import_within_budget(startup):
+    assert startup['import_ms'] <= STARTUP_BUDGETS['import_ms'], startup
+
+
+def test_no_heavy_modules_at_import(startup):
+    assert not set(LAZY_MODULES) & set(startup['loaded_at_import']), startup
+
+
+def test_default_page_renders_without_heavy_modules(startup):
+    assert startup['errors'] == 0, startup
+    assert not set(LAZY_MODULES) & set(startup['loaded_after_render']), startup
@@ -0,0 +1,135 @@
+from response_cache import TTLCache
+
+# OpenWeather is queried with units=metric, so payloads hold °C, m/s and hPa.
+# Each unit maps to (label, scale, offset): displayed = value * scale + offset
+TEMPERATURE_UNITS = {
+    'celsius': ('°C', 1.0, 0.0),
+    'fahrenheit': ('°F', 1.8, 32.0),
+    'kelvin': ('K', 1.0, 273.15),
+}
+
+WIND_SPEED_UNITS = {
+    'm/s': ('m/s', 1.0, 0.0),
+    'km/h': ('km/h', 3.6, 0.0),
+    'mph': ('mph', 3600 / 1609.344, 0.0),
+    'knots': ('kn', 3600 / 1852, 0.0),
+}
+
+PRESSURE_UNITS = {
+    'hPa': ('hPa', 1.0, 0.0),
+    'mmHg': ('mmHg', 100 / 133.322387415, 0.0),
+    'inHg': ('inHg', 100 / 3386.389, 0.0),
+    'atm': ('atm', 1 / 1013.25, 0.0),
+}
+
+# Preference key -> (unit table, ForecastFrame columns it converts)
+UNIT_PREFERENCES = {
+    'temperature_unit': (TEMPERATURE_UNITS, ('temp', 'feels_like')),
+    'wind_speed_unit': (WIND_SPEED_UNITS, ('wind_speed',)),
+    'pressure_unit': (PRESSURE_UNITS, ('pressure',)),
+}
+
+METRIC_UNITS = ('celsius', 'm/s', 'hPa')
+
+# Decimal places shown per label where one isn't enough
+DISPLAY_DIGITS = {'inHg': 2, 'atm': 3, '%': 0}
+
+# Converted frames per (payload, units), most recently used kept
+display_cache = TTLCache(max_entries=64)
+
+
+def units_key(preferences):
+    """(temperature, wind speed, pressure) units from a preferences dict, unknown ones as metric"""
+    if not preferences:
+        return METRIC_UNITS
+    return tuple(
+        preferences.get(name) if preferences.get(name) in table else default
+        for (name, (table, _)), default in zip(UNIT_PREFERENCES.items(), METRIC_UNITS)
+    )
+
+
+def labels(units):
+    """{'temperature': '°F', 'wind_speed': 'mph', 'pressure': 'hPa'} for a units key"""
+    return {
+        'temperature': TEMPERATURE_UNITS[units[0]][0],
+        'wind_speed': WIND_SPEED_UNITS[units[1]][0],
+        'pressure': PRESSURE_UNITS[units[2]][0],
+    }
+
+
+def convert(values, table, unit):
+    """Convert a metric value or array of values (None/NaN stay NaN) to unit"""
+    import numpy as np
+
+    _, scale, offset = table[unit]
+    values = np.asarray(values, dtype=float)
+    if scale == 1.0 and offset == 0.0:
+        return values
+    return values * scale + offset
+
+
+def convert_frame(frame, units):
+    """Copy of a ForecastFrame with temperature, wind and pressure columns in units"""
+    if units == METRIC_UNITS:
+        return frame
+    columns = {}
+    for unit, (table, names) in zip(units, UNIT_PREFERENCES.values()):
+        for name in names:
+            columns[name] = convert(frame[name], table, unit)
+    return frame.with_columns(columns)
+
+
+def converted_frame(weather_data, units):
+    """ForecastFrame for a payload in units, memoized per (payload object, units).
+
+    Responses served from the response cache are the same objects on every
+    rerun, so revisiting a page reuses the frame instead of rebuilding it.
+    """
+    from forecast_frame import ForecastFrame
+
+    key = (id(weather_data), units)
+    cached = display_cache.get(key)
+    # The payload is kept in the entry so its id can't be reused while cached
+    if cached is not None and cached[0] is weather_data:
+        return cached[1]
+    frame = convert_frame(ForecastFrame.from_payload(weather_data), units)
+    display_cache.set(key, (weather_data, frame), size=1)
+    return frame
+
+
+def current_values(weather, units):
+    """Display values for a current-weather payload, converted to units.
+
+    Reads OpenWeather's nested main/wind/clouds sections, or flat keys
+    ('temp', 'wind_speed', ...); missing values come back as NaN.
+    """
+    main = weather.get('main') if isinstance(weather.get('main'), dict) else weather
+    wind = weather.get('wind') if isinstance(weather.get('wind'), dict) else {}
+    clouds = weather.get('clouds')
+    temps = convert([main.get('temp'), main.get('feels_like'), main.get('temp_min'), main.get('temp_max')],
+                    TEMPERATURE_UNITS, units[0])
+    return {
+        'temp': temps[0], 'feels_like': temps[1], 'temp_min': temps[2], 'temp_max': temps[3],
+        'humidity': float(main['humidity']) if main.get('humidity') is not None else float('nan'),
+        'pressure': float(convert(main.get('pressure'), PRESSURE_UNITS, units[2])),
+        'wind_speed': float(convert(wind.get('speed', weather.get('wind_speed')), WIND_SPEED_UNITS, units[1])),
+        'wind_deg': wind.get('deg', weather.get('wind_deg')),
+        'visibility': weather.get('visibility'),
+        'clouds': clouds.get('all') if isinstance(clouds, dict) else clouds,
+    }
+
+
+def format_value(value, label='', digits=None):
+    """'12.3°C' / '4.0 m/s' / '0.998 atm', or 'N/A' for missing values"""
+    if value is None or value != value:
+        return 'N/A'
+    if digits is None:
+        digits = DISPLAY_DIGITS.get(label, 1)
+    separator = '' if not label or label.startswith('°') or label == '%' else ' '
+    return f"{value:.{digits}f}{separator}{label}"
+
+
+def format_temperature(value, units):
+    """A metric temperature (e.g. a stored summary value) formatted in units"""
+    return format_value(None if value is None else float(convert(value, TEMPERATURE_UNITS, units[0])),
+                        TEMPERATURE_UNITS[units[0]][0])
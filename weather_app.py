@@ -1,17 +1,25 @@
 import streamlit as st
 import requests
-import pandas as pd
 import datetime
-import sqlite3
-import json
-import csv
 import os
-from io import StringIO
-import pytemperature
-import folium
-from streamlit_folium import folium_static
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+import tempfile
+
+from http_client import get_client, fetch_concurrently, fetch_many
+from instrumentation import (instrument_db, start_metrics_server, summarize, HTTP_DURATION, HTTP_RETRIES,
+                             CACHE_LOOKUPS, DB_DURATION, DB_ROWS_RETURNED, DB_ROWS_CHANGED)
+from response_cache import cached_by_coordinates, set_fetch_listener, set_snapshot_store
+from refresh_scheduler import SnapshotStore, mark_locations_viewed, start_in_process, alert_hook, observation_hook
+from geocode_cache import get_geocode_cache
+from forecast_points import write_points
+from map_render import show_map_html, location_map_html, markers_map_html, overview_map_html
+from exporter import (EXPORT_FORMATS, EXPORT_MIME_TYPES, iter_export, iter_queries_export,
+                      write_export)
+from payload_codec import encode_payload, decode_payload
+from sqlite3_utils import (connection, ensure_schema, build_query_page_sql, summarize_weather_data,
+                           SUMMARY_FIELDS, SUMMARY_ASSIGNMENTS, LIST_COLUMNS, LOCATION_MATCH_RADIUS_KM)
+from spatial_index import nearest, recent_within_radius, rows_by_distance
+from units import (TEMPERATURE_UNITS, WIND_SPEED_UNITS, PRESSURE_UNITS, units_key, labels,
+                   convert, converted_frame, current_values, format_value, format_temperature)
 
 
 from dotenv import load_dotenv
@@ -23,48 +31,27 @@ WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
 GEOAPIFY_API_KEY = os.getenv("GEOAPIFY_API_KEY")
 TIMEZONE_API_KEY = os.getenv("TIMEZONE_API_KEY")
 
+# API hosts; benchmark.py points these at local stubs (see stub_api.py)
+GEOAPIFY_BASE_URL = os.getenv("GEOAPIFY_BASE_URL", "https://api.geoapify.com")
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org")
+TIMEZONEDB_BASE_URL = os.getenv("TIMEZONEDB_BASE_URL", "http://api.timezonedb.com")
+
+DB_NAME = os.getenv("WEATHER_APP_DB", 'weather_app.db')
+
 # Database setup
 def init_db():
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    
-    # Main weather queries table
-    c.execute('''CREATE TABLE IF NOT EXISTS weather_queries
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  location TEXT,
-                  latitude REAL,
-                  longitude REAL,
-                  query_date TEXT,
-                  date_from TEXT,
-                  date_to TEXT,
-                  weather_data TEXT,
-                  notes TEXT,
-                  tags TEXT,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
-    # User preferences table
-    c.execute('''CREATE TABLE IF NOT EXISTS user_preferences
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  temperature_unit TEXT DEFAULT 'celsius',
-                  wind_speed_unit TEXT DEFAULT 'm/s',
-                  pressure_unit TEXT DEFAULT 'hPa',
-                  theme TEXT DEFAULT 'light')''')
-    
-    # Locations table for quick access
-    c.execute('''CREATE TABLE IF NOT EXISTS saved_locations
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  name TEXT,
-                  address TEXT,
-                  latitude REAL,
-                  longitude REAL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
-    conn.commit()
-    conn.close()
+    ensure_schema(DB_NAME)
 
 # Initialize database
 init_db()
 
+# Shared across reruns so the in-memory tier keeps its entries
+geocode_cache = get_geocode_cache(DB_NAME)
+
+# Forecasts with more timesteps than this render as one table per day plus a
+# chart instead of a row of widgets per timestep
+COMPACT_FORECAST_THRESHOLD = int(os.getenv("COMPACT_FORECAST_THRESHOLD", 16))
+
 # Weather icons mapping
 WEATHER_ICONS = {
     "01d": "☀️", "01n": "🌙",
@@ -79,159 +66,344 @@ WEATHER_ICONS = {
 }
 
 # Helper functions
-def get_coordinates(location):
-    """Convert location string to coordinates using Geoapify (free tier)"""
-    url = f"https://api.geoapify.com/v1/geocode/search?text={location}&apiKey={GEOAPIFY_API_KEY}"
+def get_coordinates(location, cache=None):
+    """Convert location string to coordinates using Geoapify (free tier).
+    
+    cache defaults to the app's GeocodeCache; pass another to geocode
+    against a different database's cache.
+    """
+    cache = cache or geocode_cache
+    cached = cache.get(location)
+    if cached:
+        return cached
+    
+    url = f"{GEOAPIFY_BASE_URL}/v1/geocode/search"
     try:
-        response = requests.get(url)
+        response = get_client().get('geoapify', url, params={'text': location, 'apiKey': GEOAPIFY_API_KEY},
+                                    endpoint='geocode')
         if response.status_code == 200:
             data = response.json()
             if data['features']:
                 feature = data['features'][0]
+                cache.set(location, feature['properties']['lat'], feature['properties']['lon'], feature['properties'])
                 return feature['properties']['lat'], feature['properties']['lon'], feature['properties']
         return None, None, None
-    except (GeocoderTimedOut, GeocoderServiceError, requests.exceptions.RequestException):
+    except requests.exceptions.RequestException:
         return None, None, None
 
+@cached_by_coordinates('current_weather')
 def get_current_weather(lat, lon):
     """Get current weather data from OpenWeather API (free tier)"""
-    url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric"
+    url = f"{OPENWEATHER_BASE_URL}/data/2.5/weather"
     try:
-        response = requests.get(url)
+        response = get_client().get('openweather', url, params={'lat': lat, 'lon': lon, 'appid': WEATHER_API_KEY, 'units': 'metric'},
+                                    endpoint='current_weather')
         if response.status_code == 200:
             return response.json()
         return None
     except requests.exceptions.RequestException:
         return None
 
+@cached_by_coordinates('forecast')
 def get_forecast(lat, lon):
     """Get 5-day forecast from OpenWeather API (free tier)"""
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric"
+    url = f"{OPENWEATHER_BASE_URL}/data/2.5/forecast"
     try:
-        response = requests.get(url)
+        response = get_client().get('openweather', url, params={'lat': lat, 'lon': lon, 'appid': WEATHER_API_KEY, 'units': 'metric'},
+                                    endpoint='forecast')
         if response.status_code == 200:
             return response.json()
         return None
     except requests.exceptions.RequestException:
         return None
 
+@cached_by_coordinates('timezone')
 def get_timezone_info(lat, lon):
     """Get timezone information from TimezoneDB (free tier)"""
-    url = f"http://api.timezonedb.com/v2.1/get-time-zone?key={TIMEZONE_API_KEY}&format=json&by=position&lat={lat}&lng={lon}"
+    url = f"{TIMEZONEDB_BASE_URL}/v2.1/get-time-zone"
     try:
-        response = requests.get(url)
+        response = get_client().get('timezonedb', url, params={'key': TIMEZONE_API_KEY, 'format': 'json', 'by': 'position', 'lat': lat, 'lng': lon},
+                                    endpoint='timezone')
         if response.status_code == 200:
             return response.json()
         return None
     except requests.exceptions.RequestException:
         return None
 
+@cached_by_coordinates('air_quality')
 def get_air_quality(lat, lon):
     """Get air quality data from OpenWeather (free tier)"""
-    url = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}"
+    url = f"{OPENWEATHER_BASE_URL}/data/2.5/air_pollution"
     try:
-        response = requests.get(url)
+        response = get_client().get('openweather', url, params={'lat': lat, 'lon': lon, 'appid': WEATHER_API_KEY},
+                                    endpoint='air_quality')
         if response.status_code == 200:
             return response.json()
         return None
     except requests.exceptions.RequestException:
         return None
 
+def get_current_conditions(lat, lon, deadline=None):
+    """Fetch current weather, air quality and timezone concurrently.
+
+    Returns (weather_data, air_quality_data, timezone_data); any provider that
+    is slow or down comes back as None instead of holding up the others.
+    """
+    results = fetch_concurrently({
+        'weather': (get_current_weather, (lat, lon)),
+        'air_quality': (get_air_quality, (lat, lon)),
+        'timezone': (get_timezone_info, (lat, lon)),
+    }, deadline)
+    return results['weather'], results['air_quality'], results['timezone']
+
+# Serve warm data written by the background refresh scheduler; set
+# REFRESH_IN_PROCESS=1 to run the scheduler inside the app process as well
+set_snapshot_store(SnapshotStore(DB_NAME))
+# Check weather alerts for nearby saved locations on every fresh fetch; the
+# scheduler fetches uncached and runs its own check after each cycle
+set_fetch_listener(observation_hook(DB_NAME))
+if os.getenv("REFRESH_IN_PROCESS") == "1":
+    start_in_process({
+        'current_weather': get_current_weather.uncached,
+        'forecast': get_forecast.uncached,
+        'air_quality': get_air_quality.uncached,
+    }, DB_NAME, on_refresh=alert_hook(DB_NAME))
+
+# Prometheus text at http://127.0.0.1:$METRICS_PORT/metrics when METRICS_PORT is set
+if os.getenv("METRICS_PORT"):
+    start_metrics_server()
+
+def get_weather_for_locations(locations, max_workers=None):
+    """Fetch current weather for many (lat, lon) pairs concurrently, in input order"""
+    return fetch_many(get_current_weather, [(lat, lon) for lat, lon in locations], max_workers)
+
+@instrument_db()
 def save_to_db(location, lat, lon, query_date, date_from, date_to, weather_data, notes="", tags=""):
     """Save weather query to database with additional fields"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO weather_queries 
-                 (location, latitude, longitude, query_date, date_from, date_to, weather_data, notes, tags)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-              (location, lat, lon, query_date, date_from, date_to, json.dumps(weather_data), notes, tags))
-    conn.commit()
-    conn.close()
-
-def get_all_queries():
-    """Get all saved weather queries from database"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    c.execute('''SELECT id, location, latitude, longitude, query_date, date_from, date_to, 
-                 notes, tags, created_at FROM weather_queries ORDER BY created_at DESC''')
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    payload, payload_format = encode_payload(weather_data)
+    summary = summarize_weather_data(weather_data, payload)
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute(f'''INSERT INTO weather_queries 
+                      (location, latitude, longitude, query_date, date_from, date_to, weather_data, payload_format,
+                       notes, tags, {', '.join(SUMMARY_FIELDS)})
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (location, lat, lon, query_date, date_from, date_to, payload, payload_format, notes, tags) + summary)
+        write_points(c, c.lastrowid, location, weather_data)
+
+@instrument_db()
+def has_saved_queries():
+    """Check whether any weather queries have been saved"""
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute('''SELECT EXISTS(SELECT 1 FROM weather_queries)''')
+        return bool(c.fetchone()[0])
+
+@instrument_db()
+def get_queries_page(page_size=25, cursor=None, sort="Most Recent", search=None):
+    """Get one page of saved queries, searched and sorted in SQL with keyset pagination.
+
+    cursor is the (sort key, id) of the last row on the previous page.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    sql, params = build_query_page_sql(LIST_COLUMNS, sort, search, cursor, page_size + 1)
+    
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute(sql, params)
+        rows = c.fetchall()
+    
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1][-1], rows[-1][0])
+    return [row[:-1] for row in rows], next_cursor
 
+@instrument_db()
 def get_query_by_id(query_id):
-    """Get specific weather query by ID"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    c.execute('''SELECT * FROM weather_queries WHERE id = ?''', (query_id,))
-    row = c.fetchone()
-    conn.close()
-    return row
+    """Get specific weather query by ID, with weather_data decoded"""
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute('''SELECT id, location, latitude, longitude, query_date, date_from, date_to,
+                     weather_data, notes, tags, created_at, payload_format
+                     FROM weather_queries WHERE id = ?''', (query_id,))
+        row = c.fetchone()
+    if not row:
+        return None
+    return row[:7] + (decode_payload(row[7], row[11]),) + row[8:11]
 
+@instrument_db()
 def update_query_in_db(query_id, location, lat, lon, date_from, date_to, weather_data, notes, tags):
     """Update weather query in database"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    c.execute('''UPDATE weather_queries 
-                 SET location = ?, latitude = ?, longitude = ?, date_from = ?, date_to = ?, 
-                     weather_data = ?, notes = ?, tags = ?
-                 WHERE id = ?''',
-              (location, lat, lon, date_from, date_to, json.dumps(weather_data), notes, tags, query_id))
-    conn.commit()
-    conn.close()
+    payload, payload_format = encode_payload(weather_data)
+    summary = summarize_weather_data(weather_data, payload)
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute(f'''UPDATE weather_queries 
+                      SET location = ?, latitude = ?, longitude = ?, date_from = ?, date_to = ?, 
+                          weather_data = ?, payload_format = ?, notes = ?, tags = ?, {SUMMARY_ASSIGNMENTS}
+                      WHERE id = ?''',
+                  (location, lat, lon, date_from, date_to, payload, payload_format, notes, tags)
+                  + summary + (query_id,))
+        if c.rowcount:
+            write_points(c, query_id, location, weather_data)
 
+@instrument_db()
 def delete_query_from_db(query_id):
     """Delete weather query from database"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    c.execute('''DELETE FROM weather_queries WHERE id = ?''', (query_id,))
-    conn.commit()
-    conn.close()
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute('''DELETE FROM weather_queries WHERE id = ?''', (query_id,))
 
+@instrument_db()
 def save_location_to_db(name, address, lat, lon):
     """Save a location to the database for quick access"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO saved_locations 
-                 (name, address, latitude, longitude)
-                 VALUES (?, ?, ?, ?)''',
-              (name, address, lat, lon))
-    conn.commit()
-    conn.close()
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute('''INSERT INTO saved_locations 
+                     (name, address, latitude, longitude)
+                     VALUES (?, ?, ?, ?)''',
+                  (name, address, lat, lon))
 
+@instrument_db()
 def get_saved_locations():
     """Get all saved locations from database"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    c.execute('''SELECT id, name, address, latitude, longitude FROM saved_locations ORDER BY name''')
-    rows = c.fetchall()
-    conn.close()
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute('''SELECT id, name, address, latitude, longitude, created_at FROM saved_locations ORDER BY name''')
+        rows = c.fetchall()
     return rows
 
-def display_weather(weather_data, air_quality_data=None):
-    """Display weather data in a user-friendly format with more details"""
+@instrument_db()
+def get_nearest_saved_location(lat, lon, max_radius_km=50):
+    """Closest saved location within max_radius_km as a dict with distance_km, or None"""
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        rows = rows_by_distance(c, 'saved_locations', 't.id, t.name, t.address',
+                                nearest(c, 'saved_locations', lat, lon, 1, max_radius_km))
+    return rows[0] if rows else None
+
+@instrument_db()
+def get_query_history_near(lat, lon, radius_km=LOCATION_MATCH_RADIUS_KM, limit=10):
+    """Most recent saved queries within radius_km of a point, each with distance_km"""
+    if lat is None or lon is None:
+        return []
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        return recent_within_radius(c, 'weather_queries', LIST_COLUMNS, lat, lon, radius_km, limit, alias='q')
+
+def display_query_history(rows):
+    """One markdown list of past queries near a location"""
+    units = get_display_units()
+    lines = []
+    for row in rows:
+        summary = format_temperature(row['temp_mean'], units) if row['temp_mean'] is not None else "no temperature"
+        if row['dominant_condition']:
+            summary += f", {row['dominant_condition']}"
+        lines.append(f"- {row['created_at']} — {row['location']}: {summary} "
+                     f"({row['distance_km'] * 1000:.0f} m away)")
+    st.markdown("\n".join(lines))
+
+@instrument_db()
+def delete_location_from_db(location_id):
+    """Delete a saved location from database"""
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute('''DELETE FROM saved_locations WHERE id = ?''', (location_id,))
+
+def forecast_chart_spec(temperature_label='°C'):
+    """Temperature lines on the left axis, humidity (dashed) on the right.
+    
+    A static vega-lite spec avoids rebuilding an Altair chart on every rerun.
+    """
+    return {
+        'encoding': {'x': {'field': 'Time', 'type': 'temporal', 'title': None}},
+        'layer': [
+            {'transform': [{'fold': ['Temp', 'Feels like'], 'as': ['Series', temperature_label]}],
+             'mark': 'line',
+             'encoding': {'y': {'field': temperature_label, 'type': 'quantitative'},
+                          'color': {'field': 'Series', 'type': 'nominal', 'title': None}}},
+            {'mark': {'type': 'line', 'strokeDash': [4, 3], 'color': '#888'},
+             'encoding': {'y': {'field': 'Humidity', 'type': 'quantitative', 'title': 'Humidity %'}}},
+        ],
+        'resolve': {'scale': {'y': 'independent'}},
+    }
+
+def forecast_table_columns(unit_labels):
+    """Column headers for the compact forecast table, in the display units"""
+    return {
+        'time': 'Time', 'condition': 'Conditions',
+        'temp': f"Temp ({unit_labels['temperature']})", 'feels_like': f"Feels like ({unit_labels['temperature']})",
+        'humidity': 'Humidity (%)', 'pressure': f"Pressure ({unit_labels['pressure']})",
+        'wind_speed': f"Wind ({unit_labels['wind_speed']})",
+        'rain': 'Rain (mm/3h)', 'snow': 'Snow (mm/3h)',
+    }
+
+def _arrow_table(df):
+    """Arrow table without the pandas schema metadata, roughly halving each dataframe delta"""
+    import pyarrow as pa
+    
+    return pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+
+def display_forecast_compact(frame, stats, unit_labels):
+    """Render a forecast (already in display units) as one line chart and one dataframe per day"""
+    import pandas as pd
+    
+    temp_label = unit_labels['temperature']
+    chart = pd.DataFrame({'Time': pd.to_datetime(frame.local), 'Temp': frame['temp'],
+                          'Feels like': frame['feels_like'], 'Humidity': frame['humidity']})
+    st.vega_lite_chart(chart, forecast_chart_spec(temp_label), width='stretch')
+    
+    table = frame.to_table()
+    table['condition'] = [f"{WEATHER_ICONS.get(icon, '☁️')} {condition}"
+                          for icon, condition in zip(frame.icon, frame.condition)]
+    table = table.drop(columns='date').dropna(axis=1, how='all').rename(
+        columns=forecast_table_columns(unit_labels))
+    
+    for index, (date, start, stop) in enumerate(frame.day_bounds()):
+        temp_range = ""
+        if stats['count'][index]:
+            temp_range = (f" ({format_value(stats['min'][index], temp_label)} to "
+                          f"{format_value(stats['max'][index], temp_label)})")
+        with st.expander(f"**{date}** - {stop - start} forecasts{temp_range}"):
+            st.dataframe(_arrow_table(table.iloc[start:stop]), hide_index=True, width='stretch')
+
+def display_weather(weather_data, air_quality_data=None, compact=None, units=None):
+    """Display weather data in a user-friendly format with more details.
+    
+    Values are shown in units (a units_key tuple), by default the session's
+    preferences. compact renders forecasts as tables and a chart; by default
+    it is used once a forecast has more than COMPACT_FORECAST_THRESHOLD timesteps.
+    """
     if not weather_data:
         st.error("No weather data available")
         return
     
+    units = units or get_display_units()
+    unit_labels = labels(units)
+    
     if 'current' in weather_data:  # Current weather format
         weather = weather_data['current']
+        values = current_values(weather, units)
+        temp_label = unit_labels['temperature']
         st.subheader("Current Weather Details")
         
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("Temperature", f"{weather['temp']}°C")
-            st.metric("Feels Like", f"{weather['feels_like']}°C")
-            st.metric("Min/Max Temp", f"{weather.get('temp_min', 'N/A')}°C / {weather.get('temp_max', 'N/A')}°C")
+            st.metric("Temperature", format_value(values['temp'], temp_label))
+            st.metric("Feels Like", format_value(values['feels_like'], temp_label))
+            st.metric("Min/Max Temp", f"{format_value(values['temp_min'], temp_label)} / "
+                                      f"{format_value(values['temp_max'], temp_label)}")
         
         with col2:
-            st.metric("Humidity", f"{weather['humidity']}%")
-            st.metric("Pressure", f"{weather['pressure']} hPa")
-            st.metric("Visibility", f"{weather.get('visibility', 'N/A')} meters")
+            st.metric("Humidity", format_value(values['humidity'], '%'))
+            st.metric("Pressure", format_value(values['pressure'], unit_labels['pressure']))
+            st.metric("Visibility", f"{values['visibility'] if values['visibility'] is not None else 'N/A'} meters")
         
         with col3:
-            st.metric("Wind Speed", f"{weather['wind_speed']} m/s")
-            st.metric("Wind Direction", f"{weather.get('wind_deg', 'N/A')}°")
-            st.metric("Cloud Cover", f"{weather.get('clouds', 'N/A')}%")
+            st.metric("Wind Speed", format_value(values['wind_speed'], unit_labels['wind_speed']))
+            st.metric("Wind Direction", f"{values['wind_deg'] if values['wind_deg'] is not None else 'N/A'}°")
+            st.metric("Cloud Cover", f"{values['clouds'] if values['clouds'] is not None else 'N/A'}%")
         
         st.write(f"**Weather Conditions:** {weather['weather'][0]['main']} - {weather['weather'][0]['description'].capitalize()}")
         
@@ -273,18 +445,24 @@ def display_weather(weather_data, air_quality_data=None):
     else:  # Forecast format
         st.subheader("Detailed Weather Forecast")
         
-        # Group forecast by day
-        forecast_by_day = {}
-        for item in weather_data['list']:
-            date = datetime.datetime.fromtimestamp(item['dt']).strftime('%Y-%m-%d')
-            if date not in forecast_by_day:
-                forecast_by_day[date] = []
-            forecast_by_day[date].append(item)
+        # Group forecast by day, converted to the display units in one pass
+        frame = converted_frame(weather_data, units)
+        stats = frame.daily_stats('temp')
+        temp_label, wind_label = unit_labels['temperature'], unit_labels['wind_speed']
+        if compact is None:
+            compact = len(frame) > COMPACT_FORECAST_THRESHOLD
+        if compact:
+            display_forecast_compact(frame, stats, unit_labels)
+            return
         
-        for date, day_forecasts in forecast_by_day.items():
-            with st.expander(f"**{date}** - {len(day_forecasts)} forecasts"):
-                for item in day_forecasts:
-                    time = datetime.datetime.fromtimestamp(item['dt']).strftime('%H:%M')
+        for index, (date, day) in enumerate(frame.days()):
+            temp_range = ""
+            if stats['count'][index]:
+                temp_range = (f" ({format_value(stats['min'][index], temp_label)} to "
+                              f"{format_value(stats['max'][index], temp_label)})")
+            with st.expander(f"**{date}** - {len(day)} forecasts{temp_range}"):
+                for item, time, temp, feels_like, humidity, wind_speed in zip(
+                        day.items, day.times(), day['temp'], day['feels_like'], day['humidity'], day['wind_speed']):
                     weather_icon = WEATHER_ICONS.get(item['weather'][0]['icon'], "☁️")
                     
                     col1, col2, col3 = st.columns([1,2,3])
@@ -293,8 +471,10 @@ def display_weather(weather_data, air_quality_data=None):
                     with col2:
                         st.write(f"{weather_icon} {item['weather'][0]['main']}")
                     with col3:
-                        st.write(f"Temp: {item['main']['temp']}°C (Feels like {item['main']['feels_like']}°C)")
-                        st.write(f"Humidity: {item['main']['humidity']}%, Wind: {item['wind']['speed']} m/s")
+                        st.write(f"Temp: {format_value(temp, temp_label)} "
+                                 f"(Feels like {format_value(feels_like, temp_label)})")
+                        st.write(f"Humidity: {format_value(humidity, '%')}, "
+                                 f"Wind: {format_value(wind_speed, wind_label)}")
                         if 'rain' in item:
                             st.write(f"Rain: {item['rain'].get('3h', 'N/A')}mm")
                         if 'snow' in item:
@@ -303,34 +483,7 @@ def display_weather(weather_data, air_quality_data=None):
 def display_location_map(lat, lon, properties=None):
     """Display a map of the location with more details"""
     if lat and lon:
-        m = folium.Map(location=[lat, lon], zoom_start=12)
-        folium.Marker(
-            [lat, lon],
-            popup=f"Lat: {lat}, Lon: {lon}",
-            tooltip="Weather Location"
-        ).add_to(m)
-        
-        # Add more map features if properties are available
-        if properties:
-            if 'city' in properties:
-                folium.CircleMarker(
-                    location=[lat, lon],
-                    radius=5,
-                    popup=f"{properties.get('city', 'Location')}",
-                    color='blue',
-                    fill=True,
-                    fill_color='blue'
-                ).add_to(m)
-            
-            if 'country' in properties:
-                folium.Marker(
-                    [lat, lon],
-                    icon=folium.DivIcon(
-                        html=f"""<div style="font-size: 12pt; color: black">{properties.get('country', '')}</div>"""
-                    )
-                ).add_to(m)
-        
-        folium_static(m)
+        show_map_html(location_map_html(lat, lon, properties))
         
         # Display additional location information if available
         if properties:
@@ -358,6 +511,15 @@ def display_location_map(lat, lon, properties=None):
                 if 'formatted' in properties:
                     st.write(f"**Full Address:** {properties['formatted']}")
 
+def local_time(timezone_data):
+    """Current local time from the zone's gmtOffset, so a cached response still reads the right time"""
+    try:
+        offset = datetime.timedelta(seconds=int(timezone_data['gmtOffset']))
+    except (KeyError, TypeError, ValueError):
+        return 'N/A'
+    now = datetime.datetime.now(datetime.timezone.utc) + offset
+    return now.strftime('%Y-%m-%d %H:%M:%S')
+
 def display_timezone_info(timezone_data):
     """Display timezone information"""
     if not timezone_data:
@@ -370,67 +532,53 @@ def display_timezone_info(timezone_data):
         st.write(f"**Abbreviation:** {timezone_data.get('abbreviation', 'N/A')}")
     with cols[1]:
         st.write(f"**GMT Offset:** {timezone_data.get('gmtOffset', 'N/A')} seconds")
-        st.write(f"**Current Time:** {timezone_data.get('formatted', 'N/A')}")
+        st.write(f"**Current Time:** {local_time(timezone_data)}")
     with cols[2]:
         st.write(f"**DST:** {'Yes' if timezone_data.get('dst', '0') == '1' else 'No'}")
         st.write(f"**Country Code:** {timezone_data.get('countryCode', 'N/A')}")
 
+def display_metrics_panel():
+    """Sidebar tables of this process's API, cache and database metrics"""
+    import pandas as pd
+    
+    def ms(value):
+        return round(value, 1) if value is not None else None
+    
+    http_rows = [{'Provider': provider, 'Endpoint': endpoint, 'Status': status, 'Calls': stats['count'],
+                  'p50 ms': ms(stats['p50_ms']), 'p95 ms': ms(stats['p95_ms'])}
+                 for (provider, endpoint, status), stats in sorted(summarize(HTTP_DURATION).items())]
+    retries = sum(HTTP_RETRIES.samples().values())
+    st.sidebar.caption(f"Upstream calls ({retries} retries)")
+    if http_rows:
+        st.sidebar.dataframe(pd.DataFrame(http_rows), hide_index=True)
+    
+    cache = {}
+    for (endpoint, outcome), count in CACHE_LOOKUPS.samples().items():
+        cache.setdefault(endpoint, {'Endpoint': endpoint, 'hits': 0, 'warm_hits': 0, 'misses': 0})[outcome] = count
+    st.sidebar.caption("Cache lookups")
+    if cache:
+        st.sidebar.dataframe(pd.DataFrame(sorted(cache.values(), key=lambda row: row['Endpoint'])), hide_index=True)
+    
+    returned, changed = DB_ROWS_RETURNED.samples(), DB_ROWS_CHANGED.samples()
+    db_rows = [{'Operation': operation, 'Calls': stats['count'], 'p50 ms': ms(stats['p50_ms']),
+                'p95 ms': ms(stats['p95_ms']), 'Rows': returned.get((operation,), 0),
+                'Changed': changed.get((operation,), 0)}
+               for (operation,), stats in sorted(summarize(DB_DURATION).items())]
+    st.sidebar.caption("Database operations")
+    if db_rows:
+        st.sidebar.dataframe(pd.DataFrame(db_rows), hide_index=True)
+
 def export_data(data, format_type):
     """Export data in different formats with more comprehensive data handling"""
-    if format_type == 'JSON':
-        return json.dumps(data, indent=2)
-    elif format_type == 'CSV':
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        if isinstance(data, list):
-            if data and isinstance(data[0], dict):
-                # Handle list of dictionaries
-                writer.writerow(data[0].keys())  # header
-                for row in data:
-                    writer.writerow(row.values())
-            else:
-                # Handle simple list
-                writer.writerow(["Value"])
-                for item in data:
-                    writer.writerow([item])
-        elif isinstance(data, dict):
-            # Handle single dictionary
-            writer.writerow(data.keys())
-            writer.writerow(data.values())
-        else:
-            # Handle simple value
-            writer.writerow(["Value"])
-            writer.writerow([data])
-            
-        return output.getvalue()
-    elif format_type == 'XML':
-        def dict_to_xml(tag, d):
-            elem = f'<{tag}>'
-            if isinstance(d, dict):
-                for key, val in d.items():
-                    elem += dict_to_xml(key, val)
-            elif isinstance(d, list):
-                for item in d:
-                    elem += dict_to_xml('item', item)
-            else:
-                elem += str(d)
-            elem += f'</{tag}>'
-            return elem
-        
-        if isinstance(data, (dict, list)):
-            return dict_to_xml('data', data)
-        else:
-            return f'<data>{data}</data>'
-    return str(data)
+    return ''.join(iter_export(data, format_type))
 
+@instrument_db()
 def get_user_preferences():
     """Get user preferences from database"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
-    c.execute('''SELECT * FROM user_preferences LIMIT 1''')
-    row = c.fetchone()
-    conn.close()
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
+        c.execute('''SELECT * FROM user_preferences LIMIT 1''')
+        row = c.fetchone()
     
     if row:
         return {
@@ -448,23 +596,33 @@ def get_user_preferences():
             'theme': 'light'
         }
 
+def get_session_preferences():
+    """User preferences, read from the database once per session"""
+    if 'preferences' not in st.session_state:
+        st.session_state['preferences'] = get_user_preferences()
+    return st.session_state['preferences']
+
+def get_display_units():
+    """(temperature, wind speed, pressure) units to display in, from the session's preferences"""
+    return units_key(get_session_preferences())
+
+@instrument_db()
 def save_user_preferences(preferences):
-    """Save user preferences to database"""
-    conn = sqlite3.connect('weather_app.db')
-    c = conn.cursor()
+    """Save user preferences to database and refresh this session's copy"""
+    with connection(DB_NAME) as conn:
+        c = conn.cursor()
     
-    # Clear existing preferences
-    c.execute('''DELETE FROM user_preferences''')
+        # Clear existing preferences
+        c.execute('''DELETE FROM user_preferences''')
     
-    # Insert new preferences
-    c.execute('''INSERT INTO user_preferences 
-                 (temperature_unit, wind_speed_unit, pressure_unit, theme)
-                 VALUES (?, ?, ?, ?)''',
-              (preferences['temperature_unit'], preferences['wind_speed_unit'], 
-               preferences['pressure_unit'], preferences['theme']))
+        # Insert new preferences
+        c.execute('''INSERT INTO user_preferences 
+                     (temperature_unit, wind_speed_unit, pressure_unit, theme)
+                     VALUES (?, ?, ?, ?)''',
+                  (preferences['temperature_unit'], preferences['wind_speed_unit'], 
+                   preferences['pressure_unit'], preferences['theme']))
+    st.session_state['preferences'] = dict(preferences)
     
-    conn.commit()
-    conn.close()
 
 # Streamlit app
 def main():
@@ -498,33 +656,35 @@ def main():
         "Settings"
     ]
     choice = st.sidebar.selectbox("Menu", menu)
+    show_metrics = st.sidebar.checkbox("Show performance metrics")
     
     # Settings page
     if choice == "Settings":
         st.header("User Settings")
         
         # Get current preferences
-        preferences = get_user_preferences()
+        preferences = get_session_preferences()
+        current_units = units_key(preferences)
         
         # Settings form
         with st.form("settings_form"):
             st.subheader("Units")
             temp_unit = st.selectbox(
                 "Temperature Unit",
-                ["celsius", "fahrenheit", "kelvin"],
-                index=["celsius", "fahrenheit", "kelvin"].index(preferences['temperature_unit'])
+                list(TEMPERATURE_UNITS),
+                index=list(TEMPERATURE_UNITS).index(current_units[0])
             )
             
             wind_unit = st.selectbox(
                 "Wind Speed Unit",
-                ["m/s", "km/h", "mph", "knots"],
-                index=["m/s", "km/h", "mph", "knots"].index(preferences['wind_speed_unit'])
+                list(WIND_SPEED_UNITS),
+                index=list(WIND_SPEED_UNITS).index(current_units[1])
             )
             
             pressure_unit = st.selectbox(
                 "Pressure Unit",
-                ["hPa", "mmHg", "inHg", "atm"],
-                index=["hPa", "mmHg", "inHg", "atm"].index(preferences['pressure_unit'])
+                list(PRESSURE_UNITS),
+                index=list(PRESSURE_UNITS).index(current_units[2])
             )
             
             st.subheader("Appearance")
@@ -564,16 +724,26 @@ def main():
                 lat, lon, properties = get_coordinates(location)
                 if lat and lon:
                     st.success(f"Location found: {properties.get('formatted', location)}")
+                    nearby = get_nearest_saved_location(lat, lon)
+                    if nearby:
+                        st.caption(f"Nearest saved location: {nearby['name']} "
+                                   f"({nearby['distance_km']:.1f} km away)")
                 else:
                     st.error("Could not determine coordinates for this location")
         
         elif input_method == "Select Saved Location":
             saved_locations = get_saved_locations()
             if saved_locations:
-                location_options = {f"{loc[1]} ({loc[2]})": (loc[3], loc[4]) for loc in saved_locations}
+                location_options = {f"{loc[1]} ({loc[2]})": loc for loc in saved_locations}
                 selected = st.selectbox("Choose a saved location:", list(location_options.keys()))
-                lat, lon = location_options[selected]
+                lat, lon = location_options[selected][3], location_options[selected][4]
+                mark_locations_viewed([location_options[selected][0]], DB_NAME)
                 properties = {'formatted': selected.split('(')[0].strip()}
+                
+                history = get_query_history_near(lat, lon)
+                if history:
+                    with st.expander(f"Previous queries here ({len(history)})"):
+                        display_query_history(history)
             else:
                 st.info("No saved locations found. Please save locations first.")
         
@@ -591,19 +761,22 @@ def main():
         # Display weather if location is set
         if lat and lon:
             with st.spinner("Fetching weather data..."):
-                weather_data = get_current_weather(lat, lon)
-                air_quality_data = get_air_quality(lat, lon)
-                timezone_data = get_timezone_info(lat, lon)
+                weather_data, air_quality_data, timezone_data = get_current_conditions(lat, lon)
                 
                 if weather_data:
                     # Display weather information
                     display_weather({"current": weather_data}, air_quality_data)
+                    if air_quality_data is None:
+                        st.warning("Air quality data is unavailable right now")
                     
                     # Display map and location info
                     display_location_map(lat, lon, properties)
                     
                     # Display timezone info
-                    display_timezone_info(timezone_data)
+                    if timezone_data:
+                        display_timezone_info(timezone_data)
+                    else:
+                        st.warning("Timezone information is unavailable right now")
                     
                     # Save to database
                     notes = st.text_area("Add notes about this weather query:", 
@@ -707,11 +880,9 @@ def main():
                         # Note: This is simulated since historical API requires paid plan
                         forecast_data = get_forecast(lat, lon)
                         if forecast_data:
-                            weather_data = []
-                            for item in forecast_data['list']:
-                                item_date = datetime.datetime.fromtimestamp(item['dt']).date()
-                                if date_from <= item_date <= date_to:
-                                    weather_data.append(item)
+                            from forecast_frame import ForecastFrame
+                            
+                            weather_data = ForecastFrame.from_payload(forecast_data).between(date_from, date_to).items
                             
                             if weather_data:
                                 st.subheader(f"Weather from {date_from} to {date_to}")
@@ -748,38 +919,38 @@ def main():
     elif choice == "Saved Queries":
         st.header("Saved Weather Queries")
         
-        queries = get_all_queries()
-        if queries:
+        if has_saved_queries():
             st.subheader("Your Saved Weather Queries")
             
             # Search and filter options
-            col1, col2 = st.columns(2)
+            col1, col2, col3 = st.columns([2,2,1])
             with col1:
-                search_term = st.text_input("Search queries by location or tags:")
+                search_term = st.text_input("Search queries by location, tags or notes:")
             with col2:
-                sort_option = st.selectbox("Sort by:", ["Most Recent", "Oldest", "Location A-Z", "Location Z-A"])
+                sort_options = ["Most Recent", "Oldest", "Location A-Z", "Location Z-A"]
+                if search_term:
+                    sort_options.insert(0, "Best Match")
+                sort_option = st.selectbox("Sort by:", sort_options)
+            with col3:
+                page_size = st.selectbox("Per page:", [10, 25, 50, 100], index=1)
             
-            # Filter and sort queries
-            filtered_queries = queries
-            if search_term:
-                filtered_queries = [
-                    q for q in queries
-                    if search_term.lower() in q[1].lower() or 
-                    (q[8] and search_term.lower() in q[8].lower())
-                ]
+            # Keyset pagination: keep the cursor that starts each visited page
+            page_key = (search_term, sort_option, page_size)
+            if st.session_state.get('query_page_key') != page_key:
+                st.session_state['query_page_key'] = page_key
+                st.session_state['query_page_cursors'] = [None]
+            page_cursors = st.session_state['query_page_cursors']
+            filtered_queries, next_cursor = get_queries_page(
+                page_size, page_cursors[-1], sort_option, search_term)
             
-            if sort_option == "Most Recent":
-                filtered_queries = sorted(filtered_queries, key=lambda x: x[9], reverse=True)
-            elif sort_option == "Oldest":
-                filtered_queries = sorted(filtered_queries, key=lambda x: x[9])
-            elif sort_option == "Location A-Z":
-                filtered_queries = sorted(filtered_queries, key=lambda x: x[1].lower())
-            elif sort_option == "Location Z-A":
-                filtered_queries = sorted(filtered_queries, key=lambda x: x[1].lower(), reverse=True)
+            if search_term and not filtered_queries:
+                st.info("No saved queries match your search.")
             
             # Display queries
+            units = get_display_units()
             for query in filtered_queries:
-                query_id, location, lat, lon, query_date, date_from, date_to, notes, tags, created_at = query
+                (query_id, location, lat, lon, query_date, date_from, date_to, notes, tags, created_at,
+                 temp_min, temp_max, temp_mean, condition, timestep_count, payload_bytes) = query
                 
                 with st.expander(f"📌 {location} - {created_at}"):
                     col1, col2, col3 = st.columns([3,1,1])
@@ -793,6 +964,11 @@ def main():
                             st.write(f"**Notes:** {notes}")
                         if tags:
                             st.write(f"**Tags:** {tags}")
+                        if temp_mean is not None:
+                            st.write(f"**Summary:** {format_temperature(temp_min, units)} to "
+                                     f"{format_temperature(temp_max, units)} "
+                                     f"(avg {format_temperature(temp_mean, units)}), "
+                                     f"mostly {condition or 'N/A'}, {timestep_count} readings")
                     
                     with col2:
                         if st.button(f"🔍 View", key=f"view_{query_id}"):
@@ -801,7 +977,37 @@ def main():
                     with col3:
                         if st.button(f"🗑️ Delete", key=f"delete_{query_id}"):
                             delete_query_from_db(query_id)
-                            st.experimental_rerun()
+                            st.rerun()
+            
+            # Page navigation
+            if len(page_cursors) > 1 or next_cursor is not None:
+                col1, col2, col3 = st.columns([1,2,1])
+                with col1:
+                    if len(page_cursors) > 1 and st.button("← Previous", key="queries_prev"):
+                        page_cursors.pop()
+                        st.rerun()
+                with col2:
+                    st.caption(f"Page {len(page_cursors)}")
+                with col3:
+                    if next_cursor is not None and st.button("Next →", key="queries_next"):
+                        page_cursors.append(next_cursor)
+                        st.rerun()
+            
+            # Bulk export of the whole history, streamed to a temp file chunk by chunk
+            with st.expander("Export all saved queries"):
+                bulk_format = st.selectbox("Export format:", EXPORT_FORMATS, key="bulk_export_format")
+                if st.button("Generate Full Export", key="bulk_export"):
+                    with st.spinner("Exporting saved queries..."):
+                        export_file = tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+                        write_export(iter_queries_export(bulk_format, DB_NAME), export_file)
+                        export_file.seek(0)
+                    st.download_button(
+                        label="Download All Queries",
+                        data=export_file,
+                        file_name=f"weather_queries.{bulk_format.lower()}",
+                        mime=EXPORT_MIME_TYPES.get(bulk_format, "text/plain"),
+                        key="bulk_export_download"
+                    )
             
             # Query details view
             if 'view_query' in st.session_state:
@@ -827,7 +1033,7 @@ def main():
                     
                     # Display weather data
                     st.subheader("Weather Data")
-                    weather_data = json.loads(query_data[7])
+                    weather_data = query_data[7]
                     if isinstance(weather_data, list):  # Date range data
                         display_weather({"list": weather_data})
                     else:  # Current or forecast data
@@ -838,14 +1044,14 @@ def main():
                     
                     # Export options
                     st.subheader("Export Data")
-                    export_format = st.selectbox("Select export format:", ["JSON", "CSV", "XML"], key="export_format")
+                    export_format = st.selectbox("Select export format:", EXPORT_FORMATS, key="export_format")
                     if st.button("Generate Export"):
                         exported = export_data(weather_data, export_format)
                         st.download_button(
                             label="Download Exported Data",
                             data=exported,
                             file_name=f"weather_data_{query_data[0]}.{export_format.lower()}",
-                            mime="text/plain"
+                            mime=EXPORT_MIME_TYPES.get(export_format, "text/plain")
                         )
                     
                     # Update functionality
@@ -881,13 +1087,10 @@ def main():
                                     # Simulate getting historical data
                                     forecast = get_forecast(new_lat, new_lon)
                                     if forecast:
-                                        new_weather_data = []
-                                        for item in forecast['list']:
-                                            item_date = datetime.datetime.fromtimestamp(item['dt']).date()
-                                            from_date = datetime.datetime.strptime(new_date_from, '%Y-%m-%d').date()
-                                            to_date = datetime.datetime.strptime(new_date_to, '%Y-%m-%d').date()
-                                            if from_date <= item_date <= to_date:
-                                                new_weather_data.append(item)
+                                        from forecast_frame import ForecastFrame
+                                        
+                                        new_weather_data = ForecastFrame.from_payload(forecast).between(
+                                            new_date_from, new_date_to).items
                                     else:
                                         new_weather_data = weather_data
                                 else:
@@ -908,7 +1111,7 @@ def main():
                                     new_tags
                                 )
                                 st.success("Query updated successfully!")
-                                st.experimental_rerun()
+                                st.rerun()
                             else:
                                 st.error("Could not fetch updated weather data")
         else:
@@ -920,6 +1123,8 @@ def main():
         
         saved_locations = get_saved_locations()
         if saved_locations:
+            import pandas as pd
+            
             st.subheader("Your Saved Locations")
             
             # Display locations in a table
@@ -937,6 +1142,52 @@ def main():
             df = pd.DataFrame(location_data)
             st.dataframe(df, use_container_width=True, hide_index=True)
             
+            # Dashboard: current conditions for every saved location at once
+            if st.checkbox("Show weather dashboard for all locations"):
+                with st.spinner(f"Fetching weather for {len(saved_locations)} locations..."):
+                    results = get_weather_for_locations([(loc[3], loc[4]) for loc in saved_locations])
+                mark_locations_viewed([loc[0] for loc in saved_locations], DB_NAME)
+                
+                # Convert each column for every location at once
+                units = get_display_units()
+                unit_labels = labels(units)
+                temps = convert([weather['main']['temp'] if weather else None for weather in results],
+                                TEMPERATURE_UNITS, units[0])
+                feels_like = convert([weather['main']['feels_like'] if weather else None for weather in results],
+                                     TEMPERATURE_UNITS, units[0])
+                wind = convert([weather['wind']['speed'] if weather else None for weather in results],
+                               WIND_SPEED_UNITS, units[1])
+                dashboard = pd.DataFrame({
+                    "Name": [loc[1] for loc in saved_locations],
+                    f"Temperature ({unit_labels['temperature']})": temps,
+                    f"Feels Like ({unit_labels['temperature']})": feels_like,
+                    "Humidity (%)": [weather['main']['humidity'] if weather else None for weather in results],
+                    f"Wind ({unit_labels['wind_speed']})": wind,
+                    "Conditions": [weather['weather'][0]['description'].capitalize() if weather else "Unavailable"
+                                   for weather in results],
+                })
+                st.dataframe(dashboard.round(1), width='stretch', hide_index=True)
+                
+                failed = sum(1 for weather in results if weather is None)
+                if failed:
+                    st.warning(f"Could not fetch weather for {failed} of {len(results)} locations")
+                
+                markers = []
+                for loc, weather, temp in zip(saved_locations, results, temps):
+                    summary = (f"{format_value(temp, unit_labels['temperature'])}, {weather['weather'][0]['description']}"
+                               if weather else "Weather unavailable")
+                    markers.append((loc[3], loc[4], f"{loc[1]}: {summary}", loc[1]))
+                show_map_html(markers_map_html(markers))
+            
+            # Overview of everything saved, aggregated in SQL and clustered on the map
+            if st.checkbox("Show map of all saved locations and queries"):
+                map_source = st.radio("Show:", ["Saved locations", "Saved queries"], horizontal=True)
+                source = 'locations' if map_source == "Saved locations" else 'queries'
+                html, cell, total = overview_map_html(source, DB_NAME)
+                show_map_html(html)
+                if cell:
+                    st.caption(f"{total} points grouped into {cell}° grid cells")
+            
             # Location actions
             st.subheader("Location Actions")
             selected_id = st.selectbox("Select a location to manage:", [loc[0] for loc in saved_locations])
@@ -945,24 +1196,28 @@ def main():
             with col1:
                 if st.button("View on Map"):
                     selected_loc = next(loc for loc in saved_locations if loc[0] == selected_id)
-                    m = folium.Map(location=[selected_loc[3], selected_loc[4]], zoom_start=12)
-                    folium.Marker(
-                        [selected_loc[3], selected_loc[4]],
-                        popup=f"{selected_loc[1]} ({selected_loc[2]})",
-                        tooltip="Saved Location"
-                    ).add_to(m)
-                    folium_static(m)
+                    show_map_html(location_map_html(selected_loc[3], selected_loc[4],
+                                                    popup=f"{selected_loc[1]} ({selected_loc[2]})",
+                                                    tooltip="Saved Location"))
             
             with col2:
                 if st.button("Delete Location"):
-                    conn = sqlite3.connect('weather_app.db')
-                    c = conn.cursor()
-                    c.execute('''DELETE FROM saved_locations WHERE id = ?''', (selected_id,))
-                    conn.commit()
-                    conn.close()
-                    st.experimental_rerun()
+                    delete_location_from_db(selected_id)
+                    st.rerun()
+            
+            selected_loc = next(loc for loc in saved_locations if loc[0] == selected_id)
+            history = get_query_history_near(selected_loc[3], selected_loc[4], limit=25)
+            with st.expander(f"Query history within {LOCATION_MATCH_RADIUS_KM:g} km ({len(history)})"):
+                if history:
+                    display_query_history(history)
+                else:
+                    st.info("No saved queries near this location yet.")
         else:
             st.info("No saved locations found. Save some locations to see them here.")
+    
+    # Rendered last so the tables include this run's calls
+    if show_metrics:
+        display_metrics_panel()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file